@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends, Request, Body, File, Uplo
 from fastapi.responses import StreamingResponse
 import asyncio
 import json
+import re
 import traceback
 from datetime import datetime, timezone
 import uuid
@@ -14,6 +15,9 @@ import os
 from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
 from services import redis
+from services import response_stream
+from services.pubsub_hub import pubsub_hub
+from mcp_service.session_pool import mcp_session_pool
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access
 from utils.logger import logger, structlog
 from services.billing import check_billing_status, can_use_model
@@ -167,7 +171,12 @@ async def cleanup():
     except Exception as e:
         logger.error(f"Failed to clean up running agent runs: {str(e)}")
 
-    # Close Redis connection
+    # Close pooled MCP sessions, the shared pubsub connection and the Redis connection
+    try:
+        await mcp_session_pool.close()
+    except Exception as e:
+        logger.error(f"Failed to close MCP sessions: {str(e)}")
+    await pubsub_hub.close()
     await redis.close()
     logger.info("Completed cleanup of agent API resources")
 
@@ -178,12 +187,10 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     final_status = "failed" if error_message else "stopped"
 
     # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
     all_responses = []
     try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
+        all_responses = await response_stream.get_responses_for_storage(agent_run_id)
+        logger.info(f"Fetched responses from Redis for DB update on stop/fail: {agent_run_id}")
     except Exception as e:
         logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
         # Try fetching from DB as a fallback? Or proceed without responses? Proceeding without for now.
@@ -197,9 +204,9 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
         logger.error(f"Failed to update database status for stopped/failed run {agent_run_id}")
 
     # Send STOP signal to the global control channel
-    global_control_channel = f"agent_run:{agent_run_id}:control"
+    global_control_channel = response_stream.control_channel(agent_run_id)
     try:
-        await redis.publish(global_control_channel, "STOP")
+        await response_stream.publish_control(agent_run_id, "STOP")
         logger.debug(f"Published STOP signal to global channel {global_control_channel}")
     except Exception as e:
         logger.error(f"Failed to publish STOP signal to global channel {global_control_channel}: {str(e)}")
@@ -620,7 +627,11 @@ async def stream_agent_run(
     token: Optional[str] = None,
     request: Request = None
 ):
-    """Stream the responses of an agent run using Redis Lists and Pub/Sub."""
+    """Stream the responses of an agent run from Redis.
+
+    Each event carries the cursor of its response as the SSE event ID, so a
+    reconnecting client that sends Last-Event-ID only receives newer responses.
+    """
     logger.info(f"Starting stream for agent run: {agent_run_id}")
     client = await db.client
 
@@ -632,175 +643,166 @@ async def stream_agent_run(
         user_id=user_id,
     )
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-    control_channel = f"agent_run:{agent_run_id}:control" # Global control channel
+    transport = response_stream.get_transport()
+    response_list_key = response_stream.response_list_key(agent_run_id)
+    response_channel = response_stream.response_channel(agent_run_id)
+    control_channel = response_stream.control_channel(agent_run_id) # Global control channel
+
+    # Resume cursor sent by EventSource on reconnect; ignore values that do not match the transport
+    last_event_id = request.headers.get('last-event-id') if request else None
+    if last_event_id:
+        valid_cursor = last_event_id.isdigit() if transport == response_stream.TRANSPORT_LIST else bool(re.fullmatch(r"\d+-\d+", last_event_id))
+        if valid_cursor:
+            logger.debug(f"Resuming stream for {agent_run_id} after event {last_event_id}")
+        else:
+            logger.warning(f"Ignoring invalid Last-Event-ID '{last_event_id}' for {agent_run_id}")
+            last_event_id = None
 
-    async def stream_generator():
-        logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
-        last_processed_index = -1
-        pubsub_response = None
-        pubsub_control = None
-        listener_task = None
-        terminate_stream = False
+    def format_event(item: Dict[str, Any]) -> str:
+        return f"id: {item['id']}\ndata: {json.dumps(item['response'])}\n\n"
+
+    def is_completion_status(response: Dict[str, Any]) -> bool:
+        return response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']
+
+    async def check_run_is_running() -> bool:
+        run_status = await client.table('agent_runs').select('status', 'thread_id').eq("id", agent_run_id).maybe_single().execute()
+        current_status = run_status.data.get('status') if run_status.data else None
+
+        if current_status != 'running':
+            logger.info(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
+            return False
+
+        structlog.contextvars.bind_contextvars(
+            thread_id=run_status.data.get('thread_id'),
+        )
+        return True
+
+    async def stream_generator_from_stream():
+        logger.debug(f"Streaming responses for {agent_run_id} using Redis stream {response_stream.response_stream_key(agent_run_id)}")
+        cursor = last_event_id
         initial_yield_complete = False
 
         try:
-            # 1. Fetch and yield initial responses from Redis list
-            initial_responses_json = await redis.lrange(response_list_key, 0, -1)
-            initial_responses = []
-            if initial_responses_json:
-                initial_responses = [json.loads(r) for r in initial_responses_json]
-                logger.debug(f"Sending {len(initial_responses)} initial responses for {agent_run_id}")
-                for response in initial_responses:
-                    yield f"data: {json.dumps(response)}\n\n"
-                last_processed_index = len(initial_responses) - 1
+            # 1. Fetch and yield responses already written after the cursor
+            initial_items = await response_stream.read_responses(agent_run_id, after=cursor)
+            logger.debug(f"Sending {len(initial_items)} initial entries for {agent_run_id}")
+            for item in initial_items:
+                cursor = item['id']
+                if 'control' in item:
+                    yield f"data: {json.dumps({'type': 'status', 'status': item['control']})}\n\n"
+                    return
+                yield format_event(item)
             initial_yield_complete = True
 
             # 2. Check run status *after* yielding initial data
-            run_status = await client.table('agent_runs').select('status', 'thread_id').eq("id", agent_run_id).maybe_single().execute()
-            current_status = run_status.data.get('status') if run_status.data else None
-
-            if current_status != 'running':
-                logger.info(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
+            if not await check_run_is_running():
                 yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
                 return
-          
-            structlog.contextvars.bind_contextvars(
-                thread_id=run_status.data.get('thread_id'),
-            )
 
-            # 3. Set up Pub/Sub listeners for new responses and control signals
-            pubsub_response = await redis.create_pubsub()
-            await pubsub_response.subscribe(response_channel)
-            logger.debug(f"Subscribed to response channel: {response_channel}")
+            # 3. Block on the stream for new entries; each read returns every entry written since the cursor
+            while True:
+                items = await response_stream.wait_for_responses(agent_run_id, cursor)
+                if not items:
+                    # Nothing arrived within the block timeout; end the stream if the worker is gone
+                    # without writing its control entry, after draining anything written meanwhile
+                    if not await check_run_is_running():
+                        for item in await response_stream.read_responses(agent_run_id, after=cursor):
+                            if 'control' in item:
+                                yield f"data: {json.dumps({'type': 'status', 'status': item['control']})}\n\n"
+                                return
+                            yield format_event(item)
+                        yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
+                        return
+                    continue
+                for item in items:
+                    cursor = item['id']
+                    if 'control' in item:
+                        logger.info(f"Received control signal '{item['control']}' for {agent_run_id}")
+                        yield f"data: {json.dumps({'type': 'status', 'status': item['control']})}\n\n"
+                        return
+                    yield format_event(item)
+                    if is_completion_status(item['response']):
+                        logger.info(f"Detected run completion via status message in stream: {item['response'].get('status')}")
+                        return
+
+        except asyncio.CancelledError:
+            logger.info(f"Stream generator cancelled for {agent_run_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming agent run {agent_run_id}: {e}", exc_info=True)
+            if not initial_yield_complete:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+            else:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {e}'})}\n\n"
+        finally:
+            logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
-            pubsub_control = await redis.create_pubsub()
-            await pubsub_control.subscribe(control_channel)
-            logger.debug(f"Subscribed to control channel: {control_channel}")
+    async def stream_generator():
+        logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
+        last_processed_index = int(last_event_id) if last_event_id else -1
+        message_queue = None
+        initial_yield_complete = False
 
-            # Queue to communicate between listeners and the main generator loop
-            message_queue = asyncio.Queue()
+        try:
+            # 1. Fetch and yield initial responses from Redis list
+            initial_items = await response_stream.read_responses(agent_run_id, after=last_event_id)
+            if initial_items:
+                logger.debug(f"Sending {len(initial_items)} initial responses for {agent_run_id}")
+                for item in initial_items:
+                    yield format_event(item)
+                last_processed_index += len(initial_items)
+            initial_yield_complete = True
 
-            async def listen_messages():
-                response_reader = pubsub_response.listen()
-                control_reader = pubsub_control.listen()
-                tasks = [asyncio.create_task(response_reader.__anext__()), asyncio.create_task(control_reader.__anext__())]
+            # 2. Check run status *after* yielding initial data
+            if not await check_run_is_running():
+                yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
+                return
 
-                while not terminate_stream:
-                    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-                    for task in done:
-                        try:
-                            message = task.result()
-                            if message and isinstance(message, dict) and message.get("type") == "message":
-                                channel = message.get("channel")
-                                data = message.get("data")
-                                if isinstance(data, bytes): data = data.decode('utf-8')
-
-                                if channel == response_channel and data == "new":
-                                    await message_queue.put({"type": "new_response"})
-                                elif channel == control_channel and data in ["STOP", "END_STREAM", "ERROR"]:
-                                    logger.info(f"Received control signal '{data}' for {agent_run_id}")
-                                    await message_queue.put({"type": "control", "data": data})
-                                    return # Stop listening on control signal
-
-                        except StopAsyncIteration:
-                            logger.warning(f"Listener {task} stopped.")
-                            # Decide how to handle listener stopping, maybe terminate?
-                            await message_queue.put({"type": "error", "data": "Listener stopped unexpectedly"})
-                            return
-                        except Exception as e:
-                            logger.error(f"Error in listener for {agent_run_id}: {e}")
-                            await message_queue.put({"type": "error", "data": "Listener failed"})
+            # 3. Follow new responses and control signals through the process-wide pubsub connection
+            message_queue = await pubsub_hub.subscribe(response_channel, control_channel)
+            logger.debug(f"Subscribed to channels: {response_channel}, {control_channel}")
+
+            # 4. Main loop to process notifications from the queue
+            while True:
+                messages = [await message_queue.get()]
+                # Coalesce notifications that queued up while we were sending
+                while not message_queue.empty():
+                    messages.append(message_queue.get_nowait())
+
+                control_signal = next((m["data"] for m in messages if m["channel"] == control_channel and m["data"] in ["STOP", "END_STREAM", "ERROR"]), None)
+
+                if any(m["channel"] == response_channel and m["data"] == "new" for m in messages):
+                    # Fetch new responses from Redis list starting after the last processed index
+                    new_items = await response_stream.read_responses(agent_run_id, after=str(last_processed_index))
+                    for item in new_items:
+                        yield format_event(item)
+                        last_processed_index += 1
+                        # Check if this response signals completion
+                        if is_completion_status(item['response']):
+                            logger.info(f"Detected run completion via status message in stream: {item['response'].get('status')}")
                             return
-                        finally:
-                            # Reschedule the completed listener task
-                            if task in tasks:
-                                tasks.remove(task)
-                                if message and isinstance(message, dict) and message.get("channel") == response_channel:
-                                     tasks.append(asyncio.create_task(response_reader.__anext__()))
-                                elif message and isinstance(message, dict) and message.get("channel") == control_channel:
-                                     tasks.append(asyncio.create_task(control_reader.__anext__()))
-
-                # Cancel pending listener tasks on exit
-                for p_task in pending: p_task.cancel()
-                for task in tasks: task.cancel()
-
 
-            listener_task = asyncio.create_task(listen_messages())
-
-            # 4. Main loop to process messages from the queue
-            while not terminate_stream:
-                try:
-                    queue_item = await message_queue.get()
-
-                    if queue_item["type"] == "new_response":
-                        # Fetch new responses from Redis list starting after the last processed index
-                        new_start_index = last_processed_index + 1
-                        new_responses_json = await redis.lrange(response_list_key, new_start_index, -1)
-
-                        if new_responses_json:
-                            new_responses = [json.loads(r) for r in new_responses_json]
-                            num_new = len(new_responses)
-                            # logger.debug(f"Received {num_new} new responses for {agent_run_id} (index {new_start_index} onwards)")
-                            for response in new_responses:
-                                yield f"data: {json.dumps(response)}\n\n"
-                                # Check if this response signals completion
-                                if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
-                                    logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
-                                    terminate_stream = True
-                                    break # Stop processing further new responses
-                            last_processed_index += num_new
-                        if terminate_stream: break
-
-                    elif queue_item["type"] == "control":
-                        control_signal = queue_item["data"]
-                        terminate_stream = True # Stop the stream on any control signal
-                        yield f"data: {json.dumps({'type': 'status', 'status': control_signal})}\n\n"
-                        break
-
-                    elif queue_item["type"] == "error":
-                        logger.error(f"Listener error for {agent_run_id}: {queue_item['data']}")
-                        terminate_stream = True
-                        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
-                        break
-
-                except asyncio.CancelledError:
-                     logger.info(f"Stream generator main loop cancelled for {agent_run_id}")
-                     terminate_stream = True
-                     break
-                except Exception as loop_err:
-                    logger.error(f"Error in stream generator main loop for {agent_run_id}: {loop_err}", exc_info=True)
-                    terminate_stream = True
-                    yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {loop_err}'})}\n\n"
-                    break
+                if control_signal:
+                    logger.info(f"Received control signal '{control_signal}' for {agent_run_id}")
+                    yield f"data: {json.dumps({'type': 'status', 'status': control_signal})}\n\n"
+                    return
 
+        except asyncio.CancelledError:
+            logger.info(f"Stream generator cancelled for {agent_run_id}")
+            raise
         except Exception as e:
-            logger.error(f"Error setting up stream for agent run {agent_run_id}: {e}", exc_info=True)
-            # Only yield error if initial yield didn't happen
+            logger.error(f"Error streaming agent run {agent_run_id}: {e}", exc_info=True)
             if not initial_yield_complete:
-                 yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+            else:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {e}'})}\n\n"
         finally:
-            terminate_stream = True
-            # Graceful shutdown order: unsubscribe → close → cancel
-            if pubsub_response: await pubsub_response.unsubscribe(response_channel)
-            if pubsub_control: await pubsub_control.unsubscribe(control_channel)
-            if pubsub_response: await pubsub_response.close()
-            if pubsub_control: await pubsub_control.close()
-
-            if listener_task:
-                listener_task.cancel()
-                try:
-                    await listener_task  # Reap inner tasks & swallow their errors
-                except asyncio.CancelledError:
-                    pass
-                except Exception as e:
-                    logger.debug(f"listener_task ended with: {e}")
-            # Wait briefly for tasks to cancel
-            await asyncio.sleep(0.1)
+            if message_queue is not None:
+                await pubsub_hub.unsubscribe(message_queue)
             logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream", headers={
+    generator = stream_generator_from_stream() if transport == response_stream.TRANSPORT_STREAM else stream_generator()
+    return StreamingResponse(generator, media_type="text/event-stream", headers={
         "Cache-Control": "no-cache, no-transform", "Connection": "keep-alive",
         "X-Accel-Buffering": "no", "Content-Type": "text/event-stream",
         "Access-Control-Allow-Origin": "*"
@@ -1,8 +1,10 @@
 import os
 import json
+import mimetypes
 import re
+import asyncio
 from uuid import uuid4
-from typing import Optional
+from typing import Optional, Tuple
 
 # from agent.tools.message_tool import MessageTool
 from agent.tools.message_tool import MessageTool
@@ -23,7 +25,10 @@ from agent.tools.expand_msg_tool import ExpandMessageTool
 from agent.prompt import get_system_prompt
 from utils.logger import logger
 from utils.auth_utils import get_account_id_from_thread
-from services.billing import check_billing_status
+from services.billing import check_billing_status, increment_monthly_usage
+from services import screenshot_store
+from knowledge_base import retrieval as kb_retrieval
+from knowledge_base import context_cache as kb_context_cache
 from agent.tools.sb_vision_tool import SandboxVisionTool
 from agent.tools.sb_image_edit_tool import SandboxImageEditTool
 from services.langfuse import langfuse
@@ -36,6 +41,174 @@ from agentpress.tool import SchemaType
 
 load_dotenv()
 
+async def get_iteration_snapshot(client, thread_id: str) -> dict:
+    """Fetch the per-iteration thread state in a single round-trip.
+
+    Returns a dict with ``latest_message_type`` and the latest ``browser_state``
+    and ``image_context`` rows (each ``{"message_id", "content"}`` or None).
+    Falls back to concurrent per-type queries if the RPC is unavailable.
+    """
+    try:
+        result = await client.rpc('get_agent_iteration_snapshot', {'p_thread_id': thread_id}).execute()
+        if isinstance(result.data, dict):
+            return result.data
+        logger.warning(f"Unexpected iteration snapshot payload for thread {thread_id}: {type(result.data)}")
+    except Exception as e:
+        logger.warning(f"get_agent_iteration_snapshot RPC failed for thread {thread_id}, falling back to separate queries: {e}")
+
+    latest_message, latest_browser_state, latest_image_context = await asyncio.gather(
+        client.table('messages').select('type').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute(),
+        client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute(),
+        client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
+    )
+    return {
+        'latest_message_type': latest_message.data[0].get('type') if latest_message.data else None,
+        'browser_state': latest_browser_state.data[0] if latest_browser_state.data else None,
+        'image_context': latest_image_context.data[0] if latest_image_context.data else None,
+    }
+
+
+def get_message_text(content) -> str:
+    """Text of a message's content, which is either a string or a list of content blocks."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(block.get("text", "") for block in content if isinstance(block, dict) and block.get("type") == "text")
+    return ""
+
+
+async def wait_for_browser_screenshot(snapshot: dict):
+    """Wait until the screenshot of the latest browser_state in an iteration snapshot is uploaded.
+
+    Browser tools upload screenshots in the background. If the model's copy
+    (llm_image_url) could not be uploaded, the original image_url is used
+    instead; if that failed too, the screenshot is left out of the message.
+    """
+    latest_browser_state_msg = snapshot.get('browser_state')
+    if not latest_browser_state_msg:
+        return
+    try:
+        browser_content = latest_browser_state_msg["content"]
+        if isinstance(browser_content, str):
+            browser_content = json.loads(browser_content)
+            latest_browser_state_msg["content"] = browser_content
+        llm_image_url = browser_content.get("llm_image_url")
+        if llm_image_url and not await screenshot_store.wait_until_uploaded(llm_image_url):
+            browser_content.pop("llm_image_url", None)
+        image_url = browser_content.get("image_url")
+        if image_url and not browser_content.get("llm_image_url") and not await screenshot_store.wait_until_uploaded(image_url):
+            logger.warning(f"Screenshot {image_url} is not available, leaving it out of the browser state")
+            browser_content.pop("image_url", None)
+    except Exception as e:
+        logger.error(f"Error waiting for browser screenshot upload: {e}")
+
+
+def build_temporary_message(snapshot: dict, model_name: str, trace: Optional[Langfuse] = None) -> Tuple[Optional[dict], Optional[str]]:
+    """Build the temporary user message (browser state & image context) from an iteration snapshot.
+
+    Returns the temporary message (or None) and the message_id of the consumed
+    image_context message, which the caller is expected to delete.
+    """
+    temp_message_content_list = [] # List to hold text/image blocks
+    image_context_message_id = None
+
+    # Get the latest browser_state message
+    latest_browser_state_msg = snapshot.get('browser_state')
+    if latest_browser_state_msg:
+        try:
+            browser_content = latest_browser_state_msg["content"]
+            if isinstance(browser_content, str):
+                browser_content = json.loads(browser_content)
+            screenshot_base64 = browser_content.get("screenshot_base64")
+            # Prefer the downscaled copy of the screenshot made for the model
+            screenshot_url = browser_content.get("llm_image_url") or browser_content.get("image_url")
+            
+            # Create a copy of the browser state without screenshot data
+            browser_state_text = browser_content.copy()
+            browser_state_text.pop('screenshot_base64', None)
+            browser_state_text.pop('image_url', None)
+            browser_state_text.pop('llm_image_url', None)
+            browser_state_text.pop('screenshot_hash', None)
+
+            if browser_state_text:
+                temp_message_content_list.append({
+                    "type": "text",
+                    "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
+                })
+            
+            # Only add screenshot if model is not Gemini, Anthropic, or OpenAI
+            if 'gemini' in model_name.lower() or 'anthropic' in model_name.lower() or 'openai' in model_name.lower():
+                # Prioritize screenshot_url if available
+                if screenshot_url:
+                    temp_message_content_list.append({
+                        "type": "image_url",
+                        "image_url": {
+                            "url": screenshot_url,
+                            "format": mimetypes.guess_type(screenshot_url)[0] or "image/jpeg"
+                        }
+                    })
+                    if trace:
+                        trace.event(name="screenshot_url_added_to_temporary_message", level="DEFAULT", status_message=(f"Screenshot URL added to temporary message."))
+                elif screenshot_base64:
+                    # Fallback to base64 if URL not available
+                    temp_message_content_list.append({
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{screenshot_base64}",
+                        }
+                    })
+                    if trace:
+                        trace.event(name="screenshot_base64_added_to_temporary_message", level="WARNING", status_message=(f"Screenshot base64 added to temporary message. Prefer screenshot_url if available."))
+                else:
+                    logger.warning("Browser state found but no screenshot data.")
+                    if trace:
+                        trace.event(name="browser_state_found_but_no_screenshot_data", level="WARNING", status_message=(f"Browser state found but no screenshot data."))
+            else:
+                logger.warning("Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message.")
+                if trace:
+                    trace.event(name="model_is_gemini_anthropic_or_openai", level="WARNING", status_message=(f"Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message."))
+
+        except Exception as e:
+            logger.error(f"Error parsing browser state: {e}")
+            if trace:
+                trace.event(name="error_parsing_browser_state", level="ERROR", status_message=(f"{e}"))
+
+    # Get the latest image_context message
+    latest_image_context_msg = snapshot.get('image_context')
+    if latest_image_context_msg:
+        try:
+            image_context_content = latest_image_context_msg["content"] if isinstance(latest_image_context_msg["content"], dict) else json.loads(latest_image_context_msg["content"])
+            base64_image = image_context_content.get("base64")
+            mime_type = image_context_content.get("mime_type")
+            file_path = image_context_content.get("file_path", "unknown file")
+
+            if base64_image and mime_type:
+                temp_message_content_list.append({
+                    "type": "text",
+                    "text": f"Here is the image you requested to see: '{file_path}'"
+                })
+                temp_message_content_list.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{base64_image}",
+                    }
+                })
+            else:
+                logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
+
+            image_context_message_id = latest_image_context_msg["message_id"]
+        except Exception as e:
+            logger.error(f"Error parsing image context: {e}")
+            if trace:
+                trace.event(name="error_parsing_image_context", level="ERROR", status_message=(f"{e}"))
+
+    # If we have any content, construct the temporary_message
+    temporary_message = None
+    if temp_message_content_list:
+        temporary_message = {"role": "user", "content": temp_message_content_list}
+    return temporary_message, image_context_message_id
+
+
 async def run_agent(
     thread_id: str,
     project_id: str,
@@ -68,6 +241,24 @@ async def run_agent(
     if not account_id:
         raise ValueError("Could not determine account ID for thread")
 
+    # Keep the account's running monthly usage total current as LLM responses are saved
+    thread_result = await client.table('threads').select('created_at').eq('thread_id', thread_id).execute()
+    thread_created_at = thread_result.data[0]['created_at']
+
+    async def record_usage(message: dict):
+        if message.get('type') != 'assistant_response_end' or not isinstance(message.get('content'), dict):
+            return
+        usage = message['content'].get('usage') or {}
+        await increment_monthly_usage(
+            account_id,
+            thread_created_at,
+            usage.get('prompt_tokens', 0),
+            usage.get('completion_tokens', 0),
+            message['content'].get('model', 'unknown')
+        )
+
+    thread_manager.message_callback = record_usage
+
     # Get sandbox info from project
     project = await client.table('projects').select('*').eq('project_id', project_id).execute()
     if not project.data or len(project.data) == 0:
@@ -228,6 +419,14 @@ async def run_agent(
         system_content = default_system_content
         logger.info("Using default system prompt only")
     
+    latest_user_message = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'user').order('created_at', desc=True).limit(1).execute()
+    latest_user_content = None
+    if latest_user_message.data and len(latest_user_message.data) > 0:
+        data = latest_user_message.data[0]['content']
+        if isinstance(data, str):
+            data = json.loads(data)
+        latest_user_content = data['content']
+
     if await is_enabled("knowledge_base"):
         try:
             from services.supabase import DBConnection
@@ -236,15 +435,21 @@ async def run_agent(
             
             current_agent_id = agent_config.get('agent_id') if agent_config else None
             
-            kb_result = await kb_client.rpc('get_combined_knowledge_base_context', {
-                'p_thread_id': thread_id,
-                'p_agent_id': current_agent_id,
-                'p_max_tokens': 4000
-            }).execute()
+            # Prefer the parts of the agent's knowledge base relevant to the latest user message
+            kb_context = None
+            query = get_message_text(latest_user_content)
+            if current_agent_id and query.strip():
+                try:
+                    kb_context = await kb_retrieval.get_combined_context(kb_client, thread_id, current_agent_id, query, max_tokens=4000)
+                except Exception as e:
+                    logger.warning(f"Knowledge base retrieval failed for agent {current_agent_id}, using the whole knowledge base: {e}")
             
-            if kb_result.data and kb_result.data.strip():
+            if kb_context is None:
+                kb_context = await kb_context_cache.get_combined_context(kb_client, thread_id, current_agent_id, max_tokens=4000)
+            
+            if kb_context and kb_context.strip():
                 logger.info(f"Adding combined knowledge base context to system prompt for thread {thread_id}, agent {current_agent_id}")
-                system_content += "\n\n" + kb_result.data
+                system_content += "\n\n" + kb_context
             else:
                 logger.debug(f"No knowledge base context found for thread {thread_id}, agent {current_agent_id}")
                 
@@ -318,20 +523,18 @@ async def run_agent(
     iteration_count = 0
     continue_execution = True
 
-    latest_user_message = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'user').order('created_at', desc=True).limit(1).execute()
-    if latest_user_message.data and len(latest_user_message.data) > 0:
-        data = latest_user_message.data[0]['content']
-        if isinstance(data, str):
-            data = json.loads(data)
-        if trace:
-            trace.update(input=data['content'])
+    if trace and latest_user_content is not None:
+        trace.update(input=latest_user_content)
 
     while continue_execution and iteration_count < max_iterations:
         iteration_count += 1
         logger.info(f"🔄 Running iteration {iteration_count} of {max_iterations}...")
 
-        # Billing check on each iteration - still needed within the iterations
-        can_run, message, subscription = await check_billing_status(client, account_id)
+        # Billing check and iteration state are fetched concurrently - still needed within the iterations
+        (can_run, message, subscription), snapshot = await asyncio.gather(
+            check_billing_status(client, account_id),
+            get_iteration_snapshot(client, thread_id)
+        )
         if not can_run:
             error_msg = f"Billing limit reached: {message}"
             if trace:
@@ -343,112 +546,23 @@ async def run_agent(
                 "message": error_msg
             }
             break
-        # Check if last message is from assistant using direct Supabase query
-        latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()
-        if latest_message.data and len(latest_message.data) > 0:
-            message_type = latest_message.data[0].get('type')
-            if message_type == 'assistant':
-                logger.info(f"Last message was from assistant, stopping execution")
-                if trace:
-                    trace.event(name="last_message_from_assistant", level="DEFAULT", status_message=(f"Last message was from assistant, stopping execution"))
-                continue_execution = False
-                break
+        # Check if last message is from assistant
+        if snapshot.get('latest_message_type') == 'assistant':
+            logger.info(f"Last message was from assistant, stopping execution")
+            if trace:
+                trace.event(name="last_message_from_assistant", level="DEFAULT", status_message=(f"Last message was from assistant, stopping execution"))
+            continue_execution = False
+            break
 
         # ---- Temporary Message Handling (Browser State & Image Context) ----
-        temporary_message = None
-        temp_message_content_list = [] # List to hold text/image blocks
-
-        # Get the latest browser_state message
-        latest_browser_state_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
-            try:
-                browser_content = latest_browser_state_msg.data[0]["content"]
-                if isinstance(browser_content, str):
-                    browser_content = json.loads(browser_content)
-                screenshot_base64 = browser_content.get("screenshot_base64")
-                screenshot_url = browser_content.get("image_url")
-                
-                # Create a copy of the browser state without screenshot data
-                browser_state_text = browser_content.copy()
-                browser_state_text.pop('screenshot_base64', None)
-                browser_state_text.pop('image_url', None)
-
-                if browser_state_text:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
-                    })
-                
-                # Only add screenshot if model is not Gemini, Anthropic, or OpenAI
-                if 'gemini' in model_name.lower() or 'anthropic' in model_name.lower() or 'openai' in model_name.lower():
-                    # Prioritize screenshot_url if available
-                    if screenshot_url:
-                        temp_message_content_list.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": screenshot_url,
-                                "format": "image/jpeg"
-                            }
-                        })
-                        if trace:
-                            trace.event(name="screenshot_url_added_to_temporary_message", level="DEFAULT", status_message=(f"Screenshot URL added to temporary message."))
-                    elif screenshot_base64:
-                        # Fallback to base64 if URL not available
-                        temp_message_content_list.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{screenshot_base64}",
-                            }
-                        })
-                        if trace:
-                            trace.event(name="screenshot_base64_added_to_temporary_message", level="WARNING", status_message=(f"Screenshot base64 added to temporary message. Prefer screenshot_url if available."))
-                    else:
-                        logger.warning("Browser state found but no screenshot data.")
-                        if trace:
-                            trace.event(name="browser_state_found_but_no_screenshot_data", level="WARNING", status_message=(f"Browser state found but no screenshot data."))
-                else:
-                    logger.warning("Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message.")
-                    if trace:
-                        trace.event(name="model_is_gemini_anthropic_or_openai", level="WARNING", status_message=(f"Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message."))
-
-            except Exception as e:
-                logger.error(f"Error parsing browser state: {e}")
-                if trace:
-                    trace.event(name="error_parsing_browser_state", level="ERROR", status_message=(f"{e}"))
-
-        # Get the latest image_context message (NEW)
-        latest_image_context_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
+        await wait_for_browser_screenshot(snapshot)
+        temporary_message, image_context_message_id = build_temporary_message(snapshot, model_name, trace)
+        if image_context_message_id:
+            # Image context is shown to the model once, then removed
             try:
-                image_context_content = latest_image_context_msg.data[0]["content"] if isinstance(latest_image_context_msg.data[0]["content"], dict) else json.loads(latest_image_context_msg.data[0]["content"])
-                base64_image = image_context_content.get("base64")
-                mime_type = image_context_content.get("mime_type")
-                file_path = image_context_content.get("file_path", "unknown file")
-
-                if base64_image and mime_type:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"Here is the image you requested to see: '{file_path}'"
-                    })
-                    temp_message_content_list.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}",
-                        }
-                    })
-                else:
-                    logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
-
-                await client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
+                await client.table('messages').delete().eq('message_id', image_context_message_id).execute()
             except Exception as e:
-                logger.error(f"Error parsing image context: {e}")
-                if trace:
-                    trace.event(name="error_parsing_image_context", level="ERROR", status_message=(f"{e}"))
-
-        # If we have any content, construct the temporary_message
-        if temp_message_content_list:
-            temporary_message = {"role": "user", "content": temp_message_content_list}
-            # logger.debug(f"Constructed temporary message with {len(temp_message_content_list)} content blocks.")
+                logger.error(f"Error deleting image context message {image_context_message_id}: {e}")
         # ---- End Temporary Message Handling ----
 
         # Set max_tokens based on model
@@ -234,17 +234,29 @@ class LinkedinProvider(RapidDataProviderBase):
             }
         }
         base_url = "https://linkedin-data-scraper.p.rapidapi.com"
-        super().__init__(base_url, endpoints)
+        cache_ttls = {
+            # Activity and job listings change faster than profiles and companies
+            "profile_updates": 600,
+            "profile_recent_comments": 600,
+            "comments_from_recent_activity": 600,
+            "company_updates": 600,
+            "company_updates_post": 600,
+            "search_posts_with_filters": 600,
+            "company_jobs": 900,
+            "search_jobs": 900,
+        }
+        super().__init__(base_url, endpoints, default_cache_ttl=3600, cache_ttls=cache_ttls)
 
 
 if __name__ == "__main__":
+    import asyncio
     from dotenv import load_dotenv
     load_dotenv()
     tool = LinkedinProvider()
 
-    result = tool.call_endpoint(
+    result = asyncio.run(tool.call_endpoint(
         route="comments_from_recent_activity",
         payload={"profile_url": "https://www.linkedin.com/in/adamcohenhillel/", "page": 1}
-    )
+    ))
     print(result)
 
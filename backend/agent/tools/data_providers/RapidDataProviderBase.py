@@ -1,6 +1,15 @@
+import asyncio
+import hashlib
+import json
 import os
-import requests
-from typing import Dict, Any, Optional, TypedDict, Literal
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, TypedDict, Literal
+
+import httpx
+
+from utils.http_client import SharedHTTPClient
+from utils.logger import logger
 
 
 class EndpointSchema(TypedDict):
@@ -11,27 +20,95 @@ class EndpointSchema(TypedDict):
     payload: Dict[str, Any]
 
 
+REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+
+# Successful responses, keyed by provider, route and payload; shared by all providers in the process
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+_response_cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+# One connection pool per process, and the requests currently in flight so
+# identical concurrent calls share one upstream request
+_http_client = SharedHTTPClient(timeout=REQUEST_TIMEOUT, limits=POOL_LIMITS)
+_in_flight: Dict[str, "asyncio.Task[Any]"] = {}
+
+
+def _check_loop():
+    """Create the shared HTTP client for the running event loop if needed."""
+    global _in_flight
+    if _http_client.ensure():
+        _in_flight = {}
+
+
+def _get_cached_response(cache_key: str) -> Optional[Any]:
+    cached = _response_cache.get(cache_key)
+    if cached is None:
+        return None
+    expires_at, response = cached
+    if expires_at < time.monotonic():
+        del _response_cache[cache_key]
+        return None
+    _response_cache.move_to_end(cache_key)
+    return response
+
+
+def _cache_response(cache_key: str, response: Any, ttl: int):
+    _response_cache[cache_key] = (time.monotonic() + ttl, response)
+    _response_cache.move_to_end(cache_key)
+    if len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+
+def _encode_query_params(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Stringify query parameters the way requests did, so the wire format is unchanged.
+
+    requests sends str(value) (True -> "True") and leaves out None values,
+    while httpx would send booleans as "true"/"false".
+    """
+    params = {}
+    for key, value in payload.items():
+        if isinstance(value, (list, tuple)):
+            values = [str(item) for item in value if item is not None]
+            if values:
+                params[key] = values
+        elif value is not None:
+            params[key] = str(value)
+    return params
+
+
 class RapidDataProviderBase:
-    def __init__(self, base_url: str, endpoints: Dict[str, EndpointSchema]):
+    """Base class for RapidAPI data providers.
+
+    Calls go through a shared async connection pool. Successful responses are
+    cached per endpoint for cache_ttls[route] seconds (default_cache_ttl for
+    endpoints not listed, 0 disables caching), and identical calls made while
+    one is in flight wait for its response instead of sending another request.
+    """
+
+    def __init__(self, base_url: str, endpoints: Dict[str, EndpointSchema], default_cache_ttl: int = 0, cache_ttls: Optional[Dict[str, int]] = None):
         self.base_url = base_url
         self.endpoints = endpoints
-    
+        self.default_cache_ttl = default_cache_ttl
+        self.cache_ttls = cache_ttls or {}
+
     def get_endpoints(self):
         return self.endpoints
-    
-    def call_endpoint(
+
+    def get_cache_ttl(self, route: str) -> int:
+        return self.cache_ttls.get(route, self.default_cache_ttl)
+
+    async def call_endpoint(
             self,
             route: str,
             payload: Optional[Dict[str, Any]] = None
     ):
         """
         Call an API endpoint with the given parameters and data.
-        
+
         Args:
-            endpoint (EndpointSchema): The endpoint configuration dictionary
-            params (dict, optional): Query parameters for GET requests
-            payload (dict, optional): JSON payload for POST requests
-            
+            route (str): The endpoint key in self.endpoints
+            payload (dict, optional): Query parameters for GET requests or JSON payload for POST requests
+
         Returns:
             dict: The JSON response from the API
         """
@@ -41,21 +118,50 @@ class RapidDataProviderBase:
         endpoint = self.endpoints.get(route)
         if not endpoint:
             raise ValueError(f"Endpoint {route} not found")
-        
+
+        method = endpoint.get('method', 'GET').upper()
+        if method not in ('GET', 'POST'):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+
         url = f"{self.base_url}{endpoint['route']}"
-        
+        cache_key = hashlib.sha256(
+            json.dumps([method, url, payload], sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+        ttl = self.get_cache_ttl(route)
+        if ttl > 0:
+            cached = _get_cached_response(cache_key)
+            if cached is not None:
+                logger.debug(f"Data provider cache hit for {url}")
+                return cached
+
+        _check_loop()
+        request = _in_flight.get(cache_key)
+        if request is None:
+            request = asyncio.create_task(self._request(method, url, payload, cache_key, ttl))
+            _in_flight[cache_key] = request
+            request.add_done_callback(lambda _: _in_flight.pop(cache_key, None))
+        else:
+            logger.debug(f"Joining in-flight data provider request for {url}")
+
+        # Shielded so a cancelled caller does not cancel the request for the others waiting on it
+        return await asyncio.shield(request)
+
+    async def _request(self, method: str, url: str, payload: Optional[Dict[str, Any]], cache_key: str, ttl: int):
         headers = {
             "x-rapidapi-key": os.getenv("RAPID_API_KEY"),
             "x-rapidapi-host": url.split("//")[1].split("/")[0],
             "Content-Type": "application/json"
         }
 
-        method = endpoint.get('method', 'GET').upper()
-        
+        client = _http_client.client()
         if method == 'GET':
-            response = requests.get(url, params=payload, headers=headers)
-        elif method == 'POST':
-            response = requests.post(url, json=payload, headers=headers)
+            params = _encode_query_params(payload) if payload else None
+            response = await client.get(url, params=params, headers=headers)
         else:
-            raise ValueError(f"Unsupported HTTP method: {method}")
-        return response.json()
+            response = await client.post(url, json=payload, headers=headers)
+
+        result = response.json()
+        if ttl > 0 and response.is_success:
+            _cache_response(cache_key, result, ttl)
+        return result
@@ -7,7 +7,7 @@ Based on the fal.ai Python client documentation: https://docs.fal.ai/clients/pyt
 
 import asyncio
 import os
-import aiohttp
+import httpx
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 import fal_client
@@ -16,6 +16,10 @@ from pydantic import BaseModel, Field
 from agentpress.tool import ToolResult, openapi_schema
 from sandbox.tool_base import SandboxToolsBase
 from utils.logger import logger
+from utils import image_pipeline
+
+# Largest generated image downloaded into the workspace
+MAX_IMAGE_SIZE = 50 * 1024 * 1024
 
 
 class FalMediaRequest(BaseModel):
@@ -117,21 +121,19 @@ class FalMediaTool(SandboxToolsBase):
             
             # Download the image
             logger.info(f"Downloading image from {image_url} to {file_path}")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as response:
-                    if response.status == 200:
-                        image_data = await response.read()
-                        
-                        # Save to workspace
-                        await self.sandbox.fs.upload_file(image_data, file_path)
-                        
-                        # Return relative path for display
-                        relative_path = f"generated_images/{filename}"
-                        logger.info(f"✅ Image saved to workspace: {relative_path}")
-                        return relative_path
-                    else:
-                        logger.error(f"Failed to download image: HTTP {response.status}")
-                        raise Exception(f"Failed to download image: HTTP {response.status}")
+            try:
+                image_data, _ = await image_pipeline.download_image(image_url, MAX_IMAGE_SIZE)
+            except httpx.HTTPStatusError as e:
+                logger.error(f"Failed to download image: HTTP {e.response.status_code}")
+                raise Exception(f"Failed to download image: HTTP {e.response.status_code}")
+            
+            # Save to workspace
+            await self.sandbox.fs.upload_file(image_data, file_path)
+            
+            # Return relative path for display
+            relative_path = f"generated_images/{filename}"
+            logger.info(f"✅ Image saved to workspace: {relative_path}")
+            return relative_path
                         
         except Exception as e:
             logger.error(f"❌ Error in _download_and_save_image: {str(e)}", exc_info=True)
@@ -1,14 +1,22 @@
+import asyncio
 import traceback
 import json
 import base64
+import binascii
 import io
+import httpx
 from PIL import Image
 
 from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
+from sandbox import browser_client
 from sandbox.tool_base import SandboxToolsBase
 from utils.logger import logger
-from utils.s3_upload_utils import upload_base64_image
+from services import screenshot_store
+
+
+# Background checks of screenshot uploads, referenced until done so they are not garbage collected
+_upload_checks = set()
 
 
 class SandboxBrowserTool(SandboxToolsBase):
@@ -17,6 +25,10 @@ class SandboxBrowserTool(SandboxToolsBase):
     def __init__(self, project_id: str, thread_id: str, thread_manager: ThreadManager):
         super().__init__(project_id, thread_manager)
         self.thread_id = thread_id
+        # Last element snapshot received from the browser API, so actions only transfer changed elements
+        self._dom_snapshot_id = None
+        self._dom_lines = {}
+        self._dom_elements = {}
 
     def _validate_base64_image(self, base64_string: str, max_size_mb: int = 10) -> tuple[bool, str]:
         """
@@ -57,6 +69,24 @@ class SandboxBrowserTool(SandboxToolsBase):
             except Exception as e:
                 return False, f"Base64 decoding failed: {str(e)}"
             
+            return self._validate_image_data(image_data, max_size_mb)
+            
+        except Exception as e:
+            logger.error(f"Unexpected error during base64 image validation: {e}")
+            return False, f"Validation error: {str(e)}"
+
+    def _validate_image_data(self, image_data: bytes, max_size_mb: int = 10) -> tuple[bool, str]:
+        """
+        Validate decoded image data: size, format and dimensions.
+        
+        Args:
+            image_data (bytes): The image data
+            max_size_mb (int): Maximum allowed image size in megabytes
+            
+        Returns:
+            tuple[bool, str]: (is_valid, error_message)
+        """
+        try:
             # Check decoded data size
             if len(image_data) == 0:
                 return False, "Decoded image data is empty"
@@ -100,9 +130,99 @@ class SandboxBrowserTool(SandboxToolsBase):
             return True, "Valid image"
             
         except Exception as e:
-            logger.error(f"Unexpected error during base64 image validation: {e}")
+            logger.error(f"Unexpected error during image validation: {e}")
             return False, f"Validation error: {str(e)}"
 
+    async def _execute_browser_action_via_exec(self, endpoint: str, params: dict = None, method: str = "POST") -> dict:
+        """Call the browser API with curl inside the sandbox, for when its preview URL is unreachable"""
+        url = f"http://localhost:{browser_client.BROWSER_API_PORT}/api/automation/{endpoint}"
+        
+        if method == "GET" and params:
+            query_params = "&".join([f"{k}={v}" for k, v in params.items()])
+            url = f"{url}?{query_params}"
+            curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
+        else:
+            curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
+            if params:
+                json_data = json.dumps(params)
+                curl_cmd += f" -d '{json_data}'"
+        
+        logger.debug("\033[95mExecuting curl command:\033[0m")
+        logger.debug(f"{curl_cmd}")
+        
+        response = await self.sandbox.process.exec(curl_cmd, timeout=30)
+        if response.exit_code != 0:
+            raise RuntimeError(f"Browser automation request failed: {response}")
+        return json.loads(response.result)
+
+    def _update_dom_snapshot(self, result: dict):
+        """Rebuild the full element lists of a diff-mode result and remember its snapshot"""
+        if result.get("elements_diff") is None:
+            # Full result (exec fallback or an older sandbox image): nothing to diff against next time
+            result.pop("elements_diff", None)
+            result.pop("dom_snapshot_id", None)
+            self._dom_snapshot_id = None
+            return
+        if not browser_client.apply_elements_diff(result, self._dom_snapshot_id, self._dom_lines, self._dom_elements):
+            logger.warning("Browser elements diff does not match the last snapshot, kept its changed elements only and requesting all elements next time")
+            result.pop("dom_snapshot_id", None)
+            self._dom_snapshot_id = None
+            return
+        self._dom_snapshot_id = result.pop("dom_snapshot_id", None)
+
+    async def _process_screenshot(self, result: dict):
+        """Store the action's screenshot and replace it in the result with its screenshot_hash and image_url.
+        
+        The upload runs in the background; screenshots this process has already
+        stored are neither downloaded nor validated again.
+        """
+        screenshot_id = result.pop("screenshot_id", None)
+        screenshot_base64 = result.pop("screenshot_base64", None)
+        if not screenshot_id and not screenshot_base64:
+            return
+        
+        try:
+            stored = screenshot_store.lookup(screenshot_id) if screenshot_id else None
+            if stored is None:
+                if screenshot_base64:
+                    # Older sandbox images embed the screenshot in the result
+                    try:
+                        image_data = base64.b64decode(screenshot_base64.split(',', 1)[-1], validate=True)
+                    except binascii.Error as e:
+                        result["image_validation_error"] = f"Invalid base64 encoding: {str(e)}"
+                        return
+                else:
+                    image_data = await browser_client.fetch_screenshot(self.sandbox, screenshot_id)
+                stored = screenshot_store.lookup(screenshot_store.content_hash(image_data))
+                if stored is None:
+                    is_valid, validation_message = await asyncio.to_thread(self._validate_image_data, image_data)
+                    if not is_valid:
+                        logger.warning(f"Screenshot validation failed: {validation_message}")
+                        result["image_validation_error"] = validation_message
+                        return
+                    logger.debug(f"Screenshot validation passed: {validation_message}")
+                    stored = await screenshot_store.store(image_data, content_type="image/jpeg")
+            
+            result.update(stored)
+            logger.debug(f"Screenshot {stored['screenshot_hash'][:16]} stored at {stored['image_url']}")
+                
+        except Exception as e:
+            logger.error(f"Failed to process screenshot: {e}")
+            result["image_upload_error"] = str(e)
+
+    async def _record_screenshot_upload(self, message_id: str, content: dict):
+        """Drop the screenshot from a stored browser_state if its background upload failed"""
+        try:
+            if await screenshot_store.wait_until_uploaded(content["image_url"], timeout=120):
+                return
+            content = {k: v for k, v in content.items() if k not in ("image_url", "llm_image_url")}
+            content["image_upload_error"] = "Screenshot upload failed"
+            client = await self.thread_manager.db.client
+            await client.table('messages').update({'content': content}).eq('message_id', message_id).execute()
+            logger.warning(f"Screenshot upload failed, removed it from browser_state {message_id}")
+        except Exception as e:
+            logger.error(f"Failed to record screenshot upload for browser_state {message_id}: {e}")
+
     async def _execute_browser_action(self, endpoint: str, params: dict = None, method: str = "POST") -> ToolResult:
         """Execute a browser automation action through the API
         
@@ -118,100 +238,67 @@ class SandboxBrowserTool(SandboxToolsBase):
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
-            # Build the curl command
-            url = f"http://localhost:8003/api/automation/{endpoint}"
-            
-            if method == "GET" and params:
-                query_params = "&".join([f"{k}={v}" for k, v in params.items()])
-                url = f"{url}?{query_params}"
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-            else:
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-                if params:
-                    json_data = json.dumps(params)
-                    curl_cmd += f" -d '{json_data}'"
+            try:
+                result = await browser_client.call_action(self.sandbox, endpoint, params, method, dom_base=self._dom_snapshot_id or "none")
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # The request never reached the browser API, so it is safe to send it again
+                logger.warning(f"Browser API unreachable through preview link ({e}), falling back to exec")
+                result = await self._execute_browser_action_via_exec(endpoint, params, method)
+            except browser_client.BrowserAPIError as e:
+                logger.warning(str(e))
+                return self.fail_response(f"Browser action failed: {e.detail}")
             
-            logger.debug("\033[95mExecuting curl command:\033[0m")
-            logger.debug(f"{curl_cmd}")
+            self._update_dom_snapshot(result)
             
-            response = await self.sandbox.process.exec(curl_cmd, timeout=30)
+            if not "content" in result:
+                result["content"] = ""
             
-            if response.exit_code == 0:
-                try:
-                    result = json.loads(response.result)
-
-                    if not "content" in result:
-                        result["content"] = ""
-                    
-                    if not "role" in result:
-                        result["role"] = "assistant"
+            if not "role" in result:
+                result["role"] = "assistant"
 
-                    logger.info("Browser automation request completed successfully")
+            logger.info("Browser automation request completed successfully")
 
-                    if "screenshot_base64" in result:
-                        try:
-                            # Comprehensive validation of the base64 image data
-                            screenshot_data = result["screenshot_base64"]
-                            is_valid, validation_message = self._validate_base64_image(screenshot_data)
-                            
-                            if is_valid:
-                                logger.debug(f"Screenshot validation passed: {validation_message}")
-                                image_url = await upload_base64_image(screenshot_data)
-                                result["image_url"] = image_url
-                                logger.debug(f"Uploaded screenshot to {image_url}")
-                            else:
-                                logger.warning(f"Screenshot validation failed: {validation_message}")
-                                result["image_validation_error"] = validation_message
-                                
-                            # Remove base64 data from result to keep it clean
-                            del result["screenshot_base64"]
-                            
-                        except Exception as e:
-                            logger.error(f"Failed to process screenshot: {e}")
-                            result["image_upload_error"] = str(e)
+            await self._process_screenshot(result)
 
-                    added_message = await self.thread_manager.add_message(
-                        thread_id=self.thread_id,
-                        type="browser_state",
-                        content=result,
-                        is_llm_message=False
-                    )
+            added_message = await self.thread_manager.add_message(
+                thread_id=self.thread_id,
+                type="browser_state",
+                content=result,
+                is_llm_message=False
+            )
 
-                    success_response = {}
+            success_response = {}
 
-                    if result.get("success"):
-                        success_response["success"] = result["success"]
-                        success_response["message"] = result.get("message", "Browser action completed successfully")
-                    else:
-                        success_response["success"] = False
-                        success_response["message"] = result.get("message", "Browser action failed")
-
-                    if added_message and 'message_id' in added_message:
-                        success_response['message_id'] = added_message['message_id']
-                    if result.get("url"):
-                        success_response["url"] = result["url"]
-                    if result.get("title"):
-                        success_response["title"] = result["title"]
-                    if result.get("element_count"):
-                        success_response["elements_found"] = result["element_count"]
-                    if result.get("pixels_below"):
-                        success_response["scrollable_content"] = result["pixels_below"] > 0
-                    if result.get("ocr_text"):
-                        success_response["ocr_text"] = result["ocr_text"]
-                    if result.get("image_url"):
-                        success_response["image_url"] = result["image_url"]
+            if result.get("success"):
+                success_response["success"] = result["success"]
+                success_response["message"] = result.get("message", "Browser action completed successfully")
+            else:
+                success_response["success"] = False
+                success_response["message"] = result.get("message", "Browser action failed")
 
-                    if success_response.get("success"):
-                        return self.success_response(success_response)
-                    else:
-                        return self.fail_response(success_response)
+            if added_message and 'message_id' in added_message:
+                success_response['message_id'] = added_message['message_id']
+                if result.get("image_url"):
+                    task = asyncio.create_task(self._record_screenshot_upload(added_message['message_id'], result))
+                    _upload_checks.add(task)
+                    task.add_done_callback(_upload_checks.discard)
+            if result.get("url"):
+                success_response["url"] = result["url"]
+            if result.get("title"):
+                success_response["title"] = result["title"]
+            if result.get("element_count"):
+                success_response["elements_found"] = result["element_count"]
+            if result.get("pixels_below"):
+                success_response["scrollable_content"] = result["pixels_below"] > 0
+            if result.get("ocr_text"):
+                success_response["ocr_text"] = result["ocr_text"]
+            if result.get("image_url"):
+                success_response["image_url"] = result["image_url"]
 
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse response JSON: {response.result} {e}")
-                    return self.fail_response(f"Failed to parse response JSON: {response.result} {e}")
+            if success_response.get("success"):
+                return self.success_response(success_response)
             else:
-                logger.error(f"Browser automation request failed 2: {response}")
-                return self.fail_response(f"Browser automation request failed 2: {response}")
+                return self.fail_response(success_response)
 
         except Exception as e:
             logger.error(f"Error executing browser action: {e}")
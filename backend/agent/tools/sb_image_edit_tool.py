@@ -2,11 +2,14 @@ from typing import Optional
 from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
-import httpx
 from io import BytesIO
 import uuid
 from litellm import aimage_generation, aimage_edit
 import base64
+from utils import image_pipeline
+
+# Largest image accepted for editing
+MAX_IMAGE_SIZE = 25 * 1024 * 1024
 
 
 class SandboxImageEditTool(SandboxToolsBase):
@@ -126,10 +129,8 @@ class SandboxImageEditTool(SandboxToolsBase):
     async def _download_image_from_url(self, url: str) -> bytes | ToolResult:
         """Download image from URL."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url)
-                response.raise_for_status()
-                return response.content
+            image_bytes, _ = await image_pipeline.download_image(url, MAX_IMAGE_SIZE)
+            return image_bytes
         except Exception:
             return self.fail_response(f"Could not download image from URL: {url}")
 
@@ -1,4 +1,5 @@
 import asyncio
+import re
 from typing import Optional, Dict, Any
 import time
 import asyncio
@@ -7,6 +8,27 @@ from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
 
+# Each tmux session we create pipes its pane output to {COMMAND_LOG_DIR}/{session_name}.log,
+# so output can be read from a byte offset instead of re-capturing the whole scrollback
+COMMAND_LOG_DIR = "/tmp/tmux_logs"
+# Blocking commands wait on a tmux wait-for channel in windows of this many seconds,
+# which keeps each wait below the 30s timeout of _execute_raw_command
+COMMAND_WAIT_WINDOW = 20
+# Most output returned by one call; older output is dropped from the start
+MAX_OUTPUT_BYTES = 200_000
+
+SESSION_NOT_FOUND = "__session_not_found__"
+SESSION_ENDED = "__session_ended__"
+
+ANSI_ESCAPE_PATTERN = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]')
+
+
+def clean_terminal_output(text: str) -> str:
+    """Turn raw pane output into plain text: drop escape sequences and overwritten line content."""
+    text = ANSI_ESCAPE_PATTERN.sub('', text).replace('\r\n', '\n')
+    return '\n'.join(line.rsplit('\r', 1)[-1] for line in text.split('\n'))
+
+
 class SandboxShellTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities. 
     Uses sessions for maintaining state between commands and provides comprehensive process management."""
@@ -131,73 +153,76 @@ class SandboxShellTool(SandboxToolsBase):
             if not session_name:
                 session_name = f"session_{str(uuid4())[:8]}"
             
-            # Check if tmux session already exists
-            check_session = await self._execute_raw_command(f"tmux has-session -t {session_name} 2>/dev/null || echo 'not_exists'")
-            session_exists = "not_exists" not in check_session.get("output", "")
-            
-            if not session_exists:
-                # Create a new tmux session
-                await self._execute_raw_command(f"tmux new-session -d -s {session_name}")
+            # Create the tmux session if needed, and note where this command's output starts in its log
+            log_offset = await self._start_session(session_name)
                 
             # Ensure we're in the correct directory and send command to tmux
             full_command = f"cd {cwd} && {command}"
             wrapped_command = full_command.replace('"', '\\"')  # Escape double quotes
             
             if blocking:
-                # For blocking execution, use a more reliable approach
-                # Add a unique marker to detect command completion
-                marker = f"COMMAND_DONE_{str(uuid4())[:8]}"
-                completion_command = f"{command} ; echo {marker}"
-                wrapped_completion_command = completion_command.replace('"', '\\"')
-                
-                # Send the command with completion marker
-                await self._execute_raw_command(f'tmux send-keys -t {session_name} "cd {cwd} && {wrapped_completion_command}" Enter')
+                # The command records its exit code and signals a tmux channel when it finishes,
+                # so we wait on the signal instead of polling the pane
+                marker = f"command_done_{str(uuid4())[:8]}"
+                exit_file = f"{COMMAND_LOG_DIR}/{marker}.exit"
+                completion_command = f"{wrapped_command} ; echo \\$? > {exit_file} ; tmux wait-for -S {marker}"
+                await self._execute_raw_command(f'tmux send-keys -t {session_name} "{completion_command}" Enter')
                 
-                start_time = time.time()
-                final_output = ""
+                exit_code = None
+                session_ended = False
+                deadline = time.time() + timeout
                 
-                while (time.time() - start_time) < timeout:
-                    # Wait a shorter interval for more responsive checking
-                    await asyncio.sleep(0.5)
-                    
-                    # Check if session still exists (command might have exited)
-                    check_result = await self._execute_raw_command(f"tmux has-session -t {session_name} 2>/dev/null || echo 'ended'")
-                    if "ended" in check_result.get("output", ""):
-                        break
-                        
-                    # Get current output and check for our completion marker
-                    output_result = await self._execute_raw_command(f"tmux capture-pane -t {session_name} -p -S - -E -")
-                    current_output = output_result.get("output", "")
-                    
-                    if marker in current_output:
-                        final_output = current_output
+                while time.time() < deadline:
+                    window = max(1, int(min(deadline - time.time(), COMMAND_WAIT_WINDOW)))
+                    wait_result = await self._execute_raw_command(
+                        f"[ -f {exit_file} ] || timeout {window} tmux wait-for {marker} ; "
+                        f"cat {exit_file} 2>/dev/null || tmux has-session -t {session_name} 2>/dev/null || echo {SESSION_ENDED}"
+                    )
+                    wait_output = wait_result.get("output", "").strip()
+                    if SESSION_ENDED in wait_output:
+                        # The command closed the session (e.g. it ran exit)
+                        session_ended = True
                         break
+                    if wait_output:
+                        try:
+                            exit_code = int(wait_output.splitlines()[-1])
+                            break
+                        except ValueError:
+                            pass
                 
-                # If we didn't get the marker, capture whatever output we have
-                if not final_output:
-                    output_result = await self._execute_raw_command(f"tmux capture-pane -t {session_name} -p -S - -E -")
-                    final_output = output_result.get("output", "")
+                output = ""
+                if not session_ended:
+                    read_result = await self._read_output(session_name, offset=log_offset)
+                    if read_result:
+                        output = read_result["output"]
                 
                 # Kill the session after capture
-                await self._execute_raw_command(f"tmux kill-session -t {session_name}")
+                await self._execute_raw_command(
+                    f"tmux kill-session -t {session_name} 2>/dev/null ; rm -f {self._log_path(session_name)} {exit_file}"
+                )
                 
                 return self.success_response({
-                    "output": final_output,
+                    "output": output,
                     "session_name": session_name,
                     "cwd": cwd,
-                    "completed": True
+                    "exit_code": exit_code,
+                    "completed": exit_code is not None or session_ended
                 })
             else:
                 # Send command to tmux session for non-blocking execution
                 await self._execute_raw_command(f'tmux send-keys -t {session_name} "{wrapped_command}" Enter')
                 
                 # For non-blocking, just return immediately
-                return self.success_response({
+                response = {
                     "session_name": session_name,
                     "cwd": cwd,
                     "message": f"Command sent to tmux session '{session_name}'. Use check_command_output to view results.",
                     "completed": False
-                })
+                }
+                if log_offset is not None:
+                    # Pass as offset to check_command_output to get only this command's output
+                    response["output_offset"] = log_offset
+                return self.success_response(response)
                 
         except Exception as e:
             # Attempt to clean up session in case of error
@@ -237,11 +262,84 @@ class SandboxShellTool(SandboxToolsBase):
             "exit_code": response.exit_code
         }
 
+    def _log_path(self, session_name: str) -> str:
+        return f"{COMMAND_LOG_DIR}/{session_name}.log"
+
+    async def _start_session(self, session_name: str) -> Optional[int]:
+        """Create the tmux session if it does not exist.
+
+        Returns the current size of the session's output log, or None for
+        sessions that were not created with a log.
+        """
+        log_path = self._log_path(session_name)
+        result = await self._execute_raw_command(
+            f"mkdir -p {COMMAND_LOG_DIR} ; "
+            f"if tmux has-session -t {session_name} 2>/dev/null ; then stat -c %s {log_path} 2>/dev/null || echo -1 ; "
+            f"else tmux new-session -d -s {session_name} && tmux pipe-pane -t {session_name} 'cat >> {log_path}' && echo 0 ; fi"
+        )
+        try:
+            log_size = int(result.get("output", "").strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return None
+        return log_size if log_size >= 0 else None
+
+    async def _read_output(
+        self,
+        session_name: str,
+        offset: Optional[int] = None,
+        tail_lines: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Read a session's output in one round-trip, or return None if the session does not exist.
+
+        With an offset, only the log bytes written after it are read. Otherwise,
+        or for sessions without a log, the pane is captured: its last tail_lines
+        lines, or the whole scrollback.
+        """
+        log_path = self._log_path(session_name)
+        pane = f"tmux capture-pane -t {session_name} -p -S - -E -"
+        if tail_lines:
+            # Last lines up to the last non-empty one; the visible pane is padded with blank lines
+            pane += f" | awk '{{ lines[NR] = $0 }} NF {{ last = NR }} END {{ for (i = last - {int(tail_lines)} + 1; i <= last; i++) if (i > 0) print lines[i] }}'"
+        capture = f"echo '-1 -1' ; {pane}"
+        if offset is not None:
+            # Header line "<log size> <start offset>", then the log from the start offset
+            read = (
+                f"SIZE=$(stat -c %s {log_path}) ; START={max(0, int(offset))} ; "
+                f"[ $START -gt $SIZE ] && START=0 ; "
+                f"[ $((SIZE - START)) -gt {MAX_OUTPUT_BYTES} ] && START=$((SIZE - {MAX_OUTPUT_BYTES})) ; "
+                f"echo \"$SIZE $START\" ; tail -c +$((START + 1)) {log_path} | head -c $((SIZE - START))"
+            )
+        else:
+            read = f"echo \"$(stat -c %s {log_path}) -1\" ; {pane}"
+        
+        result = await self._execute_raw_command(
+            f"if ! tmux has-session -t {session_name} 2>/dev/null ; then echo {SESSION_NOT_FOUND} ; "
+            f"elif [ -f {log_path} ] ; then {read} ; else {capture} ; fi"
+        )
+        raw_output = result.get("output", "")
+        if raw_output.strip() == SESSION_NOT_FOUND:
+            return None
+        
+        header, _, output = raw_output.partition("\n")
+        try:
+            log_size, start = (int(value) for value in header.split())
+        except ValueError:
+            log_size, start = -1, -1
+            output = raw_output
+        
+        if start >= 0:
+            output = clean_terminal_output(output)
+        return {
+            "output": output,
+            "next_offset": log_size if log_size >= 0 else None,
+            "truncated": offset is not None and start > offset
+        }
+
     @openapi_schema({
         "type": "function",
         "function": {
             "name": "check_command_output",
-            "description": "Check the output of a previously executed command in a tmux session. Use this to monitor the progress or results of non-blocking commands.",
+            "description": "Check the output of a previously executed command in a tmux session. Use this to monitor the progress or results of non-blocking commands. When polling a long-running command, pass the next_offset from the previous check as offset to get only the new output.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -253,6 +351,14 @@ class SandboxShellTool(SandboxToolsBase):
                         "type": "boolean",
                         "description": "Whether to terminate the tmux session after checking. Set to true when you're done with the command.",
                         "default": False
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "Optional output offset: return only the output written after it. Use the next_offset returned by the previous check, or the output_offset returned by execute_command."
+                    },
+                    "tail_lines": {
+                        "type": "integer",
+                        "description": "Optional number of lines: return only the last lines of the output. Ignored when offset is given."
                     }
                 },
                 "required": ["session_name"]
@@ -263,7 +369,9 @@ class SandboxShellTool(SandboxToolsBase):
         tag_name="check-command-output",
         mappings=[
             {"param_name": "session_name", "node_type": "attribute", "path": ".", "required": True},
-            {"param_name": "kill_session", "node_type": "attribute", "path": ".", "required": False}
+            {"param_name": "kill_session", "node_type": "attribute", "path": ".", "required": False},
+            {"param_name": "offset", "node_type": "attribute", "path": ".", "required": False},
+            {"param_name": "tail_lines", "node_type": "attribute", "path": ".", "required": False}
         ],
         example='''
         <function_calls>
@@ -272,7 +380,15 @@ class SandboxShellTool(SandboxToolsBase):
         </invoke>
         </function_calls>
         
-        <!-- Example 2: Check final output and kill session -->
+        <!-- Example 2: Check only the output written since the last check -->
+        <function_calls>
+        <invoke name="check_command_output">
+        <parameter name="session_name">dev_server</parameter>
+        <parameter name="offset">10240</parameter>
+        </invoke>
+        </function_calls>
+        
+        <!-- Example 3: Check final output and kill session -->
         <function_calls>
         <invoke name="check_command_output">
         <parameter name="session_name">build_process</parameter>
@@ -284,33 +400,40 @@ class SandboxShellTool(SandboxToolsBase):
     async def check_command_output(
         self,
         session_name: str,
-        kill_session: bool = False
+        kill_session: bool = False,
+        offset: Optional[int] = None,
+        tail_lines: Optional[int] = None
     ) -> ToolResult:
         try:
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
-            # Check if session exists
-            check_result = await self._execute_raw_command(f"tmux has-session -t {session_name} 2>/dev/null || echo 'not_exists'")
-            if "not_exists" in check_result.get("output", ""):
+            # Get output, checking that the session exists in the same round-trip
+            read_result = await self._read_output(
+                session_name,
+                offset=int(offset) if offset is not None else None,
+                tail_lines=int(tail_lines) if tail_lines is not None else None
+            )
+            if read_result is None:
                 return self.fail_response(f"Tmux session '{session_name}' does not exist.")
             
-            # Get output from tmux pane
-            output_result = await self._execute_raw_command(f"tmux capture-pane -t {session_name} -p -S - -E -")
-            output = output_result.get("output", "")
-            
             # Kill session if requested
             if kill_session:
-                await self._execute_raw_command(f"tmux kill-session -t {session_name}")
+                await self._execute_raw_command(f"tmux kill-session -t {session_name} ; rm -f {self._log_path(session_name)}")
                 termination_status = "Session terminated."
             else:
                 termination_status = "Session still running."
             
-            return self.success_response({
-                "output": output,
+            response = {
+                "output": read_result["output"],
                 "session_name": session_name,
                 "status": termination_status
-            })
+            }
+            if read_result["next_offset"] is not None:
+                response["next_offset"] = read_result["next_offset"]
+            if read_result["truncated"]:
+                response["truncated"] = True
+            return self.success_response(response)
                 
         except Exception as e:
             return self.fail_response(f"Error checking command output: {str(e)}")
@@ -359,7 +482,7 @@ class SandboxShellTool(SandboxToolsBase):
                 return self.fail_response(f"Tmux session '{session_name}' does not exist.")
             
             # Kill the session
-            await self._execute_raw_command(f"tmux kill-session -t {session_name}")
+            await self._execute_raw_command(f"tmux kill-session -t {session_name} ; rm -f {self._log_path(session_name)}")
             
             return self.success_response({
                 "message": f"Tmux session '{session_name}' terminated successfully."
@@ -429,6 +552,6 @@ class SandboxShellTool(SandboxToolsBase):
         # Also clean up any tmux sessions
         try:
             await self._ensure_sandbox()
-            await self._execute_raw_command("tmux kill-server 2>/dev/null || true")
+            await self._execute_raw_command(f"tmux kill-server 2>/dev/null || true ; rm -rf {COMMAND_LOG_DIR}")
         except:
             pass
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""
+Shared fetch layer for the web search tool.
+
+Every SandboxWebSearchTool instance used to open its own HTTP client per URL
+and pay the full Firecrawl/Tavily round-trip for pages and queries the agent
+had already looked at. This module keeps one connection pool per process,
+bounds how many Firecrawl scrapes run at once (WEB_SCRAPE_MAX_CONCURRENCY),
+makes identical concurrent requests share one upstream call, and caches
+results in Redis:
+
+- scrapes under web:scrape:{sha256(url)} for WEB_SCRAPE_CACHE_TTL seconds
+- searches under web:search:{sha256(query, num_results)} for WEB_SEARCH_CACHE_TTL seconds
+
+Cached entries record when they were fetched, so callers can tell the agent
+how fresh a result is. Failed requests and failed or empty responses are
+never cached.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from services import redis
+from utils.config import config
+from utils.http_client import SharedHTTPClient
+from utils.logger import logger
+
+SCRAPE_CACHE_KEY_PREFIX = "web:scrape:"
+SEARCH_CACHE_KEY_PREFIX = "web:search:"
+
+SCRAPE_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+SCRAPE_MAX_RETRIES = 3
+POOL_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+
+# One connection pool and concurrency limit per process, and the requests
+# currently in flight so identical concurrent calls share one upstream request
+_http_client = SharedHTTPClient(timeout=SCRAPE_TIMEOUT, limits=POOL_LIMITS)
+_scrape_semaphore: Optional[asyncio.Semaphore] = None
+_in_flight: Dict[str, "asyncio.Task[Tuple[Dict[str, Any], str, bool]]"] = {}
+
+
+def _check_loop():
+    """Create the shared client and semaphore for the running event loop if needed."""
+    global _scrape_semaphore, _in_flight
+    if _http_client.ensure():
+        _scrape_semaphore = asyncio.Semaphore(max(1, config.WEB_SCRAPE_MAX_CONCURRENCY))
+        _in_flight = {}
+
+
+def _cache_key(prefix: str, *parts: Any) -> str:
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{prefix}{digest}"
+
+
+async def _get_cached(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        cached = await redis.get(key)
+        return json.loads(cached) if cached else None
+    except Exception as e:
+        logger.warning(f"Failed to read web cache entry {key}: {e}")
+        return None
+
+
+async def _set_cached(key: str, data: Any, fetched_at: str, ttl: int):
+    try:
+        await redis.set(key, json.dumps({"fetched_at": fetched_at, "data": data}, ensure_ascii=False), ex=ttl)
+    except Exception as e:
+        logger.warning(f"Failed to write web cache entry {key}: {e}")
+
+
+async def _cached_fetch(
+    key: str,
+    ttl: int,
+    fetch: Callable[[], Awaitable[Any]],
+) -> Tuple[Any, str, bool]:
+    """Return (data, fetched_at, from_cache), calling fetch() on a miss.
+
+    Concurrent misses for the same key share a single fetch.
+    """
+    if ttl > 0:
+        cached = await _get_cached(key)
+        if cached is not None:
+            return cached["data"], cached["fetched_at"], True
+
+    _check_loop()
+    request = _in_flight.get(key)
+    if request is None:
+        async def run():
+            data = await fetch()
+            fetched_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            if ttl > 0:
+                await _set_cached(key, data, fetched_at, ttl)
+            return data, fetched_at, False
+
+        request = asyncio.create_task(run())
+        _in_flight[key] = request
+        request.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # Shielded so a cancelled caller does not cancel the request for the others waiting on it
+    return await asyncio.shield(request)
+
+
+async def _firecrawl_scrape(url: str, api_url: str, api_key: str) -> Dict[str, Any]:
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "url": url,
+        "formats": ["markdown"]
+    }
+
+    for attempt in range(1, SCRAPE_MAX_RETRIES + 1):
+        try:
+            # Hold a concurrency slot only while the request is in flight, not during backoff
+            async with _scrape_semaphore:
+                logger.debug(f"Sending request to Firecrawl for {url} (attempt {attempt}/{SCRAPE_MAX_RETRIES})")
+                response = await _http_client.client().post(f"{api_url}/v1/scrape", json=payload, headers=headers)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ReadError) as timeout_err:
+            logger.warning(f"Firecrawl request for {url} timed out (attempt {attempt}/{SCRAPE_MAX_RETRIES}): {timeout_err}")
+            if attempt >= SCRAPE_MAX_RETRIES:
+                raise Exception(f"Request timed out after {SCRAPE_MAX_RETRIES} attempts with {SCRAPE_TIMEOUT.read}s timeout")
+        # Exponential backoff
+        await asyncio.sleep(2 ** attempt)
+
+
+class _UncacheableResponse(Exception):
+    """Raised inside a fetch to return a response without caching it."""
+
+    def __init__(self, response: Dict[str, Any]):
+        super().__init__("Response is not cacheable")
+        self.response = response
+
+
+async def scrape(url: str, api_url: str, api_key: str) -> Tuple[Dict[str, Any], str, bool]:
+    """Scrape a URL to markdown through Firecrawl.
+
+    Returns the Firecrawl response, when it was fetched (ISO 8601, UTC) and
+    whether it came from the cache.
+    """
+    key = _cache_key(SCRAPE_CACHE_KEY_PREFIX, url)
+
+    async def fetch():
+        response = await _firecrawl_scrape(url, api_url, api_key)
+        if not response.get("success", True) or not (response.get("data") or {}).get("markdown"):
+            # Don't cache failed or empty scrapes; let the next call retry
+            raise _UncacheableResponse(response)
+        return response
+
+    try:
+        return await _cached_fetch(key, config.WEB_SCRAPE_CACHE_TTL, fetch)
+    except _UncacheableResponse as e:
+        return e.response, datetime.datetime.now(datetime.timezone.utc).isoformat(), False
+
+
+async def search(
+    query: str,
+    num_results: int,
+    run_search: Callable[[], Awaitable[Dict[str, Any]]],
+) -> Tuple[Dict[str, Any], str, bool]:
+    """Run a web search through run_search(), or reuse a cached response for the same query."""
+    key = _cache_key(SEARCH_CACHE_KEY_PREFIX, query.strip(), num_results)
+
+    async def fetch():
+        response = await run_search()
+        if not response.get("results") and not (response.get("answer") or "").strip():
+            # Don't cache empty responses; let the next call retry
+            raise _UncacheableResponse(response)
+        return response
+
+    try:
+        return await _cached_fetch(key, config.WEB_SEARCH_CACHE_TTL, fetch)
+    except _UncacheableResponse as e:
+        return e.response, datetime.datetime.now(datetime.timezone.utc).isoformat(), False
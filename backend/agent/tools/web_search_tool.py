@@ -5,6 +5,8 @@ from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
 from utils.config import config
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
+from agent.tools import web_scrape_engine
+import hashlib
 import json
 import os
 import datetime
@@ -106,13 +108,19 @@ class SandboxWebSearchTool(SandboxToolsBase):
 
             # Execute the search with Tavily
             logging.info(f"Executing web search for query: '{query}' with {num_results} results")
-            search_response = await self.tavily_client.search(
-                query=query,
-                max_results=num_results,
-                include_images=True,
-                include_answer="advanced",
-                search_depth="advanced",
+            search_response, fetched_at, from_cache = await web_scrape_engine.search(
+                query,
+                num_results,
+                lambda: self.tavily_client.search(
+                    query=query,
+                    max_results=num_results,
+                    include_images=True,
+                    include_answer="advanced",
+                    search_depth="advanced",
+                ),
             )
+            if from_cache:
+                logging.info(f"Using cached search results for query: '{query}' fetched at {fetched_at}")
             
             # Check if we have actual results or an answer
             results = search_response.get('results', [])
@@ -210,26 +218,19 @@ class SandboxWebSearchTool(SandboxToolsBase):
             
             logging.info(f"Processing {len(url_list)} URLs: {url_list}")
             
-            # Process each URL and collect results
-            results = []
+            # Add protocol if missing, and drop duplicates
+            normalized_urls = []
             for url in url_list:
-                try:
-                    # Add protocol if missing
-                    if not (url.startswith('http://') or url.startswith('https://')):
-                        url = 'https://' + url
-                        logging.info(f"Added https:// protocol to URL: {url}")
-                    
-                    # Scrape this URL
-                    result = await self._scrape_single_url(url)
-                    results.append(result)
-                    
-                except Exception as e:
-                    logging.error(f"Error processing URL {url}: {str(e)}")
-                    results.append({
-                        "url": url,
-                        "success": False,
-                        "error": str(e)
-                    })
+                if not (url.startswith('http://') or url.startswith('https://')):
+                    url = 'https://' + url
+                    logging.info(f"Added https:// protocol to URL: {url}")
+                if url not in normalized_urls:
+                    normalized_urls.append(url)
+
+            await self.sandbox.fs.create_folder(f"{self.workspace_path}/scrape", "755")
+
+            # Scrape all URLs concurrently; the engine bounds how many hit Firecrawl at once
+            results = await asyncio.gather(*(self._scrape_single_url(url) for url in normalized_urls))
             
             # Summarize results
             successful = sum(1 for r in results if r.get("success", False))
@@ -271,48 +272,11 @@ class SandboxWebSearchTool(SandboxToolsBase):
         logging.info(f"Scraping single URL: {url}")
         
         try:
-            # ---------- Firecrawl scrape endpoint ----------
-            logging.info(f"Sending request to Firecrawl for URL: {url}")
-            async with httpx.AsyncClient() as client:
-                headers = {
-                    "Authorization": f"Bearer {self.firecrawl_api_key}",
-                    "Content-Type": "application/json",
-                }
-                payload = {
-                    "url": url,
-                    "formats": ["markdown"]
-                }
-                
-                # Use longer timeout and retry logic for more reliability
-                max_retries = 3
-                timeout_seconds = 120
-                retry_count = 0
-                
-                while retry_count < max_retries:
-                    try:
-                        logging.info(f"Sending request to Firecrawl (attempt {retry_count + 1}/{max_retries})")
-                        response = await client.post(
-                            f"{self.firecrawl_url}/v1/scrape",
-                            json=payload,
-                            headers=headers,
-                            timeout=timeout_seconds,
-                        )
-                        response.raise_for_status()
-                        data = response.json()
-                        logging.info(f"Successfully received response from Firecrawl for {url}")
-                        break
-                    except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ReadError) as timeout_err:
-                        retry_count += 1
-                        logging.warning(f"Request timed out (attempt {retry_count}/{max_retries}): {str(timeout_err)}")
-                        if retry_count >= max_retries:
-                            raise Exception(f"Request timed out after {max_retries} attempts with {timeout_seconds}s timeout")
-                        # Exponential backoff
-                        logging.info(f"Waiting {2 ** retry_count}s before retry")
-                        await asyncio.sleep(2 ** retry_count)
-                    except Exception as e:
-                        # Don't retry on non-timeout errors
-                        logging.error(f"Error during scraping: {str(e)}")
-                        raise e
+            data, fetched_at, from_cache = await web_scrape_engine.scrape(url, self.firecrawl_url, self.firecrawl_api_key)
+            if from_cache:
+                logging.info(f"Using cached scrape of {url} fetched at {fetched_at}")
+            else:
+                logging.info(f"Successfully received response from Firecrawl for {url}")
 
             # Format the response
             title = data.get("data", {}).get("metadata", {}).get("title", "")
@@ -322,7 +286,8 @@ class SandboxWebSearchTool(SandboxToolsBase):
             formatted_result = {
                 "title": title,
                 "url": url,
-                "text": markdown_content
+                "text": markdown_content,
+                "fetched_at": fetched_at
             }
             
             # Add metadata if available
@@ -338,16 +303,15 @@ class SandboxWebSearchTool(SandboxToolsBase):
             parsed_url = urlparse(url)
             domain = parsed_url.netloc.replace("www.", "")
             
-            # Clean up domain for filename
+            # Clean up domain for filename; the URL hash keeps pages of one domain scraped together apart
             domain = "".join([c if c.isalnum() else "_" for c in domain])
-            safe_filename = f"{timestamp}_{domain}.json"
+            url_hash = hashlib.sha256(url.encode()).hexdigest()[:8]
+            safe_filename = f"{timestamp}_{domain}_{url_hash}.json"
             
             logging.info(f"Generated filename: {safe_filename}")
             
             # Save results to a file in the /workspace/scrape directory
             scrape_dir = f"{self.workspace_path}/scrape"
-            await self.sandbox.fs.create_folder(scrape_dir, "755")
-            
             results_file_path = f"{scrape_dir}/{safe_filename}"
             json_content = json.dumps(formatted_result, ensure_ascii=False, indent=2)
             logging.info(f"Saving content to file: {results_file_path}, size: {len(json_content)} bytes")
@@ -362,7 +326,8 @@ class SandboxWebSearchTool(SandboxToolsBase):
                 "success": True,
                 "title": title,
                 "file_path": results_file_path,
-                "content_length": len(markdown_content)
+                "content_length": len(markdown_content),
+                "cached": from_cache
             }
         
         except Exception as e:
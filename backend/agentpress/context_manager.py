@@ -6,7 +6,8 @@ reaching the context window limitations of LLM models.
 """
 
 import json
-from typing import List, Dict, Any, Optional, Union
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Union
 
 from litellm.utils import token_counter
 from services.supabase import DBConnection
@@ -14,6 +15,15 @@ from utils.logger import logger
 
 DEFAULT_TOKEN_THRESHOLD = 120000
 
+# Per-message token counts, keyed by (model, message_id, content fingerprint).
+# Shared across ContextManager instances so repeat runs on the same thread in a
+# worker process do not re-tokenize messages that have not changed. Counts are
+# kept in this process only, not stored with the message: they depend on the
+# model and on compression rewriting content, so a restart or another worker
+# simply counts each message once more.
+TOKEN_CACHE_MAX_ENTRIES = 20000
+_token_cache: "OrderedDict[Tuple[str, Optional[str], int], int]" = OrderedDict()
+
 class ContextManager:
     """Manages thread context including token counting and summarization."""
     
@@ -26,6 +36,38 @@ class ContextManager:
         self.db = DBConnection()
         self.token_threshold = token_threshold
 
+    def _message_fingerprint(self, msg: Dict[str, Any]) -> int:
+        """Fingerprint the token-bearing parts of a message.
+
+        Compression rewrites msg["content"] in place, so the cache key has to
+        change with the content rather than rely on message_id alone.
+        """
+        content = msg.get('content')
+        if not isinstance(content, str):
+            content = json.dumps(content, default=str)
+        fingerprint = hash((msg.get('role'), content))
+        if msg.get('tool_calls'):
+            fingerprint = hash((fingerprint, json.dumps(msg['tool_calls'], default=str)))
+        return fingerprint
+
+    def count_message_tokens(self, msg: Dict[str, Any], llm_model: str) -> int:
+        """Get the token count of a single message, using the cache when possible."""
+        key = (llm_model, msg.get('message_id'), self._message_fingerprint(msg))
+        cached = _token_cache.get(key)
+        if cached is not None:
+            _token_cache.move_to_end(key)
+            return cached
+
+        count = token_counter(model=llm_model, messages=[msg])
+        _token_cache[key] = count
+        if len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+            _token_cache.popitem(last=False)
+        return count
+
+    def count_tokens(self, messages: List[Dict[str, Any]], llm_model: str) -> int:
+        """Get the token count of a message list by summing cached per-message counts."""
+        return sum(self.count_message_tokens(msg, llm_model) for msg in messages)
+
     def is_tool_result_message(self, msg: Dict[str, Any]) -> bool:
         """Check if a message is a tool result message."""
         if not ("content" in msg and msg['content']):
@@ -94,7 +136,7 @@ class ContextManager:
   
     def compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
 
         if uncompressed_total_token_count > max_tokens_value:
@@ -102,7 +144,7 @@ class ContextManager:
             for msg in reversed(messages):  # Start from the end and work backwards
                 if self.is_tool_result_message(msg):  # Only compress ToolResult messages
                     _i += 1  # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                    msg_token_count = self.count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
                         if _i > 1:  # If this is not the most recent ToolResult message
                             message_id = msg.get('message_id')  # Get the message_id
@@ -116,7 +158,7 @@ class ContextManager:
 
     def compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
 
         if uncompressed_total_token_count > max_tokens_value:
@@ -124,7 +166,7 @@ class ContextManager:
             for msg in reversed(messages):  # Start from the end and work backwards
                 if msg.get('role') == 'user':  # Only compress User messages
                     _i += 1  # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                    msg_token_count = self.count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
                         if _i > 1:  # If this is not the most recent User message
                             message_id = msg.get('message_id')  # Get the message_id
@@ -138,7 +180,7 @@ class ContextManager:
 
     def compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
         
         if uncompressed_total_token_count > max_tokens_value:
@@ -146,7 +188,7 @@ class ContextManager:
             for msg in reversed(messages):  # Start from the end and work backwards
                 if msg.get('role') == 'assistant':  # Only compress Assistant messages
                     _i += 1  # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                    msg_token_count = self.count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
                         if _i > 1:  # If this is not the most recent Assistant message
                             message_id = msg.get('message_id')  # Get the message_id
@@ -211,13 +253,13 @@ class ContextManager:
         result = messages
         result = self.remove_meta_messages(result)
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=result)
+        uncompressed_total_token_count = self.count_tokens(result, llm_model)
 
         result = self.compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
         result = self.compress_user_messages(result, llm_model, max_tokens, token_threshold)
         result = self.compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
 
-        compressed_token_count = token_counter(model=llm_model, messages=result)
+        compressed_token_count = self.count_tokens(result, llm_model)
 
         logger.info(f"compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}")  # Log the token compression for debugging later
 
@@ -256,7 +298,8 @@ class ContextManager:
         result = self.remove_meta_messages(result)
 
         # Early exit if no compression needed
-        initial_token_count = token_counter(model=llm_model, messages=result)
+        message_token_counts = [self.count_message_tokens(msg, llm_model) for msg in result]
+        initial_token_count = sum(message_token_counts)
         max_allowed_tokens = max_tokens or (100 * 1000)
         
         if initial_token_count <= max_allowed_tokens:
@@ -264,7 +307,9 @@ class ContextManager:
 
         # Separate system message (assumed to be first) from conversation messages
         system_message = messages[0] if messages and messages[0].get('role') == 'system' else None
+        system_token_count = self.count_message_tokens(system_message, llm_model) if system_message else 0
         conversation_messages = result[1:] if system_message else result
+        conversation_token_counts = message_token_counts[1:] if system_message else message_token_counts
         
         safety_limit = 500
         current_token_count = initial_token_count
@@ -282,22 +327,23 @@ class ContextManager:
                 middle_start = len(conversation_messages) // 2 - (removal_batch_size // 2)
                 middle_end = middle_start + removal_batch_size
                 conversation_messages = conversation_messages[:middle_start] + conversation_messages[middle_end:]
+                conversation_token_counts = conversation_token_counts[:middle_start] + conversation_token_counts[middle_end:]
             else:
                 # Remove from earlier messages, preserving recent context
                 messages_to_remove = min(removal_batch_size, len(conversation_messages) // 2)
                 if messages_to_remove > 0:
                     conversation_messages = conversation_messages[messages_to_remove:]
+                    conversation_token_counts = conversation_token_counts[messages_to_remove:]
                 else:
                     # Can't remove any more messages
                     break
 
-            # Recalculate token count
-            messages_to_count = ([system_message] + conversation_messages) if system_message else conversation_messages
-            current_token_count = token_counter(model=llm_model, messages=messages_to_count)
+            # Recalculate token count from the cached per-message counts
+            current_token_count = system_token_count + sum(conversation_token_counts)
 
         # Prepare final result
         final_messages = ([system_message] + conversation_messages) if system_message else conversation_messages
-        final_token_count = token_counter(model=llm_model, messages=final_messages)
+        final_token_count = current_token_count
         
         logger.info(f"compress_messages_by_omitting_messages: {initial_token_count} -> {final_token_count} tokens ({len(messages)} -> {len(final_messages)} messages)")
             
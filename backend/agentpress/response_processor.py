@@ -18,7 +18,7 @@ from dataclasses import dataclass
 from utils.logger import logger
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
-from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.xml_tool_parser import XMLToolParser, extract_xml_chunks
 from langfuse import Langfuse
 from services.langfuse import langfuse
 from agentpress.utils.json_helpers import (
@@ -161,7 +161,7 @@ class ResponseProcessor:
         """
         accumulated_content = ""
         tool_calls_buffer = {}
-        current_xml_content = ""
+        xml_chunk_extractor = self.xml_parser.create_stream_extractor(self.tool_registry.xml_tools.keys())
         xml_chunks_buffer = []
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
@@ -254,7 +254,6 @@ class ResponseProcessor:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
                         accumulated_content += chunk_content
-                        current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
@@ -274,9 +273,9 @@ class ResponseProcessor:
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
+                            # Only the new delta is scanned; blocks are returned as soon as they close
+                            xml_chunks = xml_chunk_extractor.feed(chunk_content)
                             for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
                                 xml_chunks_buffer.append(xml_chunk)
                                 result = self._parse_xml_tool_call(xml_chunk)
                                 if result:
@@ -378,6 +377,11 @@ class ResponseProcessor:
             # print() # Add a final newline after the streaming loop finishes
 
             # --- After Streaming Loop ---
+
+            if config.xml_tool_calling and finish_reason != "xml_tool_limit_reached":
+                # Legacy-format blocks only apply when the whole response has no function_calls
+                # block, so they are collected here and run with the final tool processing
+                xml_chunks_buffer.extend(xml_chunk_extractor.finish())
             
             if (
                 streaming_metadata["usage"]["total_tokens"] == 0
@@ -558,9 +562,7 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
+                    # The buffer holds every block from the stream plus any legacy blocks from finish()
                     # Process only chunks not already handled in the stream loop
                     remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
@@ -1095,95 +1097,13 @@ class ResponseProcessor:
 
     def _extract_xml_chunks(self, content: str) -> List[str]:
         """Extract complete XML chunks using start and end pattern matching."""
-        chunks = []
-        pos = 0
-        
         try:
-            # First, look for new format <function_calls> blocks
-            start_pattern = '<function_calls>'
-            end_pattern = '</function_calls>'
-            
-            while pos < len(content):
-                # Find the next function_calls block
-                start_pos = content.find(start_pattern, pos)
-                if start_pos == -1:
-                    break
-                
-                # Find the matching end tag
-                end_pos = content.find(end_pattern, start_pos)
-                if end_pos == -1:
-                    break
-                
-                # Extract the complete block including tags
-                chunk_end = end_pos + len(end_pattern)
-                chunk = content[start_pos:chunk_end]
-                chunks.append(chunk)
-                
-                # Move position past this chunk
-                pos = chunk_end
-            
-            # If no new format found, fall back to old format for backwards compatibility
-            if not chunks:
-                pos = 0
-                while pos < len(content):
-                    # Find the next tool tag
-                    next_tag_start = -1
-                    current_tag = None
-                    
-                    # Find the earliest occurrence of any registered tag
-                    for tag_name in self.tool_registry.xml_tools.keys():
-                        start_pattern = f'<{tag_name}'
-                        tag_pos = content.find(start_pattern, pos)
-                        
-                        if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
-                            next_tag_start = tag_pos
-                            current_tag = tag_name
-                    
-                    if next_tag_start == -1 or not current_tag:
-                        break
-                    
-                    # Find the matching end tag
-                    end_pattern = f'</{current_tag}>'
-                    tag_stack = []
-                    chunk_start = next_tag_start
-                    current_pos = next_tag_start
-                    
-                    while current_pos < len(content):
-                        # Look for next start or end tag of the same type
-                        next_start = content.find(f'<{current_tag}', current_pos + 1)
-                        next_end = content.find(end_pattern, current_pos)
-                        
-                        if next_end == -1:  # No closing tag found
-                            break
-                        
-                        if next_start != -1 and next_start < next_end:
-                            # Found nested start tag
-                            tag_stack.append(next_start)
-                            current_pos = next_start + 1
-                        else:
-                            # Found end tag
-                            if not tag_stack:  # This is our matching end tag
-                                chunk_end = next_end + len(end_pattern)
-                                chunk = content[chunk_start:chunk_end]
-                                chunks.append(chunk)
-                                pos = chunk_end
-                                break
-                            else:
-                                # Pop nested tag
-                                tag_stack.pop()
-                                current_pos = next_end + 1
-                    
-                    if current_pos >= len(content):  # Reached end without finding closing tag
-                        break
-                    
-                    pos = max(pos + 1, current_pos)
-        
+            return extract_xml_chunks(content, self.tool_registry.xml_tools.keys())
         except Exception as e:
             logger.error(f"Error extracting XML chunks: {e}")
             logger.error(f"Content was: {content}")
             self.trace.event(name="error_extracting_xml_chunks", level="ERROR", status_message=(f"Error extracting XML chunks: {e}"), metadata={"content": content})
-        
-        return chunks
+            return []
 
     def _parse_xml_tool_call(self, xml_chunk: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
         """Parse XML chunk into tool call format and return parsing details.
@@ -11,7 +11,7 @@ This module provides comprehensive conversation management, including:
 """
 
 import json
-from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, cast
+from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, Callable, Awaitable, cast
 from services.llm import make_llm_api_call
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
@@ -25,7 +25,6 @@ from utils.logger import logger
 from langfuse import Langfuse
 from services.langfuse import langfuse
 import datetime
-from litellm.utils import token_counter
 
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
@@ -38,7 +37,8 @@ class ThreadManager:
     XML-based tool execution patterns.
     """
 
-    def __init__(self, trace: Optional[Langfuse] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None):
+    def __init__(self, trace: Optional[Langfuse] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None,
+                 message_callback: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
         """Initialize ThreadManager.
 
         Args:
@@ -46,6 +46,7 @@ class ThreadManager:
             is_agent_builder: Whether this is an agent builder session
             target_agent_id: ID of the agent being built (if in agent builder mode)
             agent_config: Optional agent configuration with version information
+            message_callback: Optional async callback invoked with each saved message row
         """
         self.db = DBConnection()
         self.tool_registry = ToolRegistry()
@@ -53,6 +54,7 @@ class ThreadManager:
         self.is_agent_builder = is_agent_builder
         self.target_agent_id = target_agent_id
         self.agent_config = agent_config
+        self.message_callback = message_callback
         if not self.trace:
             self.trace = langfuse.trace(name="anonymous:thread_manager")
         self.response_processor = ResponseProcessor(
@@ -64,6 +66,9 @@ class ThreadManager:
             agent_config=self.agent_config
         )
         self.context_manager = ContextManager()
+        # Parsed LLM messages per thread, refreshed by created_at watermark so
+        # each auto-continue only fetches rows added since the previous call.
+        self._message_cache: Dict[str, Dict[str, Any]] = {}
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
@@ -117,6 +122,11 @@ class ThreadManager:
             logger.info(f"Successfully added message to thread {thread_id}")
 
             if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
+                if self.message_callback:
+                    try:
+                        await self.message_callback(result.data[0])
+                    except Exception as e:
+                        logger.warning(f"Message callback failed for thread {thread_id}: {str(e)}")
                 return result.data[0]
             else:
                 logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
@@ -128,8 +138,10 @@ class ThreadManager:
     async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
 
-        This method uses the SQL function which handles context truncation
-        by considering summary messages.
+        Messages are cached per thread for the lifetime of this ThreadManager.
+        Each call only fetches rows created at or after the last seen
+        created_at watermark, so repeated calls within a run are proportional
+        to the number of new messages rather than the thread length.
 
         Args:
             thread_id: The ID of the thread to get messages for.
@@ -140,51 +152,64 @@ class ThreadManager:
         logger.debug(f"Getting messages for thread {thread_id}")
         client = await self.db.client
 
+        cache = self._message_cache.setdefault(thread_id, {
+            'messages': [],
+            'message_ids': set(),
+            'last_created_at': None,
+        })
+
         try:
             # result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
             
-            # Fetch messages in batches of 1000 to avoid overloading the database
-            all_messages = []
+            # Fetch new messages in batches of 1000 to avoid overloading the database
+            new_rows = []
             batch_size = 1000
             offset = 0
+            watermark = cache['last_created_at']
             
             while True:
-                result = await client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').range(offset, offset + batch_size - 1).execute()
+                query = client.table('messages').select('message_id, content, created_at').eq('thread_id', thread_id).eq('is_llm_message', True)
+                if watermark:
+                    # gte rather than gt so rows sharing the watermark timestamp are not missed;
+                    # already cached rows are skipped by message_id below
+                    query = query.gte('created_at', watermark)
+                result = await query.order('created_at').range(offset, offset + batch_size - 1).execute()
                 
                 if not result.data or len(result.data) == 0:
                     break
                     
-                all_messages.extend(result.data)
+                new_rows.extend(result.data)
                 
                 # If we got fewer than batch_size records, we've reached the end
                 if len(result.data) < batch_size:
                     break
                     
                 offset += batch_size
-            
-            # Use all_messages instead of result.data in the rest of the method
-            result_data = all_messages
-
-            # Parse the returned data which might be stringified JSON
-            if not result_data:
-                return []
 
-            # Return properly parsed JSON objects
-            messages = []
-            for item in result_data:
+            # Parse only rows we have not seen before; the returned data might be stringified JSON
+            for item in new_rows:
+                if item['message_id'] in cache['message_ids']:
+                    continue
                 if isinstance(item['content'], str):
                     try:
                         parsed_item = json.loads(item['content'])
                         parsed_item['message_id'] = item['message_id']
-                        messages.append(parsed_item)
+                        cache['messages'].append(parsed_item)
                     except json.JSONDecodeError:
                         logger.error(f"Failed to parse message: {item['content']}")
                 else:
                     content = item['content']
                     content['message_id'] = item['message_id']
-                    messages.append(content)
+                    cache['messages'].append(content)
+                cache['message_ids'].add(item['message_id'])
+                cache['last_created_at'] = item['created_at']
+
+            if new_rows:
+                logger.debug(f"Fetched {len(new_rows)} new rows for thread {thread_id} ({len(cache['messages'])} cached messages)")
 
-            return messages
+            # Return shallow copies so callers that rewrite message content
+            # (e.g. context compression) do not mutate the cache
+            return [message.copy() for message in cache['messages']]
 
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
@@ -312,7 +337,7 @@ Here are the XML tools available with examples:
                 token_count = 0
                 try:
                     # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
+                    token_count = self.context_manager.count_tokens([working_system_prompt] + messages, llm_model)
                     token_threshold = self.context_manager.token_threshold
                     logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
 
@@ -7,7 +7,7 @@ the Cursor-style format with structured function_calls blocks.
 
 import re
 import xml.etree.ElementTree as ET
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 from dataclasses import dataclass
 import json
 import logging
@@ -24,6 +24,216 @@ class XMLToolCall:
     parsing_details: Dict[str, Any]
 
 
+FUNCTION_CALLS_START = '<function_calls>'
+FUNCTION_CALLS_END = '</function_calls>'
+
+
+def extract_function_calls_chunks(content: str) -> List[str]:
+    """Extract complete <function_calls>...</function_calls> blocks from content."""
+    chunks = []
+    pos = 0
+    while pos < len(content):
+        # Find the next function_calls block
+        start_pos = content.find(FUNCTION_CALLS_START, pos)
+        if start_pos == -1:
+            break
+        
+        # Find the matching end tag
+        end_pos = content.find(FUNCTION_CALLS_END, start_pos)
+        if end_pos == -1:
+            break
+        
+        # Extract the complete block including tags
+        chunk_end = end_pos + len(FUNCTION_CALLS_END)
+        chunks.append(content[start_pos:chunk_end])
+        
+        # Move position past this chunk
+        pos = chunk_end
+    return chunks
+
+
+def extract_legacy_chunks(content: str, tag_names: Iterable[str]) -> List[str]:
+    """Extract complete legacy <tag_name ...>...</tag_name> blocks, counting nested tags of the same name."""
+    tag_names = list(tag_names)
+    chunks = []
+    pos = 0
+    while pos < len(content):
+        # Find the next tool tag
+        next_tag_start = -1
+        current_tag = None
+        
+        # Find the earliest occurrence of any registered tag
+        for tag_name in tag_names:
+            start_pattern = f'<{tag_name}'
+            tag_pos = content.find(start_pattern, pos)
+            
+            if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
+                next_tag_start = tag_pos
+                current_tag = tag_name
+        
+        if next_tag_start == -1 or not current_tag:
+            break
+        
+        # Find the matching end tag
+        end_pattern = f'</{current_tag}>'
+        tag_stack = []
+        chunk_start = next_tag_start
+        current_pos = next_tag_start
+        
+        while current_pos < len(content):
+            # Look for next start or end tag of the same type
+            next_start = content.find(f'<{current_tag}', current_pos + 1)
+            next_end = content.find(end_pattern, current_pos)
+            
+            if next_end == -1:  # No closing tag found
+                break
+            
+            if next_start != -1 and next_start < next_end:
+                # Found nested start tag
+                tag_stack.append(next_start)
+                current_pos = next_start + 1
+            else:
+                # Found end tag
+                if not tag_stack:  # This is our matching end tag
+                    chunk_end = next_end + len(end_pattern)
+                    chunks.append(content[chunk_start:chunk_end])
+                    pos = chunk_end
+                    break
+                else:
+                    # Pop nested tag
+                    tag_stack.pop()
+                    current_pos = next_end + 1
+        
+        if current_pos >= len(content):  # Reached end without finding closing tag
+            break
+        
+        pos = max(pos + 1, current_pos)
+    return chunks
+
+
+def extract_xml_chunks(content: str, legacy_tags: Iterable[str] = ()) -> List[str]:
+    """Extract complete tool call blocks from a full response.
+
+    <function_calls> blocks are returned if there are any; otherwise legacy
+    blocks of the given tag names are, for backwards compatibility.
+    """
+    return extract_function_calls_chunks(content) or extract_legacy_chunks(content, legacy_tags)
+
+
+class StreamingXMLChunkExtractor:
+    """
+    Incremental extractor for tool call blocks in streamed content.
+
+    Content is fed delta by delta and returns the same blocks as
+    extract_xml_chunks() on the full response:
+
+    - <function_calls>...</function_calls> blocks are returned by feed() as
+      soon as their closing tag arrives
+    - legacy <tag_name ...>...</tag_name> blocks are only a fallback for
+      responses without any complete function_calls block, which is not known
+      until the response ends, so finish() returns them
+
+    Only new text is scanned on each feed. Text that can no longer be the start
+    of a function_calls block is dropped, so the buffer holds at most the open
+    block plus a few characters of a tag that may still be arriving. The full
+    text is kept for the legacy fallback only until a function_calls block
+    completes.
+    """
+
+    FUNCTION_CALLS_START = FUNCTION_CALLS_START
+    FUNCTION_CALLS_END = FUNCTION_CALLS_END
+
+    def __init__(self, legacy_tags: Iterable[str] = ()):
+        """
+        Initialize the extractor.
+
+        Args:
+            legacy_tags: XML tag names of tools to extract in the legacy format.
+                         The function_calls format is always extracted.
+        """
+        self._legacy_tags = list(legacy_tags)
+        # Full text for the legacy fallback, dropped once a function_calls block completes
+        self._text: Optional[List[str]] = [] if self._legacy_tags else None
+        self._found_function_calls = False
+        self._buffer = ""
+        self._scan_pos = 0
+        # Start of the open function_calls block in the buffer, if any
+        self._block_start: Optional[int] = None
+
+    def feed(self, content: str) -> List[str]:
+        """
+        Consume a content delta.
+
+        Args:
+            content: The newly streamed text
+
+        Returns:
+            List of function_calls blocks completed by this delta, in order of appearance
+        """
+        if self._text is not None:
+            self._text.append(content)
+        self._buffer += content
+        chunks = []
+        while True:
+            if self._block_start is None and not self._find_block_start():
+                break
+            chunk = self._find_block_end()
+            if chunk is None:
+                break
+            chunks.append(chunk)
+        if chunks:
+            self._found_function_calls = True
+            self._text = None
+        return chunks
+
+    def finish(self) -> List[str]:
+        """
+        Signal the end of the response.
+
+        Returns:
+            The legacy blocks of the response if it has no complete function_calls block
+        """
+        if self._found_function_calls or not self._text:
+            return []
+        text = "".join(self._text)
+        self._text = None
+        return extract_legacy_chunks(text, self._legacy_tags)
+
+    def _find_block_start(self) -> bool:
+        """Look for the next function_calls opening tag, entering the block state if found."""
+        buffer = self._buffer
+        pos = buffer.find(FUNCTION_CALLS_START, self._scan_pos)
+        if pos != -1:
+            self._block_start = pos
+            self._scan_pos = pos + len(FUNCTION_CALLS_START)
+            return True
+        
+        # Keep a tail that may become an opening tag once more content arrives
+        keep_from = len(buffer)
+        for length in range(min(len(FUNCTION_CALLS_START) - 1, len(buffer)), 0, -1):
+            if FUNCTION_CALLS_START.startswith(buffer[-length:]):
+                keep_from = len(buffer) - length
+                break
+        self._buffer = buffer[keep_from:]
+        self._scan_pos = 0
+        return False
+
+    def _find_block_end(self) -> Optional[str]:
+        """Scan the open block for its closing tag and return the block once complete."""
+        buffer = self._buffer
+        end_pos = buffer.find(FUNCTION_CALLS_END, self._scan_pos)
+        if end_pos == -1:
+            # The closing tag may be split across deltas
+            self._scan_pos = max(self._scan_pos, len(buffer) - len(FUNCTION_CALLS_END) + 1)
+            return None
+        chunk_end = end_pos + len(FUNCTION_CALLS_END)
+        chunk = buffer[self._block_start:chunk_end]
+        self._buffer = buffer[chunk_end:]
+        self._scan_pos = 0
+        self._block_start = None
+        return chunk
+
+
 class XMLToolParser:
     """
     Parser for XML tool calls using the Cursor-style format:
@@ -62,6 +272,19 @@ class XMLToolParser:
         """
         self.strict_mode = strict_mode
     
+    def create_stream_extractor(self, legacy_tags: Iterable[str] = ()) -> StreamingXMLChunkExtractor:
+        """
+        Create an incremental extractor for a streamed response.
+        
+        Args:
+            legacy_tags: XML tag names of tools to extract in the legacy format,
+                         ignored in strict mode
+            
+        Returns:
+            A StreamingXMLChunkExtractor whose blocks can be passed to parse_content
+        """
+        return StreamingXMLChunkExtractor(() if self.strict_mode else legacy_tags)
+    
     def parse_content(self, content: str) -> List[XMLToolCall]:
         """
         Parse XML tool calls from content.
@@ -0,0 +1,124 @@
+"""
+Benchmark inputs: LLM chunk streams and conversation threads.
+
+Chunk streams are either recorded from a real LiteLLM stream with
+benchmarks/record_stream.py (JSONL, one chunk per line, stored in
+benchmarks/recordings/) or generated synthetically with the same shape.
+Synthetic threads are deterministic for a given size so runs are comparable.
+"""
+
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+RECORDINGS_DIR = Path(__file__).parent / "recordings"
+
+# Rough size of an LLM token in characters; deltas are cut to a few tokens each
+AVERAGE_DELTA_CHARS = 12
+
+_WORDS = (
+    "agent sandbox file browser deploy search result update config request response "
+    "python function parameter value thread message tool output error build project "
+    "the a of to and in with for on is that this we will now next then"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(_sentence(rng, rng.randint(6, 18)) for _ in range(sentences))
+
+
+def _function_calls_block(rng: random.Random, index: int) -> str:
+    file_content = "\n".join(f"line {line}: {_sentence(rng, 8)}" for line in range(rng.randint(20, 80)))
+    return (
+        "<function_calls>\n"
+        "<invoke name=\"create_file\">\n"
+        f"<parameter name=\"file_path\">src/module_{index}.py</parameter>\n"
+        f"<parameter name=\"file_contents\">{file_content}</parameter>\n"
+        "</invoke>\n"
+        "</function_calls>"
+    )
+
+
+def synthetic_response_text(tool_calls: int, seed: int = 0) -> str:
+    """Assistant response with prose between tool call blocks."""
+    rng = random.Random(seed)
+    parts = [_paragraph(rng, 4)]
+    for index in range(tool_calls):
+        parts.append(_function_calls_block(rng, index))
+        parts.append(_paragraph(rng, 2))
+    return "\n\n".join(parts)
+
+
+def split_into_chunks(text: str, model: str = "synthetic", seed: int = 0) -> List[Dict[str, Any]]:
+    """Split text into LiteLLM-shaped streaming chunks, ending with a usage chunk."""
+    rng = random.Random(seed)
+    created = int(time.time())
+    chunks = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, AVERAGE_DELTA_CHARS * 2)
+        chunks.append({
+            "id": "chatcmpl-synthetic", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": text[pos:pos + size]}, "finish_reason": None}],
+        })
+        pos += size
+    chunks.append({
+        "id": "chatcmpl-synthetic", "created": created, "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": len(chunks), "total_tokens": 1000 + len(chunks)},
+    })
+    return chunks
+
+
+def synthetic_stream(tool_calls: int, seed: int = 0) -> List[Dict[str, Any]]:
+    return split_into_chunks(synthetic_response_text(tool_calls, seed), seed=seed)
+
+
+def load_recording(path: Path) -> List[Dict[str, Any]]:
+    """Load a recorded chunk stream (JSONL)."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def list_recordings() -> List[Path]:
+    return sorted(RECORDINGS_DIR.glob("*.jsonl")) if RECORDINGS_DIR.exists() else []
+
+
+def synthetic_thread(message_count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """LLM messages of a thread cycling user -> assistant (with tool call) -> tool result."""
+    rng = random.Random(seed)
+    messages = []
+    for index in range(message_count):
+        message_id = f"00000000-0000-0000-0000-{index:012d}"
+        kind = index % 3
+        if kind == 0:
+            message = {"role": "user", "content": _paragraph(rng, rng.randint(1, 4))}
+        elif kind == 1:
+            message = {"role": "assistant", "content": _paragraph(rng, 2) + "\n\n" + _function_calls_block(rng, index)}
+        else:
+            output = "\n".join(_sentence(rng, 12) for _ in range(rng.randint(10, 200)))
+            message = {"role": "user", "content": json.dumps({"tool_execution": {"function_name": "create_file", "result": {"success": True, "output": output}}})}
+        message["message_id"] = message_id
+        messages.append(message)
+    return messages
+
+
+def thread_rows(thread_id: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """messages table rows for a synthetic thread, as ThreadManager reads them."""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for index, message in enumerate(messages):
+        content = {key: value for key, value in message.items() if key != "message_id"}
+        rows.append({
+            "message_id": message["message_id"], "thread_id": thread_id, "type": "user" if content["role"] == "user" else "assistant",
+            "is_llm_message": True, "content": json.dumps(content),
+            "created_at": (start + timedelta(seconds=index)).isoformat(),
+        })
+    return rows
@@ -0,0 +1,53 @@
+"""
+Record a real LiteLLM chunk stream for replay by the benchmarks.
+
+Usage (from backend/, with provider API keys configured):
+    python -m benchmarks.record_stream --model anthropic/claude-sonnet-4-20250514 \
+        --prompt "Create three small Python files using your file tools" --name sonnet_files
+"""
+
+import argparse
+import asyncio
+import json
+
+from benchmarks.fixtures import RECORDINGS_DIR
+from services.llm import make_llm_api_call
+
+SYSTEM_PROMPT = (
+    "You can call tools by writing blocks of the form:\n"
+    "<function_calls>\n<invoke name=\"tool_name\">\n<parameter name=\"param\">value</parameter>\n</invoke>\n</function_calls>\n"
+    "Available tools: create_file(file_path, file_contents), execute_command(command)."
+)
+
+
+def _chunk_to_dict(chunk) -> dict:
+    if hasattr(chunk, "model_dump"):
+        return chunk.model_dump(mode="json")
+    return json.loads(json.dumps(chunk, default=lambda value: getattr(value, "__dict__", str(value))))
+
+
+async def record(model: str, prompt: str, name: str) -> None:
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+    response = await make_llm_api_call(messages, model, stream=True, max_tokens=8000)
+
+    RECORDINGS_DIR.mkdir(exist_ok=True)
+    path = RECORDINGS_DIR / f"{name}.jsonl"
+    count = 0
+    with open(path, "w") as f:
+        async for chunk in response:
+            f.write(json.dumps(_chunk_to_dict(chunk)) + "\n")
+            count += 1
+    print(f"Recorded {count} chunks to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a LiteLLM chunk stream for benchmark replay")
+    parser.add_argument("--model", required=True, help="LiteLLM model name")
+    parser.add_argument("--prompt", required=True, help="User prompt to send")
+    parser.add_argument("--name", required=True, help="Recording name (file stem in benchmarks/recordings)")
+    args = parser.parse_args()
+    asyncio.run(record(args.model, args.prompt, args.name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Benchmarks for the agentpress hot path.
+
+Runs against in-memory Supabase, Redis and Langfuse stubs (benchmarks/stubs.py):
+
+- streaming: ResponseProcessor.process_streaming_response replaying synthetic
+  and recorded LiteLLM chunk streams, with every yielded response written
+  through ResponseBatchWriter as the background worker does
+- xml_parser: XMLToolParser.parse_content and the incremental chunk extractor
+- compression: ContextManager.compress_messages on threads of 10-5000 messages,
+  with a cold and a warm token cache
+- get_llm_messages: ThreadManager.get_llm_messages full load and incremental refresh
+
+Usage (from backend/):
+    python -m benchmarks.run                        # all benchmarks
+    python -m benchmarks.run --only compression --sizes 10,1000
+    python -m benchmarks.run --json results.json    # save results
+    python -m benchmarks.run --baseline results.json --max-regression 0.25
+      (exits with status 1 if any timing is more than 25% slower than the baseline)
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from benchmarks import fixtures
+from benchmarks.stubs import (
+    MessageStore, NullTrace, StubDBConnection, StubRedis, StubSupabaseClient, replay_stream, to_chunk,
+)
+
+DEFAULT_THREAD_SIZES = [10, 100, 1000, 5000]
+DEFAULT_STREAM_TOOL_CALLS = [0, 5, 20]
+COMPRESSION_MODEL = "gpt-4o"
+
+# Metrics where a higher value is a regression
+TIMING_METRICS = ("seconds", "per_chunk_overhead_us", "cold_ms", "warm_ms", "full_load_ms", "refresh_ms", "per_call_us", "per_feed_us")
+
+
+def _quiet_logs() -> None:
+    """Drop info/debug logs so terminal I/O does not dominate the timings."""
+    try:
+        import structlog
+        structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    except ImportError:
+        logging.getLogger().setLevel(logging.WARNING)
+
+
+async def _measure(func: Callable[[], Awaitable[Any]]) -> Tuple[float, Any]:
+    gc.collect()
+    start = time.perf_counter()
+    result = await func()
+    return time.perf_counter() - start, result
+
+
+async def _peak_memory(func: Callable[[], Awaitable[Any]]) -> int:
+    """Peak bytes allocated while running func (separate run, tracemalloc slows code down)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        await func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+async def bench_streaming(streams: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    from agentpress.response_processor import ProcessorConfig, ResponseProcessor
+    from agentpress.tool_registry import ToolRegistry
+    from services import redis, response_stream
+
+    stub_redis = StubRedis()
+    redis.client = stub_redis
+    redis._initialized = True
+
+    config = ProcessorConfig(xml_tool_calling=True, native_tool_calling=False, execute_tools=False)
+    results = []
+    for name, recorded in streams.items():
+        chunks = [to_chunk(chunk) for chunk in recorded]
+
+        async def replay_only():
+            async for _ in replay_stream(chunks):
+                pass
+
+        async def process():
+            processor = ResponseProcessor(ToolRegistry(), MessageStore().add_message, trace=NullTrace())
+            writer = response_stream.ResponseBatchWriter("benchmark-run")
+            yielded = 0
+            async for response in processor.process_streaming_response(
+                replay_stream(chunks), "benchmark-thread", [], "synthetic", config
+            ):
+                await writer.add(response)
+                yielded += 1
+            await writer.close()
+            return yielded
+
+        baseline_seconds, _ = await _measure(replay_only)
+        round_trips_before = stub_redis.round_trips
+        seconds, yielded = await _measure(process)
+        round_trips = stub_redis.round_trips - round_trips_before
+        results.append({
+            "benchmark": "streaming", "case": name, "chunks": len(chunks), "responses": yielded,
+            "redis_round_trips": round_trips, "seconds": seconds,
+            "chunks_per_sec": len(chunks) / seconds if seconds else 0,
+            "per_chunk_overhead_us": (seconds - baseline_seconds) / len(chunks) * 1e6 if chunks else 0,
+            "peak_memory_kb": await _peak_memory(process) / 1024,
+        })
+    return results
+
+
+async def bench_xml_parser(iterations: int = 200) -> List[Dict[str, Any]]:
+    from agentpress.xml_tool_parser import XMLToolParser
+
+    parser = XMLToolParser(strict_mode=False)
+    results = []
+    for tool_calls in (1, 10):
+        text = fixtures.synthetic_response_text(tool_calls)
+
+        async def parse():
+            for _ in range(iterations):
+                parser.parse_content(text)
+
+        seconds, _ = await _measure(parse)
+        results.append({
+            "benchmark": "xml_parser", "case": f"parse_content/{tool_calls}_calls", "chars": len(text),
+            "seconds": seconds, "per_call_us": seconds / iterations * 1e6,
+        })
+
+        deltas = [chunk["choices"][0]["delta"].get("content") or "" for chunk in fixtures.split_into_chunks(text)]
+
+        async def extract():
+            extractor = parser.create_stream_extractor()
+            for delta in deltas:
+                extractor.feed(delta)
+
+        seconds, _ = await _measure(extract)
+        results.append({
+            "benchmark": "xml_parser", "case": f"stream_extractor/{tool_calls}_calls", "chunks": len(deltas),
+            "seconds": seconds, "per_feed_us": seconds / len(deltas) * 1e6,
+        })
+    return results
+
+
+async def bench_compression(sizes: List[int]) -> List[Dict[str, Any]]:
+    from agentpress import context_manager
+
+    manager = context_manager.ContextManager()
+    results = []
+    for size in sizes:
+        messages = fixtures.synthetic_thread(size)
+
+        async def compress():
+            return manager.compress_messages([message.copy() for message in messages], COMPRESSION_MODEL)
+
+        context_manager._token_cache.clear()
+        cold_seconds, compressed = await _measure(compress)
+        warm_seconds, _ = await _measure(compress)
+        context_manager._token_cache.clear()
+        results.append({
+            "benchmark": "compression", "case": f"{size}_messages", "messages_out": len(compressed),
+            "cold_ms": cold_seconds * 1000, "warm_ms": warm_seconds * 1000,
+            "peak_memory_kb": await _peak_memory(compress) / 1024,
+        })
+    return results
+
+
+async def bench_get_llm_messages(sizes: List[int]) -> List[Dict[str, Any]]:
+    from agentpress.thread_manager import ThreadManager
+
+    results = []
+    for size in sizes:
+        thread_id = f"benchmark-thread-{size}"
+        rows = fixtures.thread_rows(thread_id, fixtures.synthetic_thread(size + 3))
+        client = StubSupabaseClient({"messages": rows[:size]})
+
+        def new_manager() -> ThreadManager:
+            manager = ThreadManager(trace=NullTrace())
+            manager.db = StubDBConnection(client)
+            return manager
+
+        manager = new_manager()
+        full_seconds, loaded = await _measure(lambda: manager.get_llm_messages(thread_id))
+        client.tables["messages"].extend(rows[size:])
+        refresh_seconds, refreshed = await _measure(lambda: manager.get_llm_messages(thread_id))
+        del client.tables["messages"][size:]
+
+        results.append({
+            "benchmark": "get_llm_messages", "case": f"{size}_messages", "loaded": len(loaded), "refreshed": len(refreshed),
+            "full_load_ms": full_seconds * 1000, "refresh_ms": refresh_seconds * 1000,
+            "peak_memory_kb": await _peak_memory(lambda: new_manager().get_llm_messages(thread_id)) / 1024,
+        })
+    return results
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    current = None
+    for result in results:
+        if result["benchmark"] != current:
+            current = result["benchmark"]
+            print(f"\n== {current} ==")
+        metrics = "  ".join(f"{key}={_format_value(value)}" for key, value in result.items() if key not in ("benchmark", "case"))
+        print(f"{result['case']:<32} {metrics}")
+
+
+def compare_to_baseline(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], max_regression: float) -> List[str]:
+    """List timing metrics that got slower than the baseline by more than max_regression."""
+    baseline_by_case = {(item["benchmark"], item["case"]): item for item in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_case.get((result["benchmark"], result["case"]))
+        if not previous:
+            continue
+        for metric in TIMING_METRICS:
+            if metric in result and previous.get(metric):
+                change = (result[metric] - previous[metric]) / previous[metric]
+                if change > max_regression:
+                    regressions.append(
+                        f"{result['benchmark']}/{result['case']} {metric}: "
+                        f"{previous[metric]:.2f} -> {result[metric]:.2f} (+{change:.0%})"
+                    )
+    return regressions
+
+
+async def run(only: Optional[List[str]], sizes: List[int]) -> List[Dict[str, Any]]:
+    streams = {f"synthetic_{count}_calls": fixtures.synthetic_stream(count) for count in DEFAULT_STREAM_TOOL_CALLS}
+    for path in fixtures.list_recordings():
+        streams[f"recorded_{path.stem}"] = fixtures.load_recording(path)
+
+    benchmarks = {
+        "streaming": lambda: bench_streaming(streams),
+        "xml_parser": bench_xml_parser,
+        "compression": lambda: bench_compression(sizes),
+        "get_llm_messages": lambda: bench_get_llm_messages(sizes),
+    }
+    results = []
+    for name, bench in benchmarks.items():
+        if only and name not in only:
+            continue
+        results.extend(await bench())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agentpress hot path")
+    parser.add_argument("--only", help="Comma separated benchmarks: streaming,xml_parser,compression,get_llm_messages")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_THREAD_SIZES), help="Thread sizes in messages")
+    parser.add_argument("--json", dest="json_path", help="Write results to this file")
+    parser.add_argument("--baseline", help="Results file from a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--verbose-logs", action="store_true", help="Keep info/debug logging enabled")
+    args = parser.parse_args()
+
+    if not args.verbose_logs:
+        _quiet_logs()
+
+    only = args.only.split(",") if args.only else None
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = asyncio.run(run(only, sizes))
+    print_report(results)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+In-memory stand-ins for the services the agentpress hot path talks to.
+
+They implement just the subset of the Supabase, Redis and Langfuse client
+APIs the benchmarked code uses, so benchmarks measure our own processing and
+not network latency.
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+
+class NullSpan:
+    def end(self, **kwargs):
+        pass
+
+
+class NullTrace:
+    """Langfuse trace that records nothing."""
+
+    def event(self, **kwargs):
+        pass
+
+    def span(self, **kwargs) -> NullSpan:
+        return NullSpan()
+
+
+def to_chunk(data: Any) -> Any:
+    """Convert a recorded chunk (plain JSON) into an attribute-access object like a LiteLLM chunk."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{key: to_chunk(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return [to_chunk(item) for item in data]
+    return data
+
+
+async def replay_stream(chunks: List[Any]):
+    """Async generator yielding pre-built chunks, standing in for a LiteLLM stream."""
+    for chunk in chunks:
+        yield chunk
+
+
+class MessageStore:
+    """add_message callback that keeps saved messages in memory."""
+
+    def __init__(self):
+        self.messages: List[Dict[str, Any]] = []
+
+    async def add_message(self, thread_id: str, type: str, content: Any, is_llm_message: bool = False,
+                          metadata: Optional[Dict[str, Any]] = None, agent_id: Optional[str] = None,
+                          agent_version_id: Optional[str] = None) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc).isoformat()
+        message = {
+            "message_id": str(uuid.uuid4()), "thread_id": thread_id, "type": type,
+            "is_llm_message": is_llm_message, "content": content, "metadata": metadata or {},
+            "created_at": now, "updated_at": now,
+        }
+        self.messages.append(message)
+        return message
+
+
+class _StubResult:
+    def __init__(self, data: List[Dict[str, Any]]):
+        self.data = data
+
+
+class _StubQuery:
+    """Chainable query supporting the postgrest filters used by ThreadManager.get_llm_messages."""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self._rows = rows
+        self._filters = []
+        self._order = None
+        self._range = None
+        self._columns = None
+
+    def select(self, columns: str = "*"):
+        if columns != "*":
+            self._columns = [column.strip() for column in columns.split(",")]
+        return self
+
+    def eq(self, column: str, value: Any):
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gte(self, column: str, value: Any):
+        self._filters.append(lambda row: row.get(column) >= value)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self._order = (column, desc)
+        return self
+
+    def range(self, start: int, end: int):
+        self._range = (start, end)
+        return self
+
+    async def execute(self) -> _StubResult:
+        rows = [row for row in self._rows if all(check(row) for check in self._filters)]
+        if self._order:
+            column, desc = self._order
+            rows.sort(key=lambda row: row[column], reverse=desc)
+        if self._range:
+            start, end = self._range
+            rows = rows[start:end + 1]
+        if self._columns:
+            rows = [{column: row.get(column) for column in self._columns} for row in rows]
+        # Rows come back as fresh objects with JSON-encoded content, like the wire format
+        return _StubResult([json.loads(json.dumps(row)) for row in rows])
+
+
+class StubSupabaseClient:
+    """Async Supabase client over in-memory tables."""
+
+    def __init__(self, tables: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        self.tables = tables or {}
+
+    def table(self, name: str) -> _StubQuery:
+        return _StubQuery(self.tables.setdefault(name, []))
+
+
+class StubDBConnection:
+    """Drop-in for services.supabase.DBConnection."""
+
+    def __init__(self, client: StubSupabaseClient):
+        self._client = client
+
+    @property
+    async def client(self) -> StubSupabaseClient:
+        return self._client
+
+
+class _StubPipeline:
+    def __init__(self, redis: "StubRedis"):
+        self._redis = redis
+        self._commands = []
+
+    def rpush(self, key: str, *values: str):
+        self._commands.append(("rpush", (key, *values)))
+
+    def publish(self, channel: str, message: str):
+        self._commands.append(("publish", (channel, message)))
+
+    def xadd(self, key: str, fields: Dict[str, str]):
+        self._commands.append(("xadd", (key, fields)))
+
+    async def execute(self) -> List[Any]:
+        await self._redis._round_trip()
+        commands, self._commands = self._commands, []
+        return [await getattr(self._redis, name)(*args) for name, args in commands]
+
+
+class StubRedis:
+    """Async Redis client over in-memory lists and streams."""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.lists: Dict[str, List[str]] = {}
+        self.streams: Dict[str, List[Any]] = {}
+        self.published = 0
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def rpush(self, key: str, *values: str) -> int:
+        self.lists.setdefault(key, []).extend(values)
+        return len(self.lists[key])
+
+    async def publish(self, channel: str, message: str) -> int:
+        self.published += 1
+        return 0
+
+    async def xadd(self, key: str, fields: Dict[str, str]) -> str:
+        entries = self.streams.setdefault(key, [])
+        entry_id = f"{len(entries) + 1}-0"
+        entries.append((entry_id, fields))
+        return entry_id
+
+    def pipeline(self, transaction: bool = False) -> _StubPipeline:
+        return _StubPipeline(self)
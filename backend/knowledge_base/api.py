@@ -1,10 +1,14 @@
 import json
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
 from pydantic import BaseModel, Field, HttpUrl
 from utils.auth_utils import get_current_user_id_from_jwt
 from services.supabase import DBConnection
 from knowledge_base.file_processor import FileProcessor
+from knowledge_base import retrieval
+from knowledge_base import context_cache
+from knowledge_base import ingestion as kb_ingestion
+from run_agent_background import process_kb_upload_background
 from utils.logger import logger
 from flags.flags import is_enabled
 
@@ -162,6 +166,7 @@ async def create_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to create knowledge base entry")
         
         created_entry = result.data[0]
+        await context_cache.bump_revision(thread_id=thread_id)
         
         return KnowledgeBaseEntryResponse(
             entry_id=created_entry['entry_id'],
@@ -277,6 +282,8 @@ async def create_agent_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to create agent knowledge base entry")
         
         created_entry = result.data[0]
+        await context_cache.bump_revision(agent_id=agent_id)
+        await retrieval.try_index_entries(client, [created_entry])
         
         return KnowledgeBaseEntryResponse(
             entry_id=created_entry['entry_id'],
@@ -299,7 +306,6 @@ async def create_agent_knowledge_base_entry(
 @router.post("/agents/{agent_id}/upload-file")
 async def upload_file_to_agent_kb(
     agent_id: str,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user_id: str = Depends(get_current_user_id_from_jwt)
 ):
@@ -320,6 +326,7 @@ async def upload_file_to_agent_kb(
         account_id = agent_result.data[0]['account_id']
         
         file_content = await file.read()
+        mime_type = file.content_type or 'application/octet-stream'
         job_id = await client.rpc('create_agent_kb_processing_job', {
             'p_agent_id': agent_id,
             'p_account_id': account_id,
@@ -335,15 +342,24 @@ async def upload_file_to_agent_kb(
             raise HTTPException(status_code=500, detail="Failed to create processing job")
         
         job_id = job_id.data
-        background_tasks.add_task(
-            process_file_background,
-            job_id,
-            agent_id,
-            account_id,
-            file_content,
-            file.filename,
-            file.content_type or 'application/octet-stream'
-        )
+        
+        # Workers pick the file up from storage, so it survives restarts and isn't held in this process
+        storage_path = None
+        try:
+            storage_path = await kb_ingestion.store_upload(client, account_id, job_id, file_content, mime_type)
+            del file_content
+            process_kb_upload_background.send(
+                job_id,
+                agent_id,
+                account_id,
+                storage_path,
+                file.filename,
+                mime_type
+            )
+        except Exception as e:
+            # No worker will pick the job up, so don't leave it pending
+            await kb_ingestion.fail_job(client, job_id, f"Failed to queue upload: {str(e)}", storage_path)
+            raise
         
         return {
             "job_id": job_id,
@@ -407,55 +423,6 @@ async def get_agent_processing_jobs(
         logger.error(f"Error getting processing jobs for agent {agent_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get processing jobs")
 
-async def process_file_background(
-    job_id: str,
-    agent_id: str,
-    account_id: str,
-    file_content: bytes,
-    filename: str,
-    mime_type: str
-):
-    """Background task to process uploaded files"""
-    
-    processor = FileProcessor()
-    client = await processor.db.client
-    try:
-        await client.rpc('update_agent_kb_job_status', {
-            'p_job_id': job_id,
-            'p_status': 'processing'
-        }).execute()
-        
-        result = await processor.process_file_upload(
-            agent_id, account_id, file_content, filename, mime_type
-        )
-        
-        if result['success']:
-            await client.rpc('update_agent_kb_job_status', {
-                'p_job_id': job_id,
-                'p_status': 'completed',
-                'p_result_info': result,
-                'p_entries_created': 1,
-                'p_total_files': 1
-            }).execute()
-        else:
-            await client.rpc('update_agent_kb_job_status', {
-                'p_job_id': job_id,
-                'p_status': 'failed',
-                'p_error_message': result.get('error', 'Unknown error')
-            }).execute()
-            
-    except Exception as e:
-        logger.error(f"Error in background file processing for job {job_id}: {str(e)}")
-        try:
-            await client.rpc('update_agent_kb_job_status', {
-                'p_job_id': job_id,
-                'p_status': 'failed',
-                'p_error_message': str(e)
-            }).execute()
-        except:
-            pass
-
-
 @router.get("/agents/{agent_id}/context")
 async def get_agent_knowledge_base_context(
     agent_id: str,
@@ -476,12 +443,7 @@ async def get_agent_knowledge_base_context(
         if not agent_result.data:
             raise HTTPException(status_code=404, detail="Agent not found or access denied")
         
-        result = await client.rpc('get_agent_knowledge_base_context', {
-            'p_agent_id': agent_id,
-            'p_max_tokens': max_tokens
-        }).execute()
-        
-        context = result.data if result.data else None
+        context = await context_cache.get_agent_context(client, agent_id, max_tokens)
         
         return {
             "context": context,
@@ -541,6 +503,9 @@ async def update_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to update knowledge base entry")
         
         updated_entry = result.data[0]
+        await context_cache.bump_revision(agent_id=updated_entry.get('agent_id'), thread_id=updated_entry.get('thread_id'))
+        if table_name == 'agent_knowledge_base_entries' and ('content' in update_data or 'name' in update_data):
+            await retrieval.try_index_entries(client, [updated_entry])
         
         return KnowledgeBaseEntryResponse(
             entry_id=updated_entry['entry_id'],
@@ -579,17 +544,18 @@ async def delete_knowledge_base_entry(
     try:
         client = await db.client
         
-        entry_result = await client.table('knowledge_base_entries').select('entry_id').eq('entry_id', entry_id).execute()
+        entry_result = await client.table('knowledge_base_entries').select('entry_id, thread_id').eq('entry_id', entry_id).execute()
         table_name = 'knowledge_base_entries'
         
         if not entry_result.data:
-            entry_result = await client.table('agent_knowledge_base_entries').select('entry_id').eq('entry_id', entry_id).execute()
+            entry_result = await client.table('agent_knowledge_base_entries').select('entry_id, agent_id').eq('entry_id', entry_id).execute()
             table_name = 'agent_knowledge_base_entries'
             
         if not entry_result.data:
             raise HTTPException(status_code=404, detail="Knowledge base entry not found")
         
         result = await client.table(table_name).delete().eq('entry_id', entry_id).execute()
+        await context_cache.bump_revision(agent_id=entry_result.data[0].get('agent_id'), thread_id=entry_result.data[0].get('thread_id'))
         
         return {"message": "Knowledge base entry deleted successfully"}
         
@@ -664,12 +630,7 @@ async def get_knowledge_base_context(
         if not thread_result.data:
             raise HTTPException(status_code=404, detail="Thread not found")
         
-        result = await client.rpc('get_knowledge_base_context', {
-            'p_thread_id': thread_id,
-            'p_max_tokens': max_tokens
-        }).execute()
-        
-        context = result.data if result.data else None
+        context = await context_cache.get_thread_context(client, thread_id, max_tokens)
         
         return {
             "context": context,
@@ -703,13 +664,7 @@ async def get_combined_knowledge_base_context(
         if not thread_result.data:
             raise HTTPException(status_code=404, detail="Thread not found")
         
-        result = await client.rpc('get_combined_knowledge_base_context', {
-            'p_thread_id': thread_id,
-            'p_agent_id': agent_id,
-            'p_max_tokens': max_tokens
-        }).execute()
-        
-        context = result.data if result.data else None
+        context = await context_cache.get_combined_context(client, thread_id, agent_id, max_tokens)
         
         return {
             "context": context,
@@ -0,0 +1,169 @@
+"""
+Cache of assembled knowledge base contexts.
+
+Assembling a knowledge base context (the get_*_knowledge_base_context RPCs)
+reads and concatenates every active entry, and used to run on every agent start
+and every context request. Agents and threads have a knowledge base revision in
+Redis (kb:revision:agent:{agent_id}, kb:revision:thread:{thread_id}) that
+bump_revision() increments whenever one of their entries is created, updated
+or deleted. Contexts are cached under the revisions they were built from, so a
+changed knowledge base is never served from the cache:
+
+- in this process, in an LRU of up to KB_CONTEXT_CACHE_MAX_ENTRIES contexts
+- in Redis, shared by all processes, under kb:context:...
+
+Both tiers keep contexts for KB_CONTEXT_CACHE_TTL seconds. Revisions expire
+no earlier than the contexts cached under them, so a revision that expired and
+starts again from 0 can't match an old context. If Redis is unavailable the
+contexts are assembled without the cache.
+
+Cache hits don't call the RPCs, so they are not recorded in the knowledge
+base usage logs.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+REVISION_KEY_PREFIX = "kb:revision:"
+CONTEXT_KEY_PREFIX = "kb:context:"
+
+# Cache key -> (expiry time, context), in LRU order
+_contexts: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+
+
+def _revision_key(kind: str, id: str) -> str:
+    return f"{REVISION_KEY_PREFIX}{kind}:{id}"
+
+
+async def bump_revision(agent_id: Optional[str] = None, thread_id: Optional[str] = None):
+    """Record that the knowledge base of an agent and/or a thread changed."""
+    revision_keys = [
+        _revision_key(kind, id)
+        for kind, id in (("agent", agent_id), ("thread", thread_id))
+        if id
+    ]
+    if not revision_keys:
+        return
+    try:
+        pipe = await redis.pipeline()
+        for key in revision_keys:
+            pipe.incr(key)
+            pipe.expire(key, config.KB_CONTEXT_CACHE_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to bump knowledge base revision of {', '.join(revision_keys)}: {e}")
+
+
+def _cache_get(key: str) -> Tuple[bool, Optional[str]]:
+    cached = _contexts.get(key)
+    if cached is None:
+        return False, None
+    expires_at, context = cached
+    if expires_at < time.monotonic():
+        del _contexts[key]
+        return False, None
+    _contexts.move_to_end(key)
+    return True, context
+
+
+def _cache_put(key: str, context: Optional[str]):
+    _contexts[key] = (time.monotonic() + config.KB_CONTEXT_CACHE_TTL, context)
+    _contexts.move_to_end(key)
+    while len(_contexts) > max(0, config.KB_CONTEXT_CACHE_MAX_ENTRIES):
+        _contexts.popitem(last=False)
+
+
+async def _get_or_build(
+    name: str,
+    revisions: List[Tuple[str, str]],
+    max_tokens: int,
+    build: Callable[[], Awaitable[Optional[str]]]
+) -> Optional[str]:
+    """Return the cached context for the current revisions of (kind, id) pairs, or build and cache it."""
+    revision_keys = [_revision_key(kind, id) for kind, id in revisions]
+    try:
+        current = await redis.mget(*revision_keys)
+    except Exception as e:
+        logger.warning(f"Failed to read knowledge base revisions, not using the context cache: {e}")
+        return await build()
+
+    key = CONTEXT_KEY_PREFIX + name + ":" + ":".join(
+        f"{id}@{revision or 0}" for (_, id), revision in zip(revisions, current)
+    ) + f":{max_tokens}"
+
+    found, context = _cache_get(key)
+    if found:
+        logger.debug(f"Using knowledge base context {key} cached in this process")
+        return context
+
+    try:
+        cached = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Failed to read knowledge base context {key} from cache: {e}")
+        cached = None
+    if cached is not None:
+        context = json.loads(cached)
+        _cache_put(key, context)
+        logger.debug(f"Using knowledge base context {key} cached in Redis")
+        return context
+
+    context = await build()
+    _cache_put(key, context)
+    try:
+        pipe = await redis.pipeline()
+        pipe.set(key, json.dumps(context), ex=config.KB_CONTEXT_CACHE_TTL)
+        # Keep the revisions at least as long as this context
+        for revision_key in revision_keys:
+            pipe.expire(revision_key, config.KB_CONTEXT_CACHE_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to cache knowledge base context {key}: {e}")
+    return context
+
+
+async def _rpc_context(client, function: str, params: Dict[str, Any]) -> Optional[str]:
+    result = await client.rpc(function, params).execute()
+    return result.data if result.data else None
+
+
+async def get_agent_context(client, agent_id: str, max_tokens: int = 4000) -> Optional[str]:
+    """get_agent_knowledge_base_context, cached."""
+    return await _get_or_build(
+        "agent", [("agent", agent_id)], max_tokens,
+        lambda: _rpc_context(client, 'get_agent_knowledge_base_context', {
+            'p_agent_id': agent_id,
+            'p_max_tokens': max_tokens
+        })
+    )
+
+
+async def get_thread_context(client, thread_id: str, max_tokens: int = 4000) -> Optional[str]:
+    """get_knowledge_base_context, cached."""
+    return await _get_or_build(
+        "thread", [("thread", thread_id)], max_tokens,
+        lambda: _rpc_context(client, 'get_knowledge_base_context', {
+            'p_thread_id': thread_id,
+            'p_max_tokens': max_tokens
+        })
+    )
+
+
+async def get_combined_context(client, thread_id: str, agent_id: Optional[str], max_tokens: int = 4000) -> Optional[str]:
+    """get_combined_knowledge_base_context, cached."""
+    revisions = [("thread", thread_id)]
+    if agent_id:
+        revisions.append(("agent", agent_id))
+    return await _get_or_build(
+        "combined", revisions, max_tokens,
+        lambda: _rpc_context(client, 'get_combined_knowledge_base_context', {
+            'p_thread_id': thread_id,
+            'p_agent_id': agent_id,
+            'p_max_tokens': max_tokens
+        })
+    )
@@ -6,7 +6,11 @@ import shutil
 import asyncio
 import subprocess
 import re
-from typing import List, Dict, Any, Optional, Tuple
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Dict, Any, Optional, Tuple, Union
 from pathlib import Path
 import mimetypes
 import chardet
@@ -21,8 +25,94 @@ import xml.etree.ElementTree as ET
 from PIL import Image
 import pytesseract
 
+from utils.config import config
 from utils.logger import logger
 from services.supabase import DBConnection
+from knowledge_base import retrieval
+from knowledge_base import context_cache
+
+# progress_callback(entries_created, total_files) of long-running ingestion
+ProgressCallback = Callable[[int, Optional[int]], Awaitable[None]]
+
+# Extraction (PDF, DOCX, XLSX, OCR, encoding detection) runs in a process pool off the event loop
+_extraction_executor: Optional[ProcessPoolExecutor] = None
+# FileProcessor used by each pool process
+_worker_processor: Optional['FileProcessor'] = None
+
+
+def _get_extraction_executor() -> ProcessPoolExecutor:
+    global _extraction_executor
+    if _extraction_executor is None:
+        # Workers run threads and event loops, which are not safe to fork
+        _extraction_executor = ProcessPoolExecutor(
+            max_workers=max(1, config.KB_EXTRACTION_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _extraction_executor
+
+
+def content_hash(file_content: bytes) -> str:
+    """Hash of a file's content, stored as content_hash in the source_metadata of its entry."""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def _extract_in_worker(
+    source: Union[bytes, str, Tuple[str, str]],
+    filename: str,
+    mime_type: str,
+    max_file_size: int,
+    known_hash: Optional[str] = None
+) -> Tuple[Optional[str], int, Optional[str]]:
+    """Read a file and extract its text. Runs in the extraction pool.
+    
+    source is the file's content, its path, or the path of a ZIP archive and
+    the member's name in it. Returns the text, the file size and the content
+    hash; files larger than max_file_size are not read and have neither text
+    nor hash. Files whose hash is known_hash are unchanged and not extracted.
+    """
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = FileProcessor()
+    
+    if isinstance(source, bytes):
+        file_content = source
+    elif isinstance(source, tuple):
+        zip_path, member = source
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            info = zip_ref.getinfo(member)
+            if info.file_size > max_file_size:
+                return None, info.file_size, None
+            file_content = zip_ref.read(info)
+    else:
+        file_size = os.path.getsize(source)
+        if file_size > max_file_size:
+            return None, file_size, None
+        with open(source, 'rb') as f:
+            file_content = f.read()
+    
+    file_hash = content_hash(file_content)
+    if known_hash and file_hash == known_hash:
+        return None, len(file_content), file_hash
+    return _worker_processor._extract_content(file_content, filename, mime_type), len(file_content), file_hash
+
+
+async def _run_extraction(
+    source: Union[bytes, str, Tuple[str, str]],
+    filename: str,
+    mime_type: str,
+    max_file_size: int,
+    known_hash: Optional[str] = None
+) -> Tuple[Optional[str], int, Optional[str]]:
+    global _extraction_executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_extraction_executor(), _extract_in_worker, source, filename, mime_type, max_file_size, known_hash)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a new pool next time and run this job here
+        logger.warning("File extraction pool broke, restarting it")
+        _extraction_executor = None
+        return await asyncio.to_thread(_extract_in_worker, source, filename, mime_type, max_file_size, known_hash)
+
 
 class FileProcessor:
     """Handles file upload, content extraction, and processing for agent knowledge bases."""
@@ -44,6 +134,7 @@ class FileProcessor:
     MAX_FILE_SIZE = 50 * 1024 * 1024
     MAX_ZIP_ENTRIES = 1000
     MAX_CONTENT_LENGTH = 100000
+    INSERT_BATCH_SIZE = 50
     
     def __init__(self):
         self.db = DBConnection()
@@ -54,9 +145,14 @@ class FileProcessor:
         account_id: str, 
         file_content: bytes, 
         filename: str, 
-        mime_type: str
+        mime_type: str,
+        progress_callback: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
-        """Process a single uploaded file and extract its content."""
+        """Process a single uploaded file and extract its content.
+        
+        For ZIP archives, progress_callback(entries_created, total_files) is
+        awaited whenever a batch of extracted files has been stored.
+        """
         try:
             file_size = len(file_content)
             if file_size > self.MAX_FILE_SIZE:
@@ -65,15 +161,26 @@ class FileProcessor:
             file_extension = Path(filename).suffix.lower()
 
             if file_extension == '.zip':
-                return await self._process_zip_file(agent_id, account_id, file_content, filename)
+                return await self._process_zip_file(agent_id, account_id, file_content, filename, progress_callback)
+            
+            client = await self.db.client
+            
+            file_hash = await asyncio.to_thread(content_hash, file_content)
+            duplicate = await self._find_upload_by_hash(client, agent_id, file_hash)
+            if duplicate:
+                logger.info(f"Skipping upload of {filename}: same content as knowledge base entry {duplicate['entry_id']}")
+                return {
+                    'success': True,
+                    'entry_id': duplicate['entry_id'],
+                    'filename': filename,
+                    'duplicate': True
+                }
             
             content = await self._extract_file_content(file_content, filename, mime_type)
             
             if not content or not content.strip():
                 raise ValueError(f"No extractable content found in {filename}")
             
-            client = await self.db.client
-            
             entry_data = {
                 'agent_id': agent_id,
                 'account_id': account_id,
@@ -85,6 +192,7 @@ class FileProcessor:
                     'filename': filename,
                     'mime_type': mime_type,
                     'file_size': file_size,
+                    'content_hash': file_hash,
                     'extraction_method': self._get_extraction_method(file_extension, mime_type)
                 },
                 'file_size': file_size,
@@ -97,6 +205,15 @@ class FileProcessor:
             
             if not result.data:
                 raise Exception("Failed to create knowledge base entry")
+            await context_cache.bump_revision(agent_id=agent_id)
+            
+            # Index the full text, not just what fits into the entry
+            await retrieval.try_index_entries(client, [{
+                'entry_id': result.data[0]['entry_id'],
+                'agent_id': agent_id,
+                'name': entry_data['name'],
+                'content': content
+            }])
             
             return {
                 'success': True,
@@ -119,13 +236,35 @@ class FileProcessor:
         agent_id: str, 
         account_id: str, 
         zip_content: bytes, 
-        zip_filename: str
+        zip_filename: str,
+        progress_callback: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
-        """Extract and process all files from a ZIP archive."""
+        """Extract and process all files from a ZIP archive.
+        
+        An identical archive uploaded before is skipped. A different archive
+        with the same filename as one uploaded before updates that one: only
+        changed files are processed again and files no longer in the archive
+        are removed.
+        """
         
         try:
             client = await self.db.client
             
+            zip_hash = await asyncio.to_thread(content_hash, zip_content)
+            duplicate = await self._find_upload_by_hash(client, agent_id, zip_hash)
+            if duplicate:
+                logger.info(f"Skipping upload of {zip_filename}: same content as knowledge base entry {duplicate['entry_id']}")
+                return {
+                    'success': True,
+                    'zip_entry_id': duplicate['entry_id'],
+                    'zip_filename': zip_filename,
+                    'duplicate': True,
+                    'extracted_files': [],
+                    'failed_files': [],
+                    'total_extracted': 0,
+                    'total_failed': 0
+                }
+            
             zip_entry_data = {
                 'agent_id': agent_id,
                 'account_id': account_id,
@@ -133,6 +272,7 @@ class FileProcessor:
                 'description': f"ZIP archive: {zip_filename}",
                 'content': f"ZIP archive containing multiple files. Extracted files will appear as separate entries.",
                 'source_type': 'file',
+                # content_hash is only recorded once every file was ingested (see below)
                 'source_metadata': {
                     'filename': zip_filename,
                     'mime_type': 'application/zip',
@@ -145,86 +285,103 @@ class FileProcessor:
                 'is_active': True
             }
             
-            zip_result = await client.table('agent_knowledge_base_entries').insert(zip_entry_data).execute()
-            zip_entry_id = zip_result.data[0]['entry_id']
-            
-            # Extract files from ZIP
-            extracted_files = []
-            failed_files = []
-            
             with zipfile.ZipFile(io.BytesIO(zip_content), 'r') as zip_ref:
-                file_list = zip_ref.namelist()
-                
-                if len(file_list) > self.MAX_ZIP_ENTRIES:
-                    raise ValueError(f"ZIP contains too many files: {len(file_list)} (max: {self.MAX_ZIP_ENTRIES})")
-                
-                for file_path in file_list:
-                    if file_path.endswith('/'):
+                file_list = [info for info in zip_ref.infolist() if not info.is_dir()]
+            
+            if len(file_list) > self.MAX_ZIP_ENTRIES:
+                raise ValueError(f"ZIP contains too many files: {len(file_list)} (max: {self.MAX_ZIP_ENTRIES})")
+            
+            previous_upload = await client.table('agent_knowledge_base_entries').select('entry_id').eq('agent_id', agent_id).eq(
+                'source_metadata->>filename', zip_filename
+            ).eq('source_metadata->>is_zip_container', 'true').limit(1).execute()
+            if previous_upload.data:
+                zip_entry_id = previous_upload.data[0]['entry_id']
+                # Drops the old content_hash too: while the files are being replaced, neither
+                # the old nor the new archive may be skipped as a duplicate
+                await client.table('agent_knowledge_base_entries').update({
+                    'source_metadata': zip_entry_data['source_metadata'],
+                    'file_size': zip_entry_data['file_size']
+                }).eq('entry_id', zip_entry_id).execute()
+                existing_files = await self._get_source_files(client, zip_entry_id, 'original_path')
+            else:
+                zip_result = await client.table('agent_knowledge_base_entries').insert(zip_entry_data).execute()
+                zip_entry_id = zip_result.data[0]['entry_id']
+                await context_cache.bump_revision(agent_id=agent_id)
+                await retrieval.try_index_entries(client, [{**zip_entry_data, 'entry_id': zip_entry_id}])
+                existing_files = {}
+            
+            # Extraction workers read the members from the archive on disk themselves
+            zip_path = await asyncio.to_thread(self._write_temp_file, zip_content, '.zip')
+            
+            def zip_files():
+                for info in file_list:
+                    filename = os.path.basename(info.filename)
+                    if not filename:  # Skip if no filename
                         continue
                     
-                    try:
-                        file_content = zip_ref.read(file_path)
-                        filename = os.path.basename(file_path)
-                        
-                        if not filename:  # Skip if no filename
-                            continue
-                        
-                        # Detect MIME type
-                        mime_type, _ = mimetypes.guess_type(filename)
-                        if not mime_type:
-                            mime_type = 'application/octet-stream'
-                        
-                        # Extract content
-                        content = await self._extract_file_content(file_content, filename, mime_type)
-                        
-                        if content and content.strip():
-                            extracted_entry_data = {
-                                'agent_id': agent_id,
-                                'account_id': account_id,
-                                'name': f"📄 {filename}",
-                                'description': f"Extracted from {zip_filename}: {file_path}",
-                                'content': content[:self.MAX_CONTENT_LENGTH],
-                                'source_type': 'zip_extracted',
-                                'source_metadata': {
-                                    'filename': filename,
-                                    'original_path': file_path,
-                                    'zip_filename': zip_filename,
-                                    'mime_type': mime_type,
-                                    'file_size': len(file_content),
-                                    'extraction_method': self._get_extraction_method(Path(filename).suffix.lower(), mime_type)
-                                },
-                                'file_size': len(file_content),
-                                'file_mime_type': mime_type,
-                                'extracted_from_zip_id': zip_entry_id,
-                                'usage_context': 'always',
-                                'is_active': True
-                            }
-                            
-                            extracted_result = await client.table('agent_knowledge_base_entries').insert(extracted_entry_data).execute()
-                            
-                            extracted_files.append({
-                                'filename': filename,
-                                'path': file_path,
-                                'entry_id': extracted_result.data[0]['entry_id'],
-                                'content_length': len(content)
-                            })
-                        
-                    except Exception as e:
-                        logger.error(f"Error extracting {file_path} from ZIP: {str(e)}")
-                        failed_files.append({
-                            'filename': os.path.basename(file_path),
-                            'path': file_path,
-                            'error': str(e)
-                        })
+                    # Detect MIME type
+                    mime_type, _ = mimetypes.guess_type(filename)
+                    yield {
+                        'source': (zip_path, info.filename),
+                        'filename': filename,
+                        'path': info.filename,
+                        'mime_type': mime_type or 'application/octet-stream',
+                        **existing_files.get(info.filename, {})
+                    }
+            
+            def build_entry(file: Dict[str, Any], content: str, file_size: int) -> Dict[str, Any]:
+                return {
+                    'agent_id': agent_id,
+                    'account_id': account_id,
+                    'name': f"📄 {file['filename']}",
+                    'description': f"Extracted from {zip_filename}: {file['path']}",
+                    'content': content[:self.MAX_CONTENT_LENGTH],
+                    'source_type': 'zip_extracted',
+                    'source_metadata': {
+                        'filename': file['filename'],
+                        'original_path': file['path'],
+                        'zip_filename': zip_filename,
+                        'mime_type': file['mime_type'],
+                        'file_size': file_size,
+                        'extraction_method': self._get_extraction_method(Path(file['filename']).suffix.lower(), file['mime_type'])
+                    },
+                    'file_size': file_size,
+                    'file_mime_type': file['mime_type'],
+                    'extracted_from_zip_id': zip_entry_id,
+                    'usage_context': 'always',
+                    'is_active': True
+                }
+            
+            try:
+                extracted_files, failed_files, unchanged_files = await self._ingest_files(
+                    client, zip_files(), build_entry, 'path',
+                    progress_callback=progress_callback, total_files=len(file_list)
+                )
+            finally:
+                os.unlink(zip_path)
+            
+            archive_paths = {info.filename for info in file_list}
+            removed_files = [path for path in existing_files if path not in archive_paths]
+            await self._delete_entries(client, agent_id, [existing_files[path]['entry_id'] for path in removed_files])
+            
+            if not failed_files:
+                # Only a fully ingested archive counts as a duplicate of later uploads,
+                # so uploading it again retries any files that failed
+                await client.table('agent_knowledge_base_entries').update({
+                    'source_metadata': {**zip_entry_data['source_metadata'], 'content_hash': zip_hash}
+                }).eq('entry_id', zip_entry_id).execute()
             
             return {
                 'success': True,
                 'zip_entry_id': zip_entry_id,
                 'zip_filename': zip_filename,
+                'updated_previous_upload': bool(previous_upload.data),
                 'extracted_files': extracted_files,
                 'failed_files': failed_files,
+                'removed_files': removed_files,
                 'total_extracted': len(extracted_files),
-                'total_failed': len(failed_files)
+                'total_failed': len(failed_files),
+                'total_unchanged': len(unchanged_files)
             }
             
         except Exception as e:
@@ -242,9 +399,17 @@ class FileProcessor:
         git_url: str,
         branch: str = 'main',
         include_patterns: List[str] = None,
-        exclude_patterns: List[str] = None
+        exclude_patterns: List[str] = None,
+        incremental: bool = True
     ) -> Dict[str, Any]:
-        """Clone a Git repository and extract content from supported files."""
+        """Clone a Git repository and extract content from supported files.
+        
+        A repository imported before is synced instead: with incremental, only
+        the files changed since the last imported commit are processed again.
+        Otherwise (or when that commit is gone, e.g. after a force push, or the
+        patterns changed) all files are checked, and those whose content hash
+        is unchanged are skipped. Entries of deleted files are removed.
+        """
         
         if include_patterns is None:
             include_patterns = ['*.py', '*.js', '*.ts', '*.md', '*.txt', '*.json', '*.yaml', '*.yml']
@@ -257,116 +422,131 @@ class FileProcessor:
             # Create temporary directory
             temp_dir = tempfile.mkdtemp()
             
-            # Clone repository
-            clone_cmd = ['git', 'clone', '--depth', '1', '--branch', branch, git_url, temp_dir]
-            process = await asyncio.create_subprocess_exec(
-                *clone_cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
+            client = await self.db.client
             
-            if process.returncode != 0:
-                raise Exception(f"Git clone failed: {stderr.decode()}")
+            previous_import = await client.table('agent_knowledge_base_entries').select('entry_id, source_metadata').eq('agent_id', agent_id).eq(
+                'source_type', 'git_repo'
+            ).is_('extracted_from_zip_id', 'null').eq('source_metadata->>git_url', git_url).eq('source_metadata->>branch', branch).limit(1).execute()
+            previous_import = previous_import.data[0] if previous_import.data else None
             
-            # Create main repository entry
-            client = await self.db.client
+            if previous_import:
+                # Only commits and trees; file contents are fetched for the files that get checked out
+                await self._run_git('clone', '--filter=blob:none', '--no-checkout', '--branch', branch, git_url, temp_dir)
+            else:
+                await self._run_git('clone', '--depth', '1', '--branch', branch, git_url, temp_dir)
+            commit = (await self._run_git('rev-parse', 'HEAD', cwd=temp_dir)).strip()
             
             repo_name = git_url.split('/')[-1].replace('.git', '')
-            repo_entry_data = {
-                'agent_id': agent_id,
-                'account_id': account_id,
-                'name': f"🔗 {repo_name}",
-                'description': f"Git repository: {git_url} (branch: {branch})",
-                'content': f"Git repository cloned from {git_url}. Individual files are processed as separate entries.",
-                'source_type': 'git_repo',
-                'source_metadata': {
-                    'git_url': git_url,
-                    'branch': branch,
-                    'include_patterns': include_patterns,
-                    'exclude_patterns': exclude_patterns
-                },
-                'usage_context': 'always',
-                'is_active': True
+            # commit is only recorded once every file was ingested (see below)
+            repo_metadata = {
+                'git_url': git_url,
+                'branch': branch,
+                'include_patterns': include_patterns,
+                'exclude_patterns': exclude_patterns
             }
             
-            repo_result = await client.table('agent_knowledge_base_entries').insert(repo_entry_data).execute()
-            repo_entry_id = repo_result.data[0]['entry_id']
+            if previous_import:
+                repo_entry_id = previous_import['entry_id']
+                previous_metadata = previous_import['source_metadata'] or {}
+                existing_files = await self._get_source_files(client, repo_entry_id, 'relative_path')
+                
+                changes = None
+                if (
+                    incremental
+                    and previous_metadata.get('commit')
+                    and previous_metadata.get('include_patterns') == include_patterns
+                    and previous_metadata.get('exclude_patterns') == exclude_patterns
+                ):
+                    changes = await self._get_changed_paths(temp_dir, previous_metadata['commit'], commit)
+                
+                if changes is not None:
+                    changed_paths, deleted_paths = changes
+                    relative_paths = [path for path in changed_paths if self._should_include_file(path, include_patterns, exclude_patterns)]
+                    removed_files = [path for path in deleted_paths if path in existing_files]
+                    if relative_paths:
+                        await self._run_git(
+                            '--literal-pathspecs', 'checkout', commit, '--pathspec-from-file=-', '--pathspec-file-nul',
+                            cwd=temp_dir, input='\0'.join(relative_paths)
+                        )
+                else:
+                    await self._run_git('checkout', commit, cwd=temp_dir)
+                    relative_paths = await asyncio.to_thread(self._list_repository_files, temp_dir, include_patterns, exclude_patterns)
+                    listed_paths = set(relative_paths)
+                    removed_files = [path for path in existing_files if path not in listed_paths]
+            else:
+                # Create main repository entry
+                repo_entry_data = {
+                    'agent_id': agent_id,
+                    'account_id': account_id,
+                    'name': f"🔗 {repo_name}",
+                    'description': f"Git repository: {git_url} (branch: {branch})",
+                    'content': f"Git repository cloned from {git_url}. Individual files are processed as separate entries.",
+                    'source_type': 'git_repo',
+                    'source_metadata': repo_metadata,
+                    'usage_context': 'always',
+                    'is_active': True
+                }
+                
+                repo_result = await client.table('agent_knowledge_base_entries').insert(repo_entry_data).execute()
+                repo_entry_id = repo_result.data[0]['entry_id']
+                await context_cache.bump_revision(agent_id=agent_id)
+                await retrieval.try_index_entries(client, [{**repo_entry_data, 'entry_id': repo_entry_id}])
+                
+                previous_metadata = repo_metadata
+                existing_files = {}
+                removed_files = []
+                relative_paths = await asyncio.to_thread(self._list_repository_files, temp_dir, include_patterns, exclude_patterns)
             
             # Process files in repository
-            processed_files = []
-            failed_files = []
-            
-            for root, dirs, files in os.walk(temp_dir):
-                # Skip .git directory
-                if '.git' in dirs:
-                    dirs.remove('.git')
-                
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, temp_dir)
+            def repository_files():
+                for relative_path in relative_paths:
+                    file = os.path.basename(relative_path)
                     
-                    # Check if file should be included
-                    if not self._should_include_file(relative_path, include_patterns, exclude_patterns):
-                        continue
-                    
-                    try:
-                        with open(file_path, 'rb') as f:
-                            file_content = f.read()
-                        
-                        if len(file_content) > self.MAX_FILE_SIZE:
-                            continue  # Skip large files
-                        
-                        # Detect MIME type
-                        mime_type, _ = mimetypes.guess_type(file)
-                        if not mime_type:
-                            mime_type = 'application/octet-stream'
-                        
-                        # Extract content
-                        content = await self._extract_file_content(file_content, file, mime_type)
-                        
-                        if content and content.strip():
-                            # Create entry for file
-                            file_entry_data = {
-                                'agent_id': agent_id,
-                                'account_id': account_id,
-                                'name': f"📄 {file}",
-                                'description': f"From {repo_name}: {relative_path}",
-                                'content': content[:self.MAX_CONTENT_LENGTH],
-                                'source_type': 'git_repo',
-                                'source_metadata': {
-                                    'filename': file,
-                                    'relative_path': relative_path,
-                                    'git_url': git_url,
-                                    'branch': branch,
-                                    'repo_name': repo_name,
-                                    'mime_type': mime_type,
-                                    'file_size': len(file_content),
-                                    'extraction_method': self._get_extraction_method(Path(file).suffix.lower(), mime_type)
-                                },
-                                'file_size': len(file_content),
-                                'file_mime_type': mime_type,
-                                'extracted_from_zip_id': repo_entry_id,  # Reuse this field for git repo reference
-                                'usage_context': 'always',
-                                'is_active': True
-                            }
-                            
-                            file_result = await client.table('agent_knowledge_base_entries').insert(file_entry_data).execute()
-                            
-                            processed_files.append({
-                                'filename': file,
-                                'relative_path': relative_path,
-                                'entry_id': file_result.data[0]['entry_id'],
-                                'content_length': len(content)
-                            })
-                    
-                    except Exception as e:
-                        logger.error(f"Error processing {relative_path} from git repo: {str(e)}")
-                        failed_files.append({
-                            'filename': file,
-                            'relative_path': relative_path,
-                            'error': str(e)
-                        })
+                    # Detect MIME type
+                    mime_type, _ = mimetypes.guess_type(file)
+                    yield {
+                        'source': os.path.join(temp_dir, relative_path),
+                        'filename': file,
+                        'path': relative_path,
+                        'mime_type': mime_type or 'application/octet-stream',
+                        **existing_files.get(relative_path, {})
+                    }
+            
+            def build_entry(file: Dict[str, Any], content: str, file_size: int) -> Dict[str, Any]:
+                return {
+                    'agent_id': agent_id,
+                    'account_id': account_id,
+                    'name': f"📄 {file['filename']}",
+                    'description': f"From {repo_name}: {file['path']}",
+                    'content': content[:self.MAX_CONTENT_LENGTH],
+                    'source_type': 'git_repo',
+                    'source_metadata': {
+                        'filename': file['filename'],
+                        'relative_path': file['path'],
+                        'git_url': git_url,
+                        'branch': branch,
+                        'repo_name': repo_name,
+                        'commit': commit,
+                        'mime_type': file['mime_type'],
+                        'file_size': file_size,
+                        'extraction_method': self._get_extraction_method(Path(file['filename']).suffix.lower(), file['mime_type'])
+                    },
+                    'file_size': file_size,
+                    'file_mime_type': file['mime_type'],
+                    'extracted_from_zip_id': repo_entry_id,  # Reuse this field for git repo reference
+                    'usage_context': 'always',
+                    'is_active': True
+                }
+            
+            processed_files, failed_files, unchanged_files = await self._ingest_files(client, repository_files(), build_entry, 'relative_path')
+            await self._delete_entries(client, agent_id, [existing_files[path]['entry_id'] for path in removed_files])
+            
+            if not failed_files:
+                # Only a fully ingested commit is the base of the next incremental sync,
+                # so syncing again retries any files that failed
+                await client.table('agent_knowledge_base_entries').update({
+                    'source_metadata': {**previous_metadata, **repo_metadata, 'commit': commit}
+                }).eq('entry_id', repo_entry_id).execute()
             
             return {
                 'success': True,
@@ -374,10 +554,14 @@ class FileProcessor:
                 'repo_name': repo_name,
                 'git_url': git_url,
                 'branch': branch,
+                'commit': commit,
+                'synced_previous_import': previous_import is not None,
                 'processed_files': processed_files,
                 'failed_files': failed_files,
+                'removed_files': removed_files,
                 'total_processed': len(processed_files),
-                'total_failed': len(failed_files)
+                'total_failed': len(failed_files),
+                'total_unchanged': len(unchanged_files)
             }
             
         except Exception as e:
@@ -393,7 +577,227 @@ class FileProcessor:
             if temp_dir and os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir, ignore_errors=True)
     
+    @staticmethod
+    async def _run_git(*args: str, cwd: Optional[str] = None, input: Optional[str] = None) -> str:
+        """Run a git command and return its output, raising if it fails."""
+        process = await asyncio.create_subprocess_exec(
+            'git', *args,
+            cwd=cwd,
+            stdin=asyncio.subprocess.PIPE if input is not None else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate(input.encode() if input is not None else None)
+        
+        if process.returncode != 0:
+            command = next(arg for arg in args if not arg.startswith('-'))
+            raise Exception(f"Git {command} failed: {stderr.decode()}")
+        return stdout.decode()
+    
+    async def _get_changed_paths(self, repo_dir: str, since_commit: str, commit: str) -> Optional[Tuple[List[str], List[str]]]:
+        """Paths of the files added or changed and of the files deleted between two commits.
+        
+        Returns None if since_commit is not in the repository history.
+        """
+        if since_commit == commit:
+            return [], []
+        try:
+            await self._run_git('cat-file', '-e', f'{since_commit}^{{commit}}', cwd=repo_dir)
+        except Exception:
+            logger.info(f"Last imported commit {since_commit} is no longer in the repository history, checking all files")
+            return None
+        # Renames count as a deletion and an addition
+        output = await self._run_git('diff', '--name-status', '--no-renames', '-z', since_commit, commit, cwd=repo_dir)
+        fields = output.split('\0')
+        changed_paths, deleted_paths = [], []
+        for status, path in zip(fields[0::2], fields[1::2]):
+            (deleted_paths if status == 'D' else changed_paths).append(path)
+        return changed_paths, deleted_paths
+    
+    async def _get_source_files(self, client, source_entry_id: str, path_key: str) -> Dict[str, Dict[str, Any]]:
+        """entry_id and content_hash of the entries imported from a ZIP archive or repository, by the path under path_key."""
+        files = {}
+        page_size = 1000
+        offset = 0
+        while True:
+            result = await client.table('agent_knowledge_base_entries').select(
+                f'entry_id, path:source_metadata->>{path_key}, content_hash:source_metadata->>content_hash'
+            ).eq('extracted_from_zip_id', source_entry_id).order('entry_id').range(offset, offset + page_size - 1).execute()
+            for row in result.data or []:
+                files[row['path']] = {'entry_id': row['entry_id'], 'content_hash': row['content_hash']}
+            if len(result.data or []) < page_size:
+                return files
+            offset += page_size
+    
+    async def _find_upload_by_hash(self, client, agent_id: str, file_hash: str) -> Optional[Dict[str, Any]]:
+        """An uploaded file or ZIP archive in the agent's knowledge base with this content hash."""
+        result = await client.table('agent_knowledge_base_entries').select('entry_id').eq('agent_id', agent_id).eq(
+            'source_type', 'file'
+        ).eq('source_metadata->>content_hash', file_hash).limit(1).execute()
+        return result.data[0] if result.data else None
+    
+    async def _delete_entries(self, client, agent_id: str, entry_ids: List[str]):
+        if not entry_ids:
+            return
+        try:
+            for i in range(0, len(entry_ids), self.INSERT_BATCH_SIZE):
+                await client.table('agent_knowledge_base_entries').delete().in_('entry_id', entry_ids[i:i + self.INSERT_BATCH_SIZE]).execute()
+        finally:
+            await context_cache.bump_revision(agent_id=agent_id)
+    
+    @staticmethod
+    def _write_temp_file(file_content: bytes, suffix: str) -> str:
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(file_content)
+            return f.name
+    
+    def _list_repository_files(self, repo_dir: str, include_patterns: List[str], exclude_patterns: List[str]) -> List[str]:
+        """Relative paths of the files in a cloned repository that should be processed."""
+        relative_paths = []
+        for root, dirs, files in os.walk(repo_dir):
+            # Skip .git directory
+            if '.git' in dirs:
+                dirs.remove('.git')
+            
+            for file in files:
+                relative_path = os.path.relpath(os.path.join(root, file), repo_dir)
+                if self._should_include_file(relative_path, include_patterns, exclude_patterns):
+                    relative_paths.append(relative_path)
+        return relative_paths
+    
+    async def _ingest_files(
+        self,
+        client,
+        files: Iterable[Dict[str, Any]],
+        build_entry: Callable[[Dict[str, Any], str, int], Dict[str, Any]],
+        path_key: str,
+        progress_callback: Optional[ProgressCallback] = None,
+        total_files: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Extract files in the extraction pool and insert their entries in batches.
+        
+        files are dicts with the file's source (see _extract_in_worker), filename,
+        path and mime_type. Files imported before also have the entry_id and
+        content_hash of their entry; that entry is updated if the file changed
+        and left alone if it didn't. build_entry(file, content, file_size)
+        returns the entry to store. Returns the processed, the failed and the
+        unchanged files, with their path under path_key.
+        progress_callback(entries_created, total_files) is awaited after each batch.
+        """
+        processed_files = []
+        failed_files = []
+        unchanged_files = []
+        batch = []
+        
+        def record_failure(file, error):
+            failed_files.append({'filename': file['filename'], path_key: file['path'], 'error': str(error)})
+        
+        async def write(items, upsert: bool):
+            table = client.table('agent_knowledge_base_entries')
+            entries = [entry for _, entry, _ in items]
+            result = await (table.upsert(entries) if upsert else table.insert(entries)).execute()
+            return list(zip(items, result.data))
+        
+        async def store(items, upsert: bool):
+            """Write the entries in one request, falling back to one request per entry so a bad row only fails its own file."""
+            if not items:
+                return []
+            try:
+                return await write(items, upsert)
+            except Exception as e:
+                if len(items) == 1:
+                    logger.error(f"Error storing knowledge base entry for {items[0][0]['path']}: {str(e)}")
+                    record_failure(items[0][0], e)
+                    return []
+                logger.warning(f"Error storing {len(items)} knowledge base entries, retrying one by one: {str(e)}")
+            stored = []
+            for item in items:
+                try:
+                    stored.extend(await write([item], upsert))
+                except Exception as e:
+                    logger.error(f"Error storing knowledge base entry for {item[0]['path']}: {str(e)}")
+                    record_failure(item[0], e)
+            return stored
+        
+        async def flush():
+            if not batch:
+                return
+            new_entries = [(file, entry, content) for file, entry, content in batch if not file.get('entry_id')]
+            changed_entries = [(file, {**entry, 'entry_id': file['entry_id']}, content) for file, entry, content in batch if file.get('entry_id')]
+            stored = await store(new_entries, upsert=False) + await store(changed_entries, upsert=True)
+            batch.clear()
+            
+            entries_to_index = []
+            for (file, entry, content), row in stored:
+                processed_files.append({
+                    'filename': file['filename'],
+                    path_key: file['path'],
+                    'entry_id': row['entry_id'],
+                    'content_length': len(content)
+                })
+                entries_to_index.append({**entry, 'entry_id': row['entry_id'], 'content': content})
+            if stored:
+                await context_cache.bump_revision(agent_id=stored[0][0][1]['agent_id'])
+                await retrieval.try_index_entries(client, entries_to_index)
+            if progress_callback:
+                await progress_callback(len(processed_files), total_files)
+        
+        async for file, content, file_size, file_hash, error in self._extract_files(files):
+            if error is not None:
+                logger.error(f"Error processing {file['path']}: {str(error)}")
+                record_failure(file, error)
+                continue
+            
+            if file_hash and file_hash == file.get('content_hash'):
+                unchanged_files.append({'filename': file['filename'], path_key: file['path'], 'entry_id': file['entry_id']})
+            elif content is None:
+                logger.warning(f"Skipping {file['path']}: too large ({file_size} bytes)")
+            elif content.strip():
+                entry = build_entry(file, content, file_size)
+                entry['source_metadata']['content_hash'] = file_hash
+                batch.append((file, entry, content))
+                if len(batch) >= self.INSERT_BATCH_SIZE:
+                    await flush()
+        
+        await flush()
+        return processed_files, failed_files, unchanged_files
+    
+    async def _extract_files(self, files: Iterable[Dict[str, Any]]) -> AsyncIterator[Tuple[Dict[str, Any], Optional[str], int, Optional[str], Optional[Exception]]]:
+        """Extract files with at most KB_EXTRACTION_CONCURRENCY at a time, yielding (file, content, file_size, content_hash, error) as they finish."""
+        concurrency = max(1, config.KB_EXTRACTION_CONCURRENCY)
+        
+        async def extract(file):
+            try:
+                content, file_size, file_hash = await _run_extraction(
+                    file['source'], file['filename'], file['mime_type'], self.MAX_FILE_SIZE, file.get('content_hash')
+                )
+                return file, content, file_size, file_hash, None
+            except Exception as e:
+                return file, None, 0, None, e
+        
+        pending = set()
+        try:
+            for file in files:
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.create_task(extract(file)))
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+    
     async def _extract_file_content(self, file_content: bytes, filename: str, mime_type: str) -> str:
+        """Extract text content from various file types, in the extraction pool."""
+        content, _, _ = await _run_extraction(file_content, filename, mime_type, self.MAX_FILE_SIZE)
+        return content
+    
+    def _extract_content(self, file_content: bytes, filename: str, mime_type: str) -> str:
         """Extract text content from various file types."""
         file_extension = Path(filename).suffix.lower()
         
@@ -0,0 +1,157 @@
+"""
+Knowledge base upload processing for the dramatiq workers.
+
+The API stores an uploaded file in the knowledge-base-uploads bucket and
+enqueues a job with a reference to it (see process_kb_upload_background in
+run_agent_background.py), so uploads survive API restarts and are processed
+outside the API process. Progress is reported through the
+update_agent_kb_job_status RPC.
+
+Each account processes at most KB_INGEST_MAX_CONCURRENT_PER_ACCOUNT uploads at
+a time. Running jobs are tracked in the Redis sorted set
+kb_ingest:active:{account_id}, scored by when they started, so slots of jobs
+whose worker died expire after KB_INGEST_SLOT_LEASE seconds.
+"""
+
+import time
+from typing import Any, Optional
+
+from knowledge_base.file_processor import FileProcessor
+from services import redis
+from services.supabase import DBConnection
+from utils.config import config
+from utils.logger import logger
+
+UPLOADS_BUCKET = "knowledge-base-uploads"
+ACTIVE_JOBS_KEY_PREFIX = "kb_ingest:active:"
+# Longest a job holds an account slot
+KB_INGEST_SLOT_LEASE = 3600
+
+
+def upload_path(account_id: str, job_id: str) -> str:
+    # Storage rejects keys with non-ASCII and some punctuation characters, so the
+    # user's filename is not part of the key; it travels with the job message instead
+    return f"{account_id}/{job_id}/upload"
+
+
+async def store_upload(client, account_id: str, job_id: str, file_content: bytes, mime_type: str) -> str:
+    """Store an uploaded file for processing and return its path in the uploads bucket."""
+    path = upload_path(account_id, job_id)
+    await client.storage.from_(UPLOADS_BUCKET).upload(
+        path,
+        file_content,
+        {"content-type": mime_type, "upsert": "true"}
+    )
+    return path
+
+
+async def acquire_account_slot(account_id: str, job_id: str) -> bool:
+    """Take one of the account's processing slots for job_id. Returns False if all are taken."""
+    key = f"{ACTIVE_JOBS_KEY_PREFIX}{account_id}"
+    now = time.time()
+    pipe = await redis.pipeline(transaction=True)
+    pipe.zremrangebyscore(key, 0, now - KB_INGEST_SLOT_LEASE)
+    pipe.zadd(key, {job_id: now})
+    pipe.zcard(key)
+    pipe.expire(key, KB_INGEST_SLOT_LEASE)
+    _, _, active_jobs, _ = await pipe.execute()
+
+    if active_jobs > max(1, config.KB_INGEST_MAX_CONCURRENT_PER_ACCOUNT):
+        await redis.zrem(key, job_id)
+        return False
+    return True
+
+
+async def release_account_slot(account_id: str, job_id: str):
+    try:
+        await redis.zrem(f"{ACTIVE_JOBS_KEY_PREFIX}{account_id}", job_id)
+    except Exception as e:
+        logger.warning(f"Failed to release knowledge base processing slot of job {job_id}: {e}")
+
+
+async def _update_job_status(client, job_id: str, status: str, **fields: Any):
+    await client.rpc('update_agent_kb_job_status', {
+        'p_job_id': job_id,
+        'p_status': status,
+        **{f"p_{name}": value for name, value in fields.items()}
+    }).execute()
+
+
+async def fail_job(client, job_id: str, error_message: str, storage_path: Optional[str] = None):
+    """Mark a job failed before it reached a worker, removing its stored upload if there is one."""
+    try:
+        await _update_job_status(client, job_id, 'failed', error_message=error_message)
+    except Exception as e:
+        logger.warning(f"Failed to mark knowledge base processing job {job_id} as failed: {e}")
+    if storage_path:
+        try:
+            await client.storage.from_(UPLOADS_BUCKET).remove([storage_path])
+        except Exception as e:
+            logger.warning(f"Failed to remove upload {storage_path} of failed job {job_id}: {e}")
+
+
+async def process_uploaded_file(
+    job_id: str,
+    agent_id: str,
+    account_id: str,
+    storage_path: str,
+    filename: str,
+    mime_type: str
+):
+    """Process a stored upload into knowledge base entries and record the result on its job."""
+    db = DBConnection()
+    client = await db.client
+
+    job = await client.table('agent_kb_file_processing_jobs').select('status').eq('job_id', job_id).execute()
+    if not job.data:
+        logger.warning(f"Knowledge base processing job {job_id} not found, skipping")
+        return
+    if job.data[0]['status'] in ('completed', 'failed'):
+        # Redelivered message of a finished job
+        logger.info(f"Knowledge base processing job {job_id} already {job.data[0]['status']}, skipping")
+        return
+
+    try:
+        await _update_job_status(client, job_id, 'processing')
+
+        file_content = await client.storage.from_(UPLOADS_BUCKET).download(storage_path)
+
+        async def report_progress(entries_created: int, total_files: Optional[int]):
+            try:
+                # Plus the archive's own entry
+                await _update_job_status(client, job_id, 'processing', entries_created=entries_created + 1, total_files=total_files)
+            except Exception as e:
+                logger.warning(f"Failed to report progress of knowledge base processing job {job_id}: {e}")
+
+        processor = FileProcessor()
+        result = await processor.process_file_upload(
+            agent_id, account_id, file_content, filename, mime_type,
+            progress_callback=report_progress
+        )
+        del file_content
+
+        if result['success']:
+            if result.get('duplicate'):
+                # Same content as an earlier upload
+                entries_created, total_files = 0, 1
+            elif 'extracted_files' in result:
+                # The archive's own entry, unless an earlier upload of it was updated, and one per extracted file
+                entries_created = result['total_extracted'] + (0 if result['updated_previous_upload'] else 1)
+                total_files = result['total_extracted'] + result['total_failed'] + result['total_unchanged']
+            else:
+                entries_created = total_files = 1
+            await _update_job_status(client, job_id, 'completed', result_info=result, entries_created=entries_created, total_files=total_files)
+        else:
+            await _update_job_status(client, job_id, 'failed', error_message=result.get('error', 'Unknown error'))
+
+    except Exception as e:
+        logger.error(f"Error in background file processing for job {job_id}: {str(e)}")
+        try:
+            await _update_job_status(client, job_id, 'failed', error_message=str(e))
+        except Exception:
+            pass
+
+    try:
+        await client.storage.from_(UPLOADS_BUCKET).remove([storage_path])
+    except Exception as e:
+        logger.warning(f"Failed to remove processed upload {storage_path}: {e}")
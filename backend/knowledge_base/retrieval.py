@@ -0,0 +1,252 @@
+"""
+Chunked retrieval for agent knowledge bases.
+
+Agent knowledge base entries are split into overlapping chunks of about
+KB_CHUNK_TOKENS tokens, embedded with KB_EMBEDDING_MODEL and stored in
+agent_knowledge_base_chunks (pgvector). When an agent run starts, only the
+KB_RETRIEVAL_TOP_K chunks closest to the latest user message are put into the
+system prompt, instead of whole entries in creation order.
+
+Entries record when they were indexed (indexed_at, cleared by the database
+when their content or name changes). While an agent has active entries that
+are not indexed yet, get_combined_context() indexes them in the background and
+returns None, so the caller falls back to the get_combined_knowledge_base_context
+RPC for that run.
+"""
+
+import asyncio
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from knowledge_base import context_cache
+from utils.config import config
+from utils.logger import logger
+
+ENTRIES_TABLE = 'agent_knowledge_base_entries'
+CHUNKS_TABLE = 'agent_knowledge_base_chunks'
+
+# Same estimate as the database uses for content_tokens
+CHARS_PER_TOKEN = 4
+# Entries are indexed up to this length; longer content is cut off
+MAX_INDEXED_CONTENT_LENGTH = 2_000_000
+# Only the start of very long user messages is used as the query
+MAX_QUERY_LENGTH = 8000
+EMBEDDING_BATCH_SIZE = 100
+INSERT_BATCH_SIZE = 200
+
+# Entries being indexed in the background by this process
+_indexing: set = set()
+# Background indexing tasks, referenced until done so they are not garbage collected mid-run
+_indexing_tasks: set = set()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def _split(text: str, limit: int, separators=("\n\n", "\n", " ")) -> List[str]:
+    """Split text into pieces of at most limit characters, at the coarsest separator possible."""
+    if len(text) <= limit:
+        return [text]
+    if not separators:
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+
+    separator, finer_separators = separators[0], separators[1:]
+    parts = text.split(separator)
+    pieces = []
+    for i, part in enumerate(parts):
+        if i < len(parts) - 1:
+            part += separator
+        if part:
+            pieces.extend(_split(part, limit, finer_separators))
+    return pieces
+
+
+def chunk_text(text: str, chunk_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[str]:
+    """Split text into chunks of about chunk_tokens tokens that overlap by about overlap_tokens.
+
+    Chunks end at paragraph, line or word boundaries where possible.
+    """
+    chunk_chars = max(1, chunk_tokens or config.KB_CHUNK_TOKENS) * CHARS_PER_TOKEN
+    overlap_chars = min((overlap_tokens if overlap_tokens is not None else config.KB_CHUNK_OVERLAP_TOKENS) * CHARS_PER_TOKEN, chunk_chars // 2)
+
+    chunks = []
+    current: List[str] = []
+    current_size = 0
+    for piece in _split(text, chunk_chars):
+        if current and current_size + len(piece) > chunk_chars:
+            chunks.append("".join(current).strip())
+            # Start the next chunk with the end of this one
+            overlap: List[str] = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous)
+            current, current_size = overlap, overlap_size
+        current.append(piece)
+        current_size += len(piece)
+    if current:
+        chunks.append("".join(current).strip())
+
+    return [chunk for chunk in chunks if chunk]
+
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embed texts with KB_EMBEDDING_MODEL, in batches."""
+    # Imported here so file extraction processes, which import this module, don't load litellm
+    import litellm
+
+    embeddings = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        response = await litellm.aembedding(model=config.KB_EMBEDDING_MODEL, input=texts[i:i + EMBEDDING_BATCH_SIZE])
+        for item in response.data:
+            embeddings.append(item['embedding'] if isinstance(item, dict) else item.embedding)
+    return embeddings
+
+
+async def index_entries(client, entries: List[Dict[str, Any]]):
+    """Chunk and embed agent knowledge base entries, replacing their existing chunks.
+
+    Each entry needs its entry_id, agent_id, name and content. The content may
+    be longer than what is stored in the entry, e.g. the full text of a file.
+    """
+    if not entries:
+        return
+
+    rows = []
+    texts = []
+    for entry in entries:
+        for chunk_index, chunk in enumerate(chunk_text(entry['content'][:MAX_INDEXED_CONTENT_LENGTH])):
+            rows.append({
+                'entry_id': entry['entry_id'],
+                'agent_id': entry['agent_id'],
+                'chunk_index': chunk_index,
+                'content': chunk,
+                'content_tokens': estimate_tokens(chunk),
+            })
+            # The entry name gives chunks context they lack on their own
+            texts.append(f"{entry['name']}\n\n{chunk}")
+
+    embeddings = await embed_texts(texts) if texts else []
+    for row, embedding in zip(rows, embeddings):
+        row['embedding'] = embedding
+
+    entry_ids = [entry['entry_id'] for entry in entries]
+    await client.table(CHUNKS_TABLE).delete().in_('entry_id', entry_ids).execute()
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        await client.table(CHUNKS_TABLE).insert(rows[i:i + INSERT_BATCH_SIZE]).execute()
+
+    indexed_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    await client.table(ENTRIES_TABLE).update({'indexed_at': indexed_at}).in_('entry_id', entry_ids).execute()
+    logger.debug(f"Indexed {len(rows)} knowledge base chunks for {len(entries)} entries")
+
+
+async def try_index_entries(client, entries: List[Dict[str, Any]]) -> bool:
+    """index_entries() for callers that must not fail when indexing does; the entries are indexed at run time instead."""
+    try:
+        await index_entries(client, entries)
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to index {len(entries)} knowledge base entries, they will be indexed when next used: {e}")
+        return False
+
+
+async def _index_stored_entries(client, entry_ids: List[str]):
+    try:
+        result = await client.table(ENTRIES_TABLE).select('entry_id, agent_id, name, content').in_('entry_id', entry_ids).execute()
+        if result.data:
+            await index_entries(client, result.data)
+    except Exception as e:
+        logger.error(f"Failed to index knowledge base entries {entry_ids}: {e}")
+    finally:
+        _indexing.difference_update(entry_ids)
+
+
+def _schedule_indexing(client, entry_ids: List[str]):
+    entry_ids = [entry_id for entry_id in entry_ids if entry_id not in _indexing]
+    if entry_ids:
+        _indexing.update(entry_ids)
+        task = asyncio.create_task(_index_stored_entries(client, entry_ids))
+        _indexing_tasks.add(task)
+        task.add_done_callback(_indexing_tasks.discard)
+
+
+def _format_agent_context(matches: List[Dict[str, Any]], max_tokens: int) -> Tuple[Optional[str], Dict[str, Dict[str, Any]]]:
+    """Group the best matching chunks that fit into max_tokens by entry, most relevant entry first.
+
+    Returns the context text and the entries it uses by entry_id.
+    """
+    entries: Dict[str, Dict[str, Any]] = {}
+    used_tokens = 0
+    for match in matches:
+        tokens = match.get('content_tokens') or estimate_tokens(match['content'])
+        if used_tokens + tokens > max_tokens:
+            break
+        used_tokens += tokens
+        entry = entries.setdefault(match['entry_id'], {
+            'name': match['entry_name'],
+            'description': match.get('entry_description'),
+            'chunks': [],
+            'tokens': 0,
+        })
+        entry['chunks'].append(match)
+        entry['tokens'] += tokens
+
+    if not entries:
+        return None, entries
+
+    context_text = ''
+    for entry in entries.values():
+        context_text += f"\n\n## {entry['name']}\n"
+        if entry['description']:
+            context_text += f"{entry['description']}\n\n"
+        context_text += "\n\n".join(chunk['content'] for chunk in sorted(entry['chunks'], key=lambda c: c['chunk_index']))
+
+    return (
+        "# AGENT KNOWLEDGE BASE\n\nThe following are the parts of your specialized knowledge base most relevant "
+        "to the current request. Use this information as context when responding:" + context_text
+    ), entries
+
+
+async def get_combined_context(client, thread_id: str, agent_id: str, query: str, max_tokens: int = 4000) -> Optional[str]:
+    """Build the agent and thread knowledge base context for a run from the chunks most relevant to query.
+
+    Returns None if retrieval can't be used for this agent yet (no active
+    entries, or entries still to be indexed); use the
+    get_combined_knowledge_base_context RPC then. Like that RPC, the agent part
+    gets up to half of max_tokens and the thread knowledge base the rest.
+    """
+    entries = await client.table(ENTRIES_TABLE).select('entry_id, indexed_at').eq('agent_id', agent_id).eq('is_active', True).in_('usage_context', ['always', 'contextual']).execute()
+    if not entries.data:
+        return None
+
+    unindexed = [entry['entry_id'] for entry in entries.data if not entry.get('indexed_at')]
+    if unindexed:
+        logger.info(f"Indexing {len(unindexed)} knowledge base entries of agent {agent_id} in the background")
+        _schedule_indexing(client, unindexed)
+        return None
+
+    query_embedding = (await embed_texts([query[:MAX_QUERY_LENGTH]]))[0]
+    matches = await client.rpc('match_agent_knowledge_base_chunks', {
+        'p_agent_id': agent_id,
+        'p_query_embedding': query_embedding,
+        'p_match_count': config.KB_RETRIEVAL_TOP_K
+    }).execute()
+
+    agent_context, used_entries = _format_agent_context(matches.data or [], max_tokens // 2)
+    if used_entries:
+        try:
+            await client.table('agent_knowledge_base_usage_log').insert([
+                {'entry_id': entry_id, 'agent_id': agent_id, 'usage_type': 'context_injection', 'tokens_used': entry['tokens']}
+                for entry_id, entry in used_entries.items()
+            ]).execute()
+        except Exception as e:
+            logger.warning(f"Failed to log knowledge base usage for agent {agent_id}: {e}")
+
+    thread_context = await context_cache.get_thread_context(
+        client, thread_id, max_tokens - (estimate_tokens(agent_context) if agent_context else 0)
+    )
+
+    return "\n\n".join(context for context in (agent_context, thread_context) if context) or ""
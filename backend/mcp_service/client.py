@@ -15,17 +15,6 @@ from dataclasses import dataclass
 
 # Import MCP components according to the official SDK
 from mcp import ClientSession
-try:
-    from mcp.client.streamable_http import streamablehttp_client
-except ImportError:
-    # Fallback import if the module structure is different
-    try:
-        from mcp.client import streamablehttp_client
-    except ImportError:
-        raise ImportError(
-            "Could not import streamablehttp_client. "
-            "Make sure you have installed mcp with: pip install 'mcp[cli]'"
-        )
 
 # Import types - these should be in mcp.types according to the docs
 try:
@@ -41,6 +30,8 @@ except ImportError:
         Tool = Any
         ToolResult = Any
 
+from mcp_service.session_pool import mcp_session_pool
+from mcp_service.tool_catalog import cache_tools, get_cached_tools, invalidate_tools
 from utils.logger import logger
 import os
 
@@ -48,6 +39,12 @@ import os
 SMITHERY_API_KEY = os.getenv("SMITHERY_API_KEY")
 SMITHERY_SERVER_BASE_URL = "https://server.smithery.ai"
 
+
+def _smithery_server_url(qualified_name: str, server_config: Dict[str, Any]) -> str:
+    """Build the Smithery URL of a server, with its config encoded in base64."""
+    config_b64 = base64.b64encode(json.dumps(server_config).encode()).decode()
+    return f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
+
 @dataclass
 class MCPConnection:
     """Represents a connection to an MCP server"""
@@ -95,23 +92,21 @@ class MCPManager:
             )
         
         try:
-            # Encode config in base64
-            config_json = json.dumps(mcp_config["config"])
-            config_b64 = base64.b64encode(config_json.encode()).decode()
-            
-            # Create server URL
-            url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
-            
-            # Test connection and get available tools
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    logger.info(f"MCP session initialized for {qualified_name}")
-                    
-                    # List available tools
+            catalog_params = {"qualifiedName": qualified_name, "config": mcp_config["config"]}
+            cached_tools = await get_cached_tools(catalog_params)
+            if cached_tools is not None:
+                tools = [Tool(**tool) for tool in cached_tools]
+                logger.info(f"Using cached tool catalog for {qualified_name}")
+            else:
+                url = _smithery_server_url(qualified_name, mcp_config["config"])
+                
+                # List available tools over a pooled session, which later tool calls reuse
+                async with mcp_session_pool.session("http", url=url) as session:
                     tools_result = await session.list_tools()
-            tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+                tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+                await cache_tools(catalog_params, [
+                    {"name": t.name, "description": t.description, "inputSchema": t.inputSchema} for t in tools
+                ])
             
             logger.info(f"Available tools from {qualified_name}: {[t.name for t in tools]}")
             
@@ -121,7 +116,7 @@ class MCPManager:
                 name=mcp_config["name"],
                 config=mcp_config["config"],
                 enabled_tools=mcp_config.get("enabledTools", []),
-                session=None,  # No persistent session
+                session=None,  # Sessions are borrowed from mcp_session_pool per call
                 tools=tools
             )
             
@@ -133,13 +128,15 @@ class MCPManager:
             raise
             
     async def connect_all(self, mcp_configs: List[Dict[str, Any]]) -> None:
-        """Connect to all MCP servers in the configuration"""
-        for config in mcp_configs:
-            try:
-                await self.connect_server(config)
-            except Exception as e:
-                logger.error(f"Failed to connect to {config['qualifiedName']}: {str(e)}")
-                # Continue with other servers even if one fails
+        """Connect to all MCP servers in the configuration concurrently"""
+        results = await asyncio.gather(
+            *[self.connect_server(config) for config in mcp_configs],
+            return_exceptions=True
+        )
+        for config, result in zip(mcp_configs, results):
+            if isinstance(result, Exception):
+                # Other servers stay connected even if one fails
+                logger.error(f"Failed to connect to {config['qualifiedName']}: {str(result)}")
                 
     def get_all_tools_openapi(self) -> List[Dict[str, Any]]:
         """
@@ -211,55 +208,50 @@ class MCPManager:
             raise ValueError("SMITHERY_API_KEY environment variable is not set")
         
         try:
-            # Create fresh connection for this tool call
-            config_json = json.dumps(conn.config)
-            config_b64 = base64.b64encode(config_json.encode()).decode()
-            url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
+            url = _smithery_server_url(qualified_name, conn.config)
             
-            # Use the documented pattern with proper context management
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    
-                    # Call the tool
-                    result = await session.call_tool(original_tool_name, arguments)
-            
-                    # Convert result to dict - handle MCP response properly
-                    if hasattr(result, 'content'):
-                        # Handle content which might be a list of TextContent objects
-                        content = result.content
-                        if isinstance(content, list):
-                            # Extract text from TextContent objects
-                            text_parts = []
-                            for item in content:
-                                if hasattr(item, 'text'):
-                                    text_parts.append(item.text)
-                                elif hasattr(item, 'content'):
-                                    text_parts.append(str(item.content))
-                                else:
-                                    text_parts.append(str(item))
-                            content_str = "\n".join(text_parts)
-                        elif hasattr(content, 'text'):
-                            # Single TextContent object
-                            content_str = content.text
-                        elif hasattr(content, 'content'):
-                            content_str = str(content.content)
+            # Borrow a warm session from the pool instead of reconnecting for every call
+            async with mcp_session_pool.session("http", url=url) as session:
+                # Call the tool
+                result = await session.call_tool(original_tool_name, arguments)
+
+            # Convert result to dict - handle MCP response properly
+            if hasattr(result, 'content'):
+                # Handle content which might be a list of TextContent objects
+                content = result.content
+                if isinstance(content, list):
+                    # Extract text from TextContent objects
+                    text_parts = []
+                    for item in content:
+                        if hasattr(item, 'text'):
+                            text_parts.append(item.text)
+                        elif hasattr(item, 'content'):
+                            text_parts.append(str(item.content))
                         else:
-                            content_str = str(content)
-                        
-                        is_error = getattr(result, 'isError', False)
-                    else:
-                        content_str = str(result)
-                        is_error = False
-                        
-                return {
-                        "content": content_str,
-                        "isError": is_error
-                }
-                
+                            text_parts.append(str(item))
+                    content_str = "\n".join(text_parts)
+                elif hasattr(content, 'text'):
+                    # Single TextContent object
+                    content_str = content.text
+                elif hasattr(content, 'content'):
+                    content_str = str(content.content)
+                else:
+                    content_str = str(content)
+
+                is_error = getattr(result, 'isError', False)
+            else:
+                content_str = str(result)
+                is_error = False
+
+            return {
+                "content": content_str,
+                "isError": is_error
+            }
+
         except Exception as e:
             logger.error(f"Error executing MCP tool {tool_name}: {str(e)}")
+            # The cached tool list may be stale (e.g. the tool was removed from the server)
+            await invalidate_tools({"qualifiedName": qualified_name, "config": conn.config})
             return {
                 "content": f"Error executing tool: {str(e)}",
                 "isError": True
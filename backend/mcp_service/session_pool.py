@@ -0,0 +1,305 @@
+"""
+Process-wide pool of MCP client sessions.
+
+Opening an MCP session costs a transport connect plus the initialize
+handshake, so discovery and tool calls borrow warm sessions from this pool
+instead of opening one per call. Sessions are keyed by transport, endpoint and
+a hash of everything used to connect (URL query, headers, command arguments
+and environment), so different credentials never share a session.
+
+Idle sessions are pinged every MCP_SESSION_KEEPALIVE_INTERVAL seconds, which
+keeps them alive and retires dead connections, and closed once idle for
+MCP_SESSION_IDLE_TTL seconds. A session whose call raises is retired too, and
+the next borrower reconnects.
+
+Each session is owned by a background task that enters the transport and
+ClientSession contexts and exits them on close: the MCP transports run task
+groups that have to be exited by the task that entered them.
+
+Usage:
+    from mcp_service.session_pool import mcp_session_pool
+
+    async with mcp_session_pool.session("http", url=url) as session:
+        result = await session.call_tool(tool_name, arguments)
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from utils.config import config
+from utils.logger import logger
+
+TRANSPORT_SSE = "sse"
+TRANSPORT_HTTP = "http"
+TRANSPORT_STDIO = "stdio"
+
+DEFAULT_CONNECT_TIMEOUT = 15
+PING_TIMEOUT = 5
+CLOSE_TIMEOUT = 5
+
+
+@dataclass
+class _PooledSession:
+    key: str
+    label: str
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    closing: asyncio.Event = field(default_factory=asyncio.Event)
+    session: Optional[ClientSession] = None
+    task: Optional[asyncio.Task] = None
+    error: Optional[BaseException] = None
+    in_use: int = 0
+    retired: bool = False
+    last_used: float = field(default_factory=time.monotonic)
+    last_checked: float = field(default_factory=time.monotonic)
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self.closing.is_set() and self.task is not None and not self.task.done()
+
+
+def _session_key(transport: str, url: Optional[str], headers: Optional[Dict[str, str]],
+                 server_params: Optional[StdioServerParameters]) -> Tuple[str, str]:
+    """Build the pool key and a label without credentials for logs."""
+    if transport == TRANSPORT_STDIO:
+        endpoint = server_params.command
+        connect_params = {"command": server_params.command, "args": server_params.args, "env": server_params.env}
+    else:
+        endpoint = url.split("?", 1)[0]
+        connect_params = {"url": url, "headers": headers or {}}
+    digest = hashlib.sha256(json.dumps(connect_params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    label = f"{transport}:{endpoint}"
+    return f"{label}:{digest}", label
+
+
+def _open_transport(transport: str, url: Optional[str], headers: Optional[Dict[str, str]],
+                    server_params: Optional[StdioServerParameters]):
+    if transport == TRANSPORT_SSE:
+        try:
+            return sse_client(url, headers=headers or {})
+        except TypeError as e:
+            # Older mcp versions do not accept headers
+            if "unexpected keyword argument" in str(e):
+                return sse_client(url)
+            raise
+    if transport == TRANSPORT_HTTP:
+        return streamablehttp_client(url)
+    if transport == TRANSPORT_STDIO:
+        return stdio_client(server_params)
+    raise ValueError(f"Unsupported MCP transport: {transport}")
+
+
+class MCPSessionPool:
+    """Shares initialized MCP client sessions across agent runs in a process."""
+
+    def __init__(self):
+        self._entries: Dict[str, _PooledSession] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+
+    def _check_loop(self):
+        # Sessions are bound to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._entries:
+                logger.warning(f"MCP session pool used from a new event loop, dropping {len(self._entries)} sessions")
+            self._abandon_loop()
+            self._loop = loop
+            self._entries = {}
+            self._lock = asyncio.Lock()
+            self._maintenance_task = None
+
+    def _abandon_loop(self):
+        """Cancel the tasks owning sessions of the previous loop so their transports are exited."""
+        old_loop = self._loop
+        tasks = [entry.task for entry in self._entries.values() if entry.task]
+        if self._maintenance_task:
+            tasks.append(self._maintenance_task)
+        if old_loop is None or old_loop.is_closed() or not tasks:
+            return
+        for task in tasks:
+            try:
+                old_loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # The loop closed in the meantime, taking its tasks with it
+                break
+
+    @asynccontextmanager
+    async def session(
+        self,
+        transport: str,
+        url: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        server_params: Optional[StdioServerParameters] = None,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    ) -> AsyncIterator[ClientSession]:
+        """Borrow an initialized session for the given server, connecting if needed."""
+        entry = await self._acquire(transport, url, headers, server_params, connect_timeout)
+        failed = False
+        try:
+            yield entry.session
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if failed:
+                # The connection may be broken or left mid-request; don't hand it out again
+                self._retire(entry)
+            else:
+                entry.last_checked = entry.last_used
+            if entry.retired and entry.in_use == 0:
+                self._close(entry)
+
+    async def _acquire(self, transport: str, url: Optional[str], headers: Optional[Dict[str, str]],
+                       server_params: Optional[StdioServerParameters], connect_timeout: float) -> _PooledSession:
+        self._check_loop()
+        key, label = _session_key(transport, url, headers, server_params)
+
+        for _ in range(2):
+            async with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.ready.is_set() and not entry.alive:
+                    self._retire(entry)
+                    entry = None
+                if entry is None:
+                    self._evict_for_capacity()
+                    entry = _PooledSession(key=key, label=label)
+                    entry.task = asyncio.create_task(self._run_session(entry, transport, url, headers, server_params))
+                    self._entries[key] = entry
+                    self._ensure_maintenance()
+                entry.in_use += 1
+
+            try:
+                await asyncio.wait_for(entry.ready.wait(), timeout=connect_timeout)
+            except BaseException:
+                entry.in_use -= 1
+                self._retire(entry)
+                raise
+
+            if not entry.alive:
+                entry.in_use -= 1
+                self._retire(entry)
+                raise ConnectionError(f"Failed to connect to MCP server {label}: {entry.error}") from entry.error
+
+            if time.monotonic() - entry.last_checked < config.MCP_SESSION_KEEPALIVE_INTERVAL or await self._probe(entry):
+                return entry
+
+            # Stale session that no longer answers pings: reconnect once
+            logger.info(f"Pooled MCP session {label} failed its health check, reconnecting")
+            entry.in_use -= 1
+            self._retire(entry)
+
+        raise ConnectionError(f"MCP server {label} is not responding")
+
+    async def _run_session(self, entry: _PooledSession, transport: str, url: Optional[str],
+                           headers: Optional[Dict[str, str]], server_params: Optional[StdioServerParameters]):
+        """Own a session: connect, initialize, then hold it open until it is closed."""
+        try:
+            async with AsyncExitStack() as stack:
+                streams = await stack.enter_async_context(_open_transport(transport, url, headers, server_params))
+                session = await stack.enter_async_context(ClientSession(streams[0], streams[1]))
+                await session.initialize()
+                entry.session = session
+                entry.last_checked = time.monotonic()
+                entry.ready.set()
+                logger.info(f"Opened pooled MCP session {entry.label}")
+                await entry.closing.wait()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            entry.error = e
+            logger.warning(f"Pooled MCP session {entry.label} ended with error: {e}")
+        finally:
+            entry.session = None
+            entry.ready.set()
+            logger.debug(f"Closed pooled MCP session {entry.label}")
+
+    async def _probe(self, entry: _PooledSession) -> bool:
+        try:
+            async with asyncio.timeout(PING_TIMEOUT):
+                await entry.session.send_ping()
+            entry.last_checked = time.monotonic()
+            return True
+        except Exception as e:
+            logger.debug(f"Ping to pooled MCP session {entry.label} failed: {e}")
+            return False
+
+    def _retire(self, entry: _PooledSession):
+        """Stop handing out a session; it is closed once no borrower holds it."""
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        entry.retired = True
+        if entry.in_use == 0:
+            self._close(entry)
+
+    def _close(self, entry: _PooledSession):
+        if entry.task is None or entry.task.done():
+            return
+        if entry.ready.is_set():
+            entry.closing.set()
+        else:
+            # Still connecting; nothing to exit cleanly yet
+            entry.task.cancel()
+
+    def _evict_for_capacity(self):
+        if len(self._entries) < config.MCP_SESSION_POOL_MAX_SIZE:
+            return
+        idle = [entry for entry in self._entries.values() if entry.in_use == 0 and entry.ready.is_set()]
+        if not idle:
+            logger.warning(f"MCP session pool is full ({len(self._entries)} sessions in use), growing past the limit")
+            return
+        self._retire(min(idle, key=lambda entry: entry.last_used))
+
+    def _ensure_maintenance(self):
+        if self._maintenance_task is None or self._maintenance_task.done():
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def _maintenance_loop(self):
+        """Evict idle sessions and ping the rest; stops when the pool is empty."""
+        while self._entries:
+            await asyncio.sleep(config.MCP_SESSION_KEEPALIVE_INTERVAL)
+            now = time.monotonic()
+            for entry in list(self._entries.values()):
+                if not entry.ready.is_set() or entry.in_use:
+                    continue
+                if not entry.alive:
+                    self._retire(entry)
+                elif now - entry.last_used > config.MCP_SESSION_IDLE_TTL:
+                    logger.debug(f"Evicting idle MCP session {entry.label}")
+                    self._retire(entry)
+                elif not await self._probe(entry):
+                    logger.info(f"Pooled MCP session {entry.label} failed keep-alive ping, closing")
+                    self._retire(entry)
+
+    async def close(self):
+        """Close every session in the pool."""
+        if self._loop is not asyncio.get_running_loop():
+            return
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        entries = list(self._entries.values())
+        self._entries = {}
+        for entry in entries:
+            entry.retired = True
+            self._close(entry)
+        tasks = [entry.task for entry in entries if entry.task]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=CLOSE_TIMEOUT)
+            for task in pending:
+                task.cancel()
+
+
+mcp_session_pool = MCPSessionPool()
@@ -0,0 +1,54 @@
+"""
+Redis cache of the tools each MCP server exposes.
+
+Listing tools needs a connection and handshake with every server, which
+delays the start of each agent run. The catalog stores the tool list of a
+server under a hash of its connection config (credentials are never stored)
+for MCP_TOOL_CATALOG_TTL seconds, so repeat runs can register the tools
+without contacting the servers. A server's entry is dropped when a call to
+one of its tools fails, so the next run lists its tools again.
+
+Tools are stored as {"name", "description", "inputSchema"} dicts.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+TOOL_CATALOG_KEY_PREFIX = "mcp:tools:"
+
+
+def catalog_key(server_params: Dict[str, Any]) -> str:
+    """Cache key for a server, from everything that determines its tool list."""
+    digest = hashlib.sha256(json.dumps(server_params, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{TOOL_CATALOG_KEY_PREFIX}{digest}"
+
+
+async def get_cached_tools(server_params: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """Get the cached tool list of a server, or None if it is not cached."""
+    try:
+        cached = await redis.get(catalog_key(server_params))
+        return json.loads(cached) if cached else None
+    except Exception as e:
+        logger.warning(f"Failed to read MCP tool catalog from cache: {e}")
+        return None
+
+
+async def cache_tools(server_params: Dict[str, Any], tools: List[Dict[str, Any]]) -> None:
+    """Cache the tool list of a server."""
+    try:
+        await redis.set(catalog_key(server_params), json.dumps(tools, default=str), ex=config.MCP_TOOL_CATALOG_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to cache MCP tool catalog: {e}")
+
+
+async def invalidate_tools(server_params: Dict[str, Any]) -> None:
+    """Drop the cached tool list of a server."""
+    try:
+        await redis.delete(catalog_key(server_params))
+    except Exception as e:
+        logger.warning(f"Failed to invalidate MCP tool catalog: {e}")
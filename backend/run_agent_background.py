@@ -8,9 +8,13 @@ import traceback
 from datetime import datetime, timezone
 from typing import Optional
 from services import redis
+from services import response_stream
 from agent.run import run_agent
+from knowledge_base import ingestion as kb_ingestion
+from mcp_service.session_pool import mcp_session_pool
 from utils.logger import logger, structlog
 import dramatiq
+import dramatiq.asyncio
 import uuid
 from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
@@ -55,6 +59,23 @@ else:
     )
     logger.info(f"Using individual RabbitMQ env vars for connection to {rabbitmq_host}:{rabbitmq_port}")
 
+
+class MCPSessionPoolShutdown(dramatiq.Middleware):
+    """Close pooled MCP sessions when the worker shuts down.
+
+    after_worker_shutdown hooks run in reverse order, so this runs once the
+    actors have stopped but before AsyncIO stops the event loop the sessions
+    live on.
+    """
+
+    def after_worker_shutdown(self, broker, worker):
+        try:
+            dramatiq.asyncio.get_event_loop_thread().run_coroutine(mcp_session_pool.close())
+        except Exception as e:
+            logger.error(f"Failed to close MCP sessions: {str(e)}")
+
+
+rabbitmq_broker.add_middleware(MCPSessionPoolShutdown())
 dramatiq.set_broker(rabbitmq_broker)
 
 
@@ -80,6 +101,44 @@ async def check_health(key: str):
     structlog.contextvars.clear_contextvars()
     await redis.set(key, "healthy", ex=redis.REDIS_KEY_TTL)
 
+# How long an upload waits before trying again when its account has no free processing slot
+KB_UPLOAD_RETRY_DELAY_MS = 10_000
+
+@dramatiq.actor(queue_name="knowledge_base")
+async def process_kb_upload_background(
+    job_id: str,
+    agent_id: str,
+    account_id: str,
+    storage_path: str,
+    filename: str,
+    mime_type: str
+):
+    """Process a knowledge base file upload stored in the uploads bucket."""
+    structlog.contextvars.clear_contextvars()
+    structlog.contextvars.bind_contextvars(
+        kb_job_id=job_id,
+        agent_id=agent_id,
+    )
+
+    try:
+        await initialize()
+    except Exception as e:
+        logger.critical(f"Failed to initialize Redis connection: {e}")
+        raise e
+
+    if not await kb_ingestion.acquire_account_slot(account_id, job_id):
+        logger.info(f"Account {account_id} is already processing its maximum number of uploads, retrying job {job_id} later")
+        process_kb_upload_background.send_with_options(
+            args=(job_id, agent_id, account_id, storage_path, filename, mime_type),
+            delay=KB_UPLOAD_RETRY_DELAY_MS
+        )
+        return
+
+    try:
+        await kb_ingestion.process_uploaded_file(job_id, agent_id, account_id, storage_path, filename, mime_type)
+    finally:
+        await kb_ingestion.release_account_slot(account_id, job_id)
+
 @dramatiq.actor
 async def run_agent_background(
     agent_run_id: str,
@@ -152,11 +211,10 @@ async def run_agent_background(
     total_responses = 0
     pubsub = None
     stop_checker = None
+    response_writer = response_stream.ResponseBatchWriter(agent_run_id)
     stop_signal_received = False
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
     instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
     instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
@@ -230,8 +288,6 @@ async def run_agent_background(
         final_status = "running"
         error_message = None
 
-        pending_redis_operations = []
-
         async for response in agent_gen:
             if stop_signal_received:
                 logger.info(f"Agent run {agent_run_id} stopped by signal.")
@@ -240,10 +296,8 @@ async def run_agent_background(
                     trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
                 break
 
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+            # Buffer response; the writer flushes batches and notifies readers
+            await response_writer.add(response)
             total_responses += 1
 
             # Check for agent-signaled completion or error
@@ -256,6 +310,9 @@ async def run_agent_background(
                          error_message = response.get('message', f"Run ended with status: {status_val}")
                      break
 
+        # Write any buffered responses before the final status and DB update
+        await response_writer.close()
+
         # If loop finished without explicit completion/error/stop signal, mark as completed
         if final_status == "running":
              final_status = "completed"
@@ -264,12 +321,10 @@ async def run_agent_background(
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              if trace:
                  trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             await response_stream.append_responses(agent_run_id, [completion_message])
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        # Collect final responses from Redis for DB update (compacted per AGENT_RUN_RESPONSES_STORAGE)
+        all_responses = await response_stream.get_responses_for_storage(agent_run_id)
 
         # Update DB status
         await update_agent_run_status(client, agent_run_id, final_status, error=error_message, responses=all_responses)
@@ -277,7 +332,7 @@ async def run_agent_background(
         # Publish final control signal (END_STREAM or ERROR)
         control_signal = "END_STREAM" if final_status == "completed" else "ERROR" if final_status == "failed" else "STOP"
         try:
-            await redis.publish(global_control_channel, control_signal)
+            await response_stream.publish_control(agent_run_id, control_signal)
             # No need to publish to instance channel as the run is ending on this instance
             logger.debug(f"Published final control signal '{control_signal}' to {global_control_channel}")
         except Exception as e:
@@ -292,19 +347,18 @@ async def run_agent_background(
         if trace:
             trace.span(name="agent_run_failed").end(status_message=error_message, level="ERROR")
 
-        # Push error message to Redis list
+        # Push error message to Redis after any buffered responses
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            await response_writer.close()
+            await response_stream.append_responses(agent_run_id, [error_response])
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
         # Fetch final responses (including the error)
         all_responses = []
         try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
+             all_responses = await response_stream.get_responses_for_storage(agent_run_id)
         except Exception as fetch_err:
              logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
              all_responses = [error_response] # Use the error message we tried to push
@@ -314,7 +368,7 @@ async def run_agent_background(
 
         # Publish ERROR signal
         try:
-            await redis.publish(global_control_channel, "ERROR")
+            await response_stream.publish_control(agent_run_id, "ERROR")
             logger.debug(f"Published ERROR signal to {global_control_channel}")
         except Exception as e:
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
@@ -336,6 +390,14 @@ async def run_agent_background(
             except Exception as e:
                 logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
 
+        # Make sure buffered responses are written, with timeout
+        try:
+            await asyncio.wait_for(response_writer.close(), timeout=30.0)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
+        except Exception as e:
+            logger.warning(f"Failed to write buffered responses for {agent_run_id}: {str(e)}")
+
         # Set TTL on the response list in Redis
         await _cleanup_redis_response_list(agent_run_id)
 
@@ -345,12 +407,6 @@ async def run_agent_background(
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
 
-        # Wait for all pending redis operations to complete, with timeout
-        try:
-            await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
-
         logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
 async def _cleanup_redis_instance_key(agent_run_id: str):
@@ -380,20 +436,19 @@ async def _cleanup_redis_run_lock(agent_run_id: str):
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
 
 async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+    """Set TTL on the stored Redis responses."""
     try:
-        await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
-        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response list: {response_list_key}")
+        await response_stream.expire_responses(agent_run_id, REDIS_RESPONSE_LIST_TTL)
+        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on responses for agent run: {agent_run_id}")
     except Exception as e:
-        logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
+        logger.warning(f"Failed to set TTL on responses for agent run {agent_run_id}: {str(e)}")
 
 async def update_agent_run_status(
     client,
     agent_run_id: str,
     status: str,
     error: Optional[str] = None,
-    responses: Optional[list[any]] = None # Expects parsed list of dicts
+    responses: Optional[Any] = None # Parsed list of dicts, or a compressed blob
 ) -> bool:
     """
     Centralized function to update agent run status.
@@ -0,0 +1,150 @@
+"""
+HTTP client for the browser automation API in the sandbox.
+
+The sandbox runs browser_api.py on port 8003. Browser tools call it directly
+through the sandbox's preview link for that port, over a connection pool
+shared by the process, rather than running curl inside the sandbox for every
+action. Actions ask for screenshots by reference (X-Screenshot-Mode:
+reference): results carry a screenshot_id instead of a base64 image, and
+fetch_screenshot() downloads the JPEG as binary when it is needed.
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from daytona_sdk import AsyncSandbox
+
+from utils.http_client import SharedHTTPClient
+from utils.logger import logger
+
+BROWSER_API_PORT = 8003
+
+# Actions wait for the page to settle before taking their screenshot
+ACTION_TIMEOUT = httpx.Timeout(90.0, connect=10.0)
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+
+_http_client = SharedHTTPClient(timeout=ACTION_TIMEOUT, limits=POOL_LIMITS)
+
+# Browser API base URL and request headers per sandbox id
+_endpoints: Dict[str, Tuple[str, Dict[str, str]]] = {}
+
+
+async def _get_endpoint(sandbox: AsyncSandbox) -> Tuple[str, Dict[str, str]]:
+    endpoint = _endpoints.get(sandbox.id)
+    if endpoint is None:
+        preview_link = await sandbox.get_preview_link(BROWSER_API_PORT)
+        base_url = preview_link.url if hasattr(preview_link, 'url') else str(preview_link)
+        headers = {"X-Daytona-Skip-Preview-Warning": "true"}
+        token = getattr(preview_link, 'token', None)
+        if token:
+            headers["X-Daytona-Preview-Token"] = token
+        endpoint = (base_url.rstrip('/'), headers)
+        _endpoints[sandbox.id] = endpoint
+    return endpoint
+
+
+class BrowserAPIError(Exception):
+    """The browser API answered with an error status or a body that is not JSON."""
+
+    def __init__(self, endpoint: str, status_code: int, detail: str):
+        super().__init__(f"Browser API {endpoint} returned HTTP {status_code}: {detail}")
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.detail = detail
+
+
+def forget_sandbox(sandbox_id: str):
+    """Drop the cached browser API endpoint of a sandbox, e.g. after it was restarted."""
+    _endpoints.pop(sandbox_id, None)
+
+
+async def call_action(sandbox: AsyncSandbox, endpoint: str, params: Optional[Dict[str, Any]] = None,
+                      method: str = "POST", dom_base: Optional[str] = None) -> Dict[str, Any]:
+    """Call /api/automation/{endpoint} and return the JSON result.
+
+    With dom_base (the dom_snapshot_id of the last result the caller holds, or
+    "none"), elements come as elements_diff: only the elements that changed
+    since that snapshot, or all of them if the snapshot is unknown. Rebuild the
+    full lists with apply_elements_diff().
+
+    Error statuses and non-JSON bodies (e.g. a proxy error page) raise
+    BrowserAPIError; transport errors raise httpx errors.
+    """
+    base_url, headers = await _get_endpoint(sandbox)
+    url = f"{base_url}/api/automation/{endpoint}"
+    headers = {**headers, "X-Screenshot-Mode": "reference"}
+    if dom_base:
+        headers["X-DOM-Base"] = dom_base
+
+    client = _http_client.client()
+    try:
+        if method == "GET":
+            response = await client.get(url, params=params, headers=headers)
+        else:
+            response = await client.request(method, url, json=params or {}, headers=headers)
+    except httpx.TransportError:
+        # The preview URL may have changed if the sandbox was restarted
+        forget_sandbox(sandbox.id)
+        raise
+
+    is_json = response.headers.get("content-type", "").startswith("application/json")
+    if not response.is_success:
+        logger.warning(f"Browser API {endpoint} returned HTTP {response.status_code}")
+        detail = response.text[:500]
+        if is_json:
+            try:
+                # FastAPI errors come back as {"detail": ...}
+                detail = str(response.json().get("detail", detail))
+            except (ValueError, AttributeError):
+                pass
+        raise BrowserAPIError(endpoint, response.status_code, detail)
+    if not is_json:
+        raise BrowserAPIError(endpoint, response.status_code, f"unexpected content type '{response.headers.get('content-type', '')}'")
+    try:
+        return response.json()
+    except ValueError as e:
+        raise BrowserAPIError(endpoint, response.status_code, f"invalid JSON: {e}") from e
+
+
+async def fetch_screenshot(sandbox: AsyncSandbox, screenshot_id: str) -> bytes:
+    """Download a screenshot taken by an action as JPEG bytes."""
+    base_url, headers = await _get_endpoint(sandbox)
+    response = await _http_client.client().get(f"{base_url}/api/automation/screenshot/{screenshot_id}", headers=headers)
+    response.raise_for_status()
+    return response.content
+
+
+def apply_elements_diff(result: Dict[str, Any], base_snapshot_id: Optional[str],
+                        lines: Dict[int, str], elements: Dict[int, Dict[str, Any]]) -> bool:
+    """Rebuild elements and interactive_elements of a diff-mode result in place.
+
+    lines and elements hold the element lines and interactive elements of the
+    caller's snapshot (base_snapshot_id) by index, and are updated to the new
+    snapshot. A diff without a base lists every element. Returns False if the
+    result has no diff or was diffed against another snapshot; in the latter
+    case the lists are rebuilt from the diff's changed entries alone, which
+    may leave out unchanged elements.
+    """
+    diff = result.pop("elements_diff", None)
+    if diff is None:
+        return False
+    diff_base = diff.get("base_snapshot_id")
+    matches_base = diff_base is None or diff_base == base_snapshot_id
+    if diff_base is None or not matches_base:
+        lines.clear()
+        elements.clear()
+
+    for index in diff.get("removed", []):
+        lines.pop(int(index), None)
+        elements.pop(int(index), None)
+    for change in diff.get("changed", []):
+        index = int(change["index"])
+        lines[index] = change["line"]
+        if change.get("element") is not None:
+            elements[index] = change["element"]
+        else:
+            elements.pop(index, None)
+
+    result["elements"] = "\n".join(lines[index] for index in sorted(lines)) or "No interactive elements found"
+    result["interactive_elements"] = [elements[index] for index in sorted(elements)]
+    return matches_base
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Body
+from fastapi import FastAPI, APIRouter, HTTPException, Body, Request, Response
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import asyncio
+import contextvars
+import hashlib
 import json
 import logging
 import base64
@@ -11,11 +13,25 @@ from datetime import datetime
 import os
 import random
 from functools import cached_property
+from collections import OrderedDict
 import traceback
 import pytesseract
 from PIL import Image
 import io
 
+# Screenshots kept in memory for GET /api/automation/screenshot/{screenshot_id}
+MAX_STORED_SCREENSHOTS = 20
+
+# OCR results kept for recent screenshots, keyed by screenshot_id
+MAX_CACHED_OCR_RESULTS = 20
+
+# Set per request from the X-Screenshot-Mode header: "inline" embeds screenshots
+# in action results as base64, "reference" returns only their screenshot_id
+screenshot_mode: contextvars.ContextVar[str] = contextvars.ContextVar("screenshot_mode", default="inline")
+# Set per request from the X-DOM-Base header: the dom_snapshot_id the client already
+# has, or "none". When set, results carry elements as a diff against that snapshot
+dom_base: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("dom_base", default=None)
+
 #######################################################
 # Action model definitions
 #######################################################
@@ -99,6 +115,18 @@ class HashedDomElement:
     attributes: Dict[str, str]
     is_visible: bool
     page_coordinates: Optional[CoordinateSet] = None
+    
+    def key(self, text: str = "") -> str:
+        """Stable digest of the element and its text, used to recognise it across snapshots"""
+        coords = self.page_coordinates
+        payload = json.dumps([
+            self.tag_name,
+            sorted(self.attributes.items()),
+            self.is_visible,
+            [coords.x, coords.y, coords.width, coords.height] if coords else None,
+            text
+        ], default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
 
 @dataclass
 class DOMBaseNode:
@@ -181,6 +209,42 @@ class DOMElementNode(DOMBaseNode):
         collect_text(self, 0)
         return '\n'.join(text_parts).strip()
     
+    def clickable_element_line(self, include_attributes: list[str] | None = None) -> str:
+        """Format this element for the clickable elements list, without its [index] prefix."""
+        attributes_str = ''
+        text = self.get_all_text_till_next_clickable_element()
+        
+        # Process attributes for display
+        display_attributes = []
+        if include_attributes:
+            for key, value in self.attributes.items():
+                if key in include_attributes and value and value != self.tag_name:
+                    if text and value in text:
+                        continue  # Skip if attribute value is already in the text
+                    display_attributes.append(str(value))
+        
+        attributes_str = ';'.join(display_attributes)
+        
+        # Build the element string
+        line = f'<{self.tag_name}'
+        
+        # Add important attributes for identification
+        for attr_name in ['id', 'href', 'name', 'value', 'type']:
+            if attr_name in self.attributes and self.attributes[attr_name]:
+                line += f' {attr_name}="{self.attributes[attr_name]}"'
+        
+        # Add the text content if available
+        if text:
+            line += f'> {text}'
+        elif attributes_str:
+            line += f'> {attributes_str}'
+        else:
+            # If no text and no attributes, use the tag name
+            line += f'> {self.tag_name.upper()}'
+        
+        line += ' </>'
+        return line
+    
     def clickable_elements_to_string(self, include_attributes: list[str] | None = None) -> str:
         """Convert the processed DOM content to HTML."""
         formatted_text = []
@@ -189,39 +253,7 @@ class DOMElementNode(DOMBaseNode):
             if isinstance(node, DOMElementNode):
                 # Add element with highlight_index
                 if node.highlight_index is not None:
-                    attributes_str = ''
-                    text = node.get_all_text_till_next_clickable_element()
-                    
-                    # Process attributes for display
-                    display_attributes = []
-                    if include_attributes:
-                        for key, value in node.attributes.items():
-                            if key in include_attributes and value and value != node.tag_name:
-                                if text and value in text:
-                                    continue  # Skip if attribute value is already in the text
-                                display_attributes.append(str(value))
-                    
-                    attributes_str = ';'.join(display_attributes)
-                    
-                    # Build the element string
-                    line = f'[{node.highlight_index}]<{node.tag_name}'
-                    
-                    # Add important attributes for identification
-                    for attr_name in ['id', 'href', 'name', 'value', 'type']:
-                        if attr_name in node.attributes and node.attributes[attr_name]:
-                            line += f' {attr_name}="{node.attributes[attr_name]}"'
-                    
-                    # Add the text content if available
-                    if text:
-                        line += f'> {text}'
-                    elif attributes_str:
-                        line += f'> {attributes_str}'
-                    else:
-                        # If no text and no attributes, use the tag name
-                        line += f'> {node.tag_name.upper()}'
-                    
-                    line += ' </>'
-                    formatted_text.append(line)
+                    formatted_text.append(f'[{node.highlight_index}]' + node.clickable_element_line(include_attributes))
                 
                 # Process children regardless
                 for child in node.children:
@@ -245,6 +277,17 @@ class DOMState:
     title: str = ""
     pixels_above: int = 0
     pixels_below: int = 0
+    # Digest of what the viewport shows (scroll position, text, form values, loaded images);
+    # None when the page has content it cannot see into, such as canvas or video
+    visual_signature: Optional[str] = None
+
+@dataclass
+class DOMSnapshot:
+    """The clickable elements last returned to clients, by highlight index"""
+    snapshot_id: str
+    url: str
+    lines: Dict[int, str]
+    elements: Dict[int, Dict[str, Any]]
 
 #######################################################
 # Browser Action Result Model
@@ -260,6 +303,9 @@ class BrowserActionResult(BaseModel):
     title: Optional[str] = None
     elements: Optional[str] = None  # Formatted string of clickable elements
     screenshot_base64: Optional[str] = None
+    screenshot_id: Optional[str] = None  # Fetch the image from /automation/screenshot/{screenshot_id}
+    dom_snapshot_id: Optional[str] = None  # Send back as X-DOM-Base to get only changed elements next time
+    elements_diff: Optional[Dict[str, Any]] = None  # Replaces elements and interactive_elements in diff mode
     pixels_above: int = 0
     pixels_below: int = 0
     content: Optional[str] = None
@@ -289,6 +335,20 @@ class BrowserAutomation:
         self.include_attributes = ["id", "href", "src", "alt", "aria-label", "placeholder", "name", "role", "title", "value"]
         self.screenshot_dir = os.path.join(os.getcwd(), "screenshots")
         os.makedirs(self.screenshot_dir, exist_ok=True)
+        self.screenshots: "OrderedDict[str, bytes]" = OrderedDict()
+        self.latest_screenshot_id: Optional[str] = None
+        
+        # State carried between actions so unchanged pages are not re-captured:
+        # the last screenshot and the visual signature it was taken at, OCR text
+        # per screenshot, element nodes by HashedDomElement key and the last
+        # element snapshot sent to clients
+        self.last_screenshot: str = ""
+        self.last_visual_signature: Optional[str] = None
+        self.ocr_cache: "OrderedDict[str, str]" = OrderedDict()
+        self.element_nodes: Dict[str, DOMElementNode] = {}
+        self.element_keys: Dict[int, str] = {}
+        self.element_lines: Dict[str, str] = {}
+        self.dom_snapshot: Optional[DOMSnapshot] = None
         
         # Register routes
         self.router.on_startup.append(self.startup)
@@ -326,6 +386,9 @@ class BrowserAutomation:
         
         # Drag and drop
         self.router.post("/automation/drag_drop")(self.drag_drop)
+        
+        # Screenshots taken by the actions above, as binary images
+        self.router.get("/automation/screenshot/{screenshot_id}")(self.get_screenshot)
 
     async def startup(self):
         """Initialize the browser instance on startup"""
@@ -406,6 +469,7 @@ class BrowserAutomation:
         
         # Create a selector map for interactive elements
         selector_map = {}
+        self.element_keys = {}
         
         try:
             # More comprehensive JavaScript to find interactive elements
@@ -480,7 +544,9 @@ class BrowserAutomation:
                 is_top_element=True
             )
             
-            # Create element nodes for each element
+            # Create element nodes for each element, reusing the nodes of elements
+            # that are unchanged since the previous snapshot
+            element_nodes = {}
             for idx, el in enumerate(elements):
                 # Create coordinate sets
                 page_coordinates = None
@@ -504,27 +570,46 @@ class BrowserAutomation:
                         height=coords.get('height', 0)
                     )
                 
-                # Create the element node
-                element_node = DOMElementNode(
-                    is_visible=el.get('isVisible', True),
+                highlight_index = el.get('index', idx + 1)
+                element_key = HashedDomElement(
                     tag_name=el.get('tagName', 'div'),
                     attributes=el.get('attributes', {}),
-                    is_interactive=el.get('isInteractive', True),
-                    is_in_viewport=el.get('isInViewport', False),
-                    highlight_index=el.get('index', idx + 1),
-                    page_coordinates=page_coordinates,
-                    viewport_coordinates=viewport_coordinates
-                )
+                    is_visible=el.get('isVisible', True),
+                    page_coordinates=page_coordinates
+                ).key(el.get('text', ''))
                 
-                # Add a text node if there's text content
-                if el.get('text'):
-                    text_node = DOMTextNode(is_visible=True, text=el.get('text', ''))
-                    text_node.parent = element_node
-                    element_node.children.append(text_node)
+                element_node = self.element_nodes.get(element_key)
+                if element_node is not None and element_key not in element_nodes:
+                    # Unchanged element: keep its subtree, update what depends on position and scroll
+                    element_node.highlight_index = highlight_index
+                    element_node.is_in_viewport = el.get('isInViewport', False)
+                    element_node.viewport_coordinates = viewport_coordinates
+                else:
+                    # Create the element node
+                    element_node = DOMElementNode(
+                        is_visible=el.get('isVisible', True),
+                        tag_name=el.get('tagName', 'div'),
+                        attributes=el.get('attributes', {}),
+                        is_interactive=el.get('isInteractive', True),
+                        is_in_viewport=el.get('isInViewport', False),
+                        highlight_index=highlight_index,
+                        page_coordinates=page_coordinates,
+                        viewport_coordinates=viewport_coordinates
+                    )
+                    
+                    # Add a text node if there's text content
+                    if el.get('text'):
+                        text_node = DOMTextNode(is_visible=True, text=el.get('text', ''))
+                        text_node.parent = element_node
+                        element_node.children.append(text_node)
                 
-                selector_map[el.get('index', idx + 1)] = element_node
+                element_nodes[element_key] = element_node
+                self.element_keys[highlight_index] = element_key
+                selector_map[highlight_index] = element_node
                 root.children.append(element_node)
                 element_node.parent = root
+            
+            self.element_nodes = element_nodes
                 
         except Exception as e:
             print(f"Error getting selector map: {e}")
@@ -560,9 +645,8 @@ class BrowserAutomation:
             
             # Add all elements from selector map as children of root
             for element in selector_map.values():
-                if element.parent is None:
-                    element.parent = root
-                    root.children.append(element)
+                element.parent = root
+                root.children.append(element)
             
             # Get basic page info
             url = page.url
@@ -584,20 +668,43 @@ class BrowserAutomation:
                     const scrollY = window.scrollY || window.pageYOffset;
                     const windowHeight = window.innerHeight;
                     
+                    // Cheap digest of what is on screen, to skip screenshots of unchanged pages.
+                    // Pages with canvas, video or iframes can change without any of this changing.
+                    let visualSignature = null;
+                    if (!document.querySelector('canvas, video, iframe, embed, object')) {
+                        const active = document.activeElement;
+                        const parts = [
+                            location.href, window.scrollX, scrollY, window.innerWidth, windowHeight, totalHeight,
+                            body.innerText,
+                            Array.from(document.querySelectorAll('input, textarea, select')).map(el => el.type === 'checkbox' || el.type === 'radio' ? el.checked : el.value).join('\u0000'),
+                            Array.from(document.images).filter(img => img.complete).length,
+                            active ? `${active.tagName}#${active.id}.${active.name || ''}` : ''
+                        ];
+                        let hash = 0;
+                        const text = parts.join('\u0001');
+                        for (let i = 0; i < text.length; i++) {
+                            hash = (Math.imul(31, hash) + text.charCodeAt(i)) | 0;
+                        }
+                        visualSignature = `${text.length}:${hash}`;
+                    }
+                    
                     return {
                         pixelsAbove: scrollY,
                         pixelsBelow: Math.max(0, totalHeight - scrollY - windowHeight),
                         totalHeight: totalHeight,
-                        viewportHeight: windowHeight
+                        viewportHeight: windowHeight,
+                        visualSignature: visualSignature
                     };
                 }
                 """)
                 pixels_above = scroll_info.get('pixelsAbove', 0)
                 pixels_below = scroll_info.get('pixelsBelow', 0)
+                visual_signature = scroll_info.get('visualSignature')
             except Exception as e:
                 print(f"Error getting scroll info: {e}")
                 pixels_above = 0
                 pixels_below = 0
+                visual_signature = None
             
             return DOMState(
                 element_tree=root,
@@ -605,7 +712,8 @@ class BrowserAutomation:
                 url=url,
                 title=title,
                 pixels_above=pixels_above,
-                pixels_below=pixels_below
+                pixels_below=pixels_below,
+                visual_signature=visual_signature
             )
         except Exception as e:
             print(f"Error getting DOM state: {e}")
@@ -656,6 +764,7 @@ class BrowserAutomation:
                 scale='device'  # Use device scale factor
             )
             
+            self.latest_screenshot_id = self.store_screenshot(screenshot_bytes)
             return base64.b64encode(screenshot_bytes).decode('utf-8')
         except Exception as e:
             print(f"Error taking screenshot: {e}")
@@ -663,6 +772,22 @@ class BrowserAutomation:
             # Return an empty string rather than failing
             return ""
     
+    def store_screenshot(self, screenshot_bytes: bytes) -> str:
+        """Keep a screenshot for get_screenshot and return its id (a hash of its content)"""
+        screenshot_id = hashlib.sha256(screenshot_bytes).hexdigest()[:16]
+        self.screenshots[screenshot_id] = screenshot_bytes
+        self.screenshots.move_to_end(screenshot_id)
+        while len(self.screenshots) > MAX_STORED_SCREENSHOTS:
+            self.screenshots.popitem(last=False)
+        return screenshot_id
+    
+    async def get_screenshot(self, screenshot_id: str):
+        """Return a stored screenshot as a JPEG image"""
+        screenshot_bytes = self.screenshots.get(screenshot_id)
+        if screenshot_bytes is None:
+            raise HTTPException(status_code=404, detail=f"Screenshot {screenshot_id} not found")
+        return Response(content=screenshot_bytes, media_type="image/jpeg")
+    
     async def save_screenshot_to_file(self) -> str:
         """Take a screenshot and save to file, returning the path"""
         try:
@@ -703,6 +828,10 @@ class BrowserAutomation:
     async def get_updated_browser_state(self, action_name: str) -> tuple:
         """Helper method to get updated browser state after any action
         Returns a tuple of (dom_state, screenshot, elements, metadata)
+        
+        The screenshot is only retaken when the page's visual signature changed,
+        OCR only runs on new screenshots, and element lines are only formatted
+        for elements that changed since the previous state.
         """
         try:
             # Wait a moment for any potential async processes to settle
@@ -710,12 +839,31 @@ class BrowserAutomation:
             
             # Get updated state
             dom_state = await self.get_current_dom_state()
-            screenshot = await self.take_screenshot()
+            if (dom_state.visual_signature is not None
+                    and dom_state.visual_signature == self.last_visual_signature
+                    and self.last_screenshot):
+                screenshot = self.last_screenshot
+                print(f"Page unchanged after {action_name}, reusing last screenshot")
+            else:
+                screenshot = await self.take_screenshot()
+                self.last_screenshot = screenshot
+                self.last_visual_signature = dom_state.visual_signature if screenshot else None
             
             # Format elements for output
-            elements = dom_state.element_tree.clickable_elements_to_string(
-                include_attributes=self.include_attributes
-            )
+            lines = {}
+            element_lines = {}
+            for idx, element in dom_state.selector_map.items():
+                element_key = self.element_keys.get(idx)
+                if element_key is None or self.element_nodes.get(element_key) is not element:
+                    element_key = None
+                line = self.element_lines.get(element_key) if element_key else None
+                if line is None:
+                    line = element.clickable_element_line(self.include_attributes)
+                if element_key:
+                    element_lines[element_key] = line
+                lines[idx] = f'[{idx}]{line}'
+            self.element_lines = element_lines
+            elements = '\n'.join(lines.values()) or "No interactive elements found"
             
             # Collect additional metadata
             page = await self.get_current_page()
@@ -725,7 +873,7 @@ class BrowserAutomation:
             metadata['element_count'] = len(dom_state.selector_map)
             
             # Create simplified interactive elements list
-            interactive_elements = []
+            element_infos = {}
             for idx, element in dom_state.selector_map.items():
                 element_info = {
                     'index': idx,
@@ -739,9 +887,14 @@ class BrowserAutomation:
                     if attr_name in element.attributes:
                         element_info[attr_name] = element.attributes[attr_name]
                 
-                interactive_elements.append(element_info)
+                element_infos[idx] = element_info
+            
+            metadata['interactive_elements'] = list(element_infos.values())
             
-            metadata['interactive_elements'] = interactive_elements
+            snapshot_id = hashlib.sha256(
+                json.dumps([dom_state.url, lines, element_infos], sort_keys=True, default=str).encode()
+            ).hexdigest()[:16]
+            metadata['dom_snapshot'] = DOMSnapshot(snapshot_id=snapshot_id, url=dom_state.url, lines=lines, elements=element_infos)
             
             # Get viewport dimensions - Fix syntax error in JavaScript
             try:
@@ -760,10 +913,15 @@ class BrowserAutomation:
                 metadata['viewport_width'] = 0
                 metadata['viewport_height'] = 0
             
-            # Extract OCR text from screenshot if available
+            # Extract OCR text from screenshot if available, once per distinct screenshot
             ocr_text = ""
             if screenshot:
-                ocr_text = await self.extract_ocr_text_from_screenshot(screenshot)
+                ocr_text = self.ocr_cache.get(self.latest_screenshot_id)
+                if ocr_text is None:
+                    ocr_text = await self.extract_ocr_text_from_screenshot(screenshot)
+                    self.ocr_cache[self.latest_screenshot_id] = ocr_text
+                    while len(self.ocr_cache) > MAX_CACHED_OCR_RESULTS:
+                        self.ocr_cache.popitem(last=False)
                 metadata['ocr_text'] = ocr_text
             
             print(f"Got updated state after {action_name}: {len(dom_state.selector_map)} elements")
@@ -774,6 +932,32 @@ class BrowserAutomation:
             # Return empty values in case of error
             return None, "", "", {}
 
+    def diff_dom_snapshot(self, snapshot: Optional[DOMSnapshot]) -> Optional[Dict[str, Any]]:
+        """Record the snapshot as the latest one sent and, in diff mode, diff it against the client's base.
+        
+        Returns None when the client did not ask for diffs. If the client's base
+        is not the previous snapshot, every element is listed and base_snapshot_id is None.
+        """
+        if snapshot is None:
+            return None
+        previous = self.dom_snapshot
+        self.dom_snapshot = snapshot
+        
+        base = dom_base.get()
+        if base is None:
+            return None
+        if previous is None or previous.snapshot_id != base or previous.url != snapshot.url:
+            base = None
+            previous = DOMSnapshot(snapshot_id="", url=snapshot.url, lines={}, elements={})
+        
+        changed = [
+            {"index": idx, "line": line, "element": snapshot.elements.get(idx)}
+            for idx, line in snapshot.lines.items()
+            if previous.lines.get(idx) != line or previous.elements.get(idx) != snapshot.elements.get(idx)
+        ]
+        removed = [idx for idx in previous.lines if idx not in snapshot.lines]
+        return {"base_snapshot_id": base, "changed": changed, "removed": removed}
+
     def build_action_result(self, success: bool, message: str, dom_state, screenshot: str, 
                               elements: str, metadata: dict, error: str = "", content: str = None,
                               fallback_url: str = None) -> BrowserActionResult:
@@ -781,6 +965,14 @@ class BrowserAutomation:
         # Ensure elements is never None to avoid display issues
         if elements is None:
             elements = ""
+        
+        # In diff mode, send only the elements that changed since the client's snapshot
+        snapshot = metadata.get('dom_snapshot')
+        elements_diff = self.diff_dom_snapshot(snapshot)
+        interactive_elements = metadata.get('interactive_elements', [])
+        if elements_diff is not None:
+            elements = None
+            interactive_elements = None
             
         return BrowserActionResult(
             success=success,
@@ -789,13 +981,16 @@ class BrowserAutomation:
             url=dom_state.url if dom_state else fallback_url or "",
             title=dom_state.title if dom_state else "",
             elements=elements,
-            screenshot_base64=screenshot,
+            screenshot_base64=screenshot if screenshot_mode.get() != "reference" else None,
+            screenshot_id=self.latest_screenshot_id if screenshot else None,
+            dom_snapshot_id=snapshot.snapshot_id if snapshot else None,
+            elements_diff=elements_diff,
             pixels_above=dom_state.pixels_above if dom_state else 0,
             pixels_below=dom_state.pixels_below if dom_state else 0,
             content=content,
             ocr_text=metadata.get('ocr_text', ""),
             element_count=metadata.get('element_count', 0),
-            interactive_elements=metadata.get('interactive_elements', []),
+            interactive_elements=interactive_elements,
             viewport_width=metadata.get('viewport_width', 0),
             viewport_height=metadata.get('viewport_height', 0)
         )
@@ -1844,6 +2039,16 @@ automation_service = BrowserAutomation()
 # Create API app
 api_app = FastAPI()
 
+@api_app.middleware("http")
+async def read_request_modes(request: Request, call_next):
+    mode_token = screenshot_mode.set(request.headers.get("X-Screenshot-Mode", "inline"))
+    base_token = dom_base.set(request.headers.get("X-DOM-Base"))
+    try:
+        return await call_next(request)
+    finally:
+        dom_base.reset(base_token)
+        screenshot_mode.reset(mode_token)
+
 @api_app.get("/api")
 async def health_check():
     return {"status": "ok", "message": "API server is running"}
@@ -1,12 +1,105 @@
-from typing import Optional
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
 
 from agentpress.thread_manager import ThreadManager
 from agentpress.tool import Tool
-from daytona_sdk import AsyncSandbox
+from daytona_sdk import AsyncSandbox, SandboxState
 from sandbox.sandbox import get_or_start_sandbox
+from utils.config import config
 from utils.logger import logger
 from utils.files_utils import clean_path
 
+
+@dataclass
+class SandboxHandle:
+    sandbox_id: str
+    sandbox_pass: Optional[str]
+    sandbox: AsyncSandbox
+    expires_at: float
+
+
+# Sandbox handles resolved in this process, keyed by project_id, and the
+# resolutions in progress so concurrent tools wait for the same one
+_sandbox_handles: Dict[str, SandboxHandle] = {}
+_resolving: Dict[str, "asyncio.Task[SandboxHandle]"] = {}
+
+
+async def _resolve_project_sandbox(project_id: str, thread_manager: ThreadManager) -> SandboxHandle:
+    # Get database client
+    client = await thread_manager.db.client
+    
+    # Get project data
+    project = await client.table('projects').select('sandbox').eq('project_id', project_id).execute()
+    if not project.data or len(project.data) == 0:
+        raise ValueError(f"Project {project_id} not found")
+    
+    sandbox_info = project.data[0].get('sandbox') or {}
+    if not sandbox_info.get('id'):
+        raise ValueError(f"No sandbox found for project {project_id}")
+    
+    # Get or start the sandbox
+    sandbox = await get_or_start_sandbox(sandbox_info['id'])
+    
+    handle = SandboxHandle(
+        sandbox_id=sandbox_info['id'],
+        sandbox_pass=sandbox_info.get('pass'),
+        sandbox=sandbox,
+        expires_at=time.monotonic() + config.SANDBOX_HANDLE_TTL,
+    )
+    _sandbox_handles[project_id] = handle
+    return handle
+
+
+def _prune_expired_handles():
+    now = time.monotonic()
+    for project_id in [key for key, handle in _sandbox_handles.items() if handle.expires_at <= now]:
+        del _sandbox_handles[project_id]
+
+
+async def _is_started(handle: SandboxHandle) -> bool:
+    """Re-read the sandbox state so a stopped or archived sandbox is started again."""
+    try:
+        await handle.sandbox.refresh_data()
+    except Exception as e:
+        logger.warning(f"Failed to refresh state of sandbox {handle.sandbox_id}: {str(e)}")
+        return False
+    return handle.sandbox.state == SandboxState.STARTED
+
+
+async def get_project_sandbox(project_id: str, thread_manager: ThreadManager) -> SandboxHandle:
+    """Get the sandbox of a project, shared by every tool in the process.
+
+    The project lookup runs once per project and the handle is then reused for
+    SANDBOX_HANDLE_TTL seconds. A reused handle has its state re-checked, and
+    is resolved again through get_or_start_sandbox if the sandbox is no longer
+    started. Concurrent callers share one resolution, so a cold sandbox is
+    started once.
+    """
+    _prune_expired_handles()
+    handle = _sandbox_handles.get(project_id)
+    if handle is not None:
+        if await _is_started(handle):
+            return handle
+        logger.info(f"Cached sandbox {handle.sandbox_id} of project {project_id} is not started, resolving it again")
+        invalidate_project_sandbox(project_id)
+    
+    task = _resolving.get(project_id)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.create_task(_resolve_project_sandbox(project_id, thread_manager))
+        _resolving[project_id] = task
+        task.add_done_callback(lambda done: _resolving.pop(project_id, None) if _resolving.get(project_id) is done else None)
+    
+    # Shielded so a cancelled tool call does not cancel the start for the others waiting on it
+    return await asyncio.shield(task)
+
+
+def invalidate_project_sandbox(project_id: str):
+    """Drop the cached sandbox of a project, e.g. after it was deleted or stopped."""
+    _sandbox_handles.pop(project_id, None)
+
+
 class SandboxToolsBase(Tool):
     """Base class for all sandbox tools that provides project-based sandbox access."""
     
@@ -26,43 +119,16 @@ class SandboxToolsBase(Tool):
         """Ensure we have a valid sandbox instance, retrieving it from the project if needed."""
         if self._sandbox is None:
             try:
-                # Get database client
-                client = await self.thread_manager.db.client
-                
-                # Get project data
-                project = await client.table('projects').select('*').eq('project_id', self.project_id).execute()
-                if not project.data or len(project.data) == 0:
-                    raise ValueError(f"Project {self.project_id} not found")
-                
-                project_data = project.data[0]
-                sandbox_info = project_data.get('sandbox', {})
-                
-                if not sandbox_info.get('id'):
-                    raise ValueError(f"No sandbox found for project {self.project_id}")
+                handle = await get_project_sandbox(self.project_id, self.thread_manager)
                 
                 # Store sandbox info
-                self._sandbox_id = sandbox_info['id']
-                self._sandbox_pass = sandbox_info.get('pass')
-                
-                # Get or start the sandbox
-                self._sandbox = await get_or_start_sandbox(self._sandbox_id)
-                
-                # # Log URLs if not already printed
-                # if not SandboxToolsBase._urls_printed:
-                #     vnc_link = self._sandbox.get_preview_link(6080)
-                #     website_link = self._sandbox.get_preview_link(8080)
-                    
-                #     vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link)
-                #     website_url = website_link.url if hasattr(website_link, 'url') else str(website_link)
-                    
-                #     print("\033[95m***")
-                #     print(f"VNC URL: {vnc_url}")
-                #     print(f"Website URL: {website_url}")
-                #     print("***\033[0m")
-                #     SandboxToolsBase._urls_printed = True
+                self._sandbox_id = handle.sandbox_id
+                self._sandbox_pass = handle.sandbox_pass
+                self._sandbox = handle.sandbox
                 
             except Exception as e:
                 logger.error(f"Error retrieving sandbox for project {self.project_id}: {str(e)}", exc_info=True)
+                invalidate_project_sandbox(self.project_id)
                 raise e
         
         return self._sandbox
@@ -15,6 +15,8 @@ from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel
 from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES
 from litellm import cost_per_token
+from services import redis
+import json
 import time
 
 # Initialize Stripe
@@ -23,6 +25,22 @@ stripe.api_key = config.STRIPE_SECRET_KEY
 # Token price multiplier
 TOKEN_PRICE_MULTIPLIER = 1.5
 
+# Billing state cache. Subscriptions are invalidated by the Stripe webhook, the
+# TTL only bounds staleness if a webhook is missed. The monthly usage counter is
+# seeded from the usage logs and incremented as usage is recorded; its TTL makes
+# it re-seed periodically so any drift from the logs stays bounded.
+SUBSCRIPTION_CACHE_TTL = 300
+MONTHLY_USAGE_CACHE_TTL = 3600
+
+# Only increment the usage counter if it has been seeded, otherwise a partial
+# total would be created without a TTL
+_INCREMENT_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBYFLOAT', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
 # Initialize router
 router = APIRouter(prefix="/billing", tags=["billing"])
 
@@ -268,8 +286,8 @@ async def calculate_monthly_usage(client, user_id: str) -> float:
     return total_cost
 
 
-async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: int = 1000) -> Dict:
-    """Get detailed usage logs for a user with pagination."""
+def _usage_period_start() -> datetime:
+    """Start of the window usage is billed over; only threads created since then count."""
     # Get start of current month in UTC
     now = datetime.now(timezone.utc)
     start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
@@ -278,7 +296,12 @@ async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: in
     # Ignore all token counts before this date
     cutoff_date = datetime(2025, 6, 30, 9, 0, 0, tzinfo=timezone.utc)
     
-    start_of_month = max(start_of_month, cutoff_date)
+    return max(start_of_month, cutoff_date)
+
+
+async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: int = 1000) -> Dict:
+    """Get detailed usage logs for a user with pagination."""
+    start_of_month = _usage_period_start()
     
     # First get all threads for this user in batches
     batch_size = 1000
@@ -495,6 +518,85 @@ async def can_use_model(client, user_id: str, model_name: str):
     
     return False, f"Your current subscription plan does not include access to {model_name}. Please upgrade your subscription or choose from your available models: {', '.join(allowed_models)}", allowed_models
 
+def _subscription_cache_key(user_id: str) -> str:
+    return f"billing:subscription:{user_id}"
+
+def _monthly_usage_cache_key(user_id: str) -> str:
+    now = datetime.now(timezone.utc)
+    return f"billing:usage:{user_id}:{now.year}-{now.month:02d}"
+
+async def get_cached_user_subscription(user_id: str, cached_value: Optional[str] = None) -> Optional[Dict]:
+    """Get the current subscription for a user, served from Redis when cached.
+
+    Args:
+        user_id: The account to look up
+        cached_value: A value already read from the subscription cache key, if any
+    """
+    if cached_value is None:
+        try:
+            cached_value = await redis.get(_subscription_cache_key(user_id))
+        except Exception as e:
+            logger.warning(f"Failed to read subscription cache for {user_id}: {str(e)}")
+    if cached_value is not None:
+        return json.loads(cached_value)
+
+    subscription = await get_user_subscription(user_id)
+    try:
+        await redis.set(_subscription_cache_key(user_id), json.dumps(subscription), ex=SUBSCRIPTION_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to cache subscription for {user_id}: {str(e)}")
+    return subscription
+
+async def get_cached_monthly_usage(client, user_id: str, cached_value: Optional[str] = None) -> float:
+    """Get the running monthly usage total for a user, seeding it from the usage logs on a miss.
+
+    Args:
+        client: Supabase client used to seed the counter
+        user_id: The account to look up
+        cached_value: A value already read from the usage cache key, if any
+    """
+    key = _monthly_usage_cache_key(user_id)
+    if cached_value is None:
+        try:
+            cached_value = await redis.get(key)
+        except Exception as e:
+            logger.warning(f"Failed to read monthly usage cache for {user_id}: {str(e)}")
+    if cached_value is not None:
+        return float(cached_value)
+
+    current_usage = await calculate_monthly_usage(client, user_id)
+    try:
+        # nx so a seed computed concurrently does not overwrite increments recorded since
+        await redis.set(key, str(current_usage), ex=MONTHLY_USAGE_CACHE_TTL, nx=True)
+    except Exception as e:
+        logger.warning(f"Failed to cache monthly usage for {user_id}: {str(e)}")
+    return current_usage
+
+async def increment_monthly_usage(user_id: str, thread_created_at: str, prompt_tokens: int, completion_tokens: int, model: str) -> None:
+    """Add the cost of a recorded LLM response to the user's running monthly usage total.
+
+    Mirrors calculate_monthly_usage, which only counts threads created in the
+    current billing window, so responses in older threads are not added.
+    """
+    if datetime.fromisoformat(thread_created_at) < _usage_period_start():
+        return
+    cost = calculate_token_cost(prompt_tokens, completion_tokens, model)
+    if not cost:
+        return
+    try:
+        redis_client = await redis.get_client()
+        await redis_client.eval(_INCREMENT_IF_EXISTS_SCRIPT, 1, _monthly_usage_cache_key(user_id), cost)
+    except Exception as e:
+        logger.warning(f"Failed to increment monthly usage for {user_id}: {str(e)}")
+
+async def invalidate_billing_cache(user_id: str) -> None:
+    """Drop the cached subscription for a user so the next billing check hits Stripe."""
+    try:
+        await redis.delete(_subscription_cache_key(user_id))
+        logger.debug(f"Invalidated billing cache for {user_id}")
+    except Exception as e:
+        logger.warning(f"Failed to invalidate billing cache for {user_id}: {str(e)}")
+
 async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optional[Dict]]:
     """
     Check if a user can run agents based on their subscription and usage.
@@ -510,9 +612,15 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
             "minutes_limit": "no limit"
         }
     
+    # Read cached subscription and usage in a single round-trip
+    cached_subscription, cached_usage = None, None
+    try:
+        cached_subscription, cached_usage = await redis.mget(_subscription_cache_key(user_id), _monthly_usage_cache_key(user_id))
+    except Exception as e:
+        logger.warning(f"Failed to read billing cache for {user_id}: {str(e)}")
+
     # Get current subscription
-    subscription = await get_user_subscription(user_id)
-    # print("Current subscription:", subscription)
+    subscription = await get_cached_user_subscription(user_id, cached_subscription)
     
     # If no subscription, they can use free tier
     if not subscription:
@@ -534,8 +642,8 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
         logger.warning(f"Unknown subscription tier: {price_id}, defaulting to free tier")
         tier_info = SUBSCRIPTION_TIERS[config.STRIPE_FREE_TIER_ID]
     
-    # Calculate current month's usage
-    current_usage = await calculate_monthly_usage(client, user_id)
+    # Get current month's usage
+    current_usage = await get_cached_monthly_usage(client, user_id, cached_usage)
     
     # Check if within limits
     if current_usage >= tier_info['cost']:
@@ -1072,6 +1180,14 @@ async def stripe_webhook(request: Request):
             # Get database connection
             db = DBConnection()
             client = await db.client
+
+            # Drop the cached subscription so billing checks pick up the change
+            customer_result = await client.schema('basejump').from_('billing_customers') \
+                .select('account_id') \
+                .eq('id', customer_id) \
+                .execute()
+            if customer_result.data:
+                await invalidate_billing_cache(customer_result.data[0]['account_id'])
             
             if event.type == 'customer.subscription.created' or event.type == 'customer.subscription.updated':
                 # Check if subscription is active
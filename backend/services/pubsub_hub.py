@@ -0,0 +1,114 @@
+"""
+Shared Redis pub/sub fan-out for an API process.
+
+Instead of each SSE client opening its own pub/sub connections, the process
+keeps a single pub/sub connection and one reader task. Subscribers get an
+in-memory queue per subscription; Redis channels are reference counted so a
+channel is subscribed once no matter how many clients follow it and
+unsubscribed when the last one leaves.
+
+Usage:
+    from services.pubsub_hub import pubsub_hub
+
+    queue = await pubsub_hub.subscribe(response_channel, control_channel)
+    try:
+        message = await queue.get()  # {"channel": ..., "data": ...}
+    finally:
+        await pubsub_hub.unsubscribe(queue)
+"""
+
+import asyncio
+from typing import Any, Dict, Optional, Set
+
+from services import redis
+from utils.logger import logger
+
+
+class PubSubHub:
+    """Multiplexes Redis channel subscriptions over one pub/sub connection."""
+
+    def __init__(self):
+        self._pubsub = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock = asyncio.Lock()
+
+    async def _ensure_started(self):
+        if self._pubsub is None:
+            self._pubsub = await redis.create_pubsub()
+        if self._reader_task is None or self._reader_task.done():
+            self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.1)
+                    continue
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The pub/sub connection reconnects and re-subscribes on the next read
+                logger.error(f"Error reading from shared pubsub connection: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not message or message.get("type") != "message":
+                continue
+
+            channel = message.get("channel")
+            data = message.get("data")
+            if isinstance(data, bytes): data = data.decode('utf-8')
+            for queue in list(self._subscribers.get(channel, ())):
+                queue.put_nowait({"channel": channel, "data": data})
+
+    async def subscribe(self, *channels: str) -> "asyncio.Queue[Dict[str, Any]]":
+        """Subscribe to channels and return a queue receiving their messages."""
+        queue: asyncio.Queue = asyncio.Queue()
+        async with self._lock:
+            await self._ensure_started()
+            new_channels = [channel for channel in channels if channel not in self._subscribers]
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(queue)
+            if new_channels:
+                await self._pubsub.subscribe(*new_channels)
+                logger.debug(f"Shared pubsub subscribed to: {new_channels}")
+        return queue
+
+    async def unsubscribe(self, queue: asyncio.Queue):
+        """Remove a subscriber queue, unsubscribing channels nobody follows anymore."""
+        async with self._lock:
+            unused_channels = []
+            for channel, queues in list(self._subscribers.items()):
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[channel]
+                    unused_channels.append(channel)
+            if unused_channels and self._pubsub is not None:
+                try:
+                    await self._pubsub.unsubscribe(*unused_channels)
+                    logger.debug(f"Shared pubsub unsubscribed from: {unused_channels}")
+                except Exception as e:
+                    logger.warning(f"Failed to unsubscribe shared pubsub from {unused_channels}: {e}")
+
+    async def close(self):
+        """Stop the reader task and close the pub/sub connection."""
+        async with self._lock:
+            if self._reader_task:
+                self._reader_task.cancel()
+                try:
+                    await self._reader_task
+                except asyncio.CancelledError:
+                    pass
+                self._reader_task = None
+            if self._pubsub is not None:
+                try:
+                    await self._pubsub.close()
+                except Exception as e:
+                    logger.warning(f"Error closing shared pubsub connection: {e}")
+                self._pubsub = None
+            self._subscribers.clear()
+
+
+pubsub_hub = PubSubHub()
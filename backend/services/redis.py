@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional
 from utils.retry import retry
 from urllib.parse import urlparse
 
@@ -142,6 +142,12 @@ async def get(key: str, default: str = None):
     return result if result is not None else default
 
 
+async def mget(*keys: str) -> List[Any]:
+    """Get the values of multiple Redis keys in one round-trip."""
+    redis_client = await get_client()
+    return await redis_client.mget(*keys)
+
+
 async def delete(key: str):
     """Delete a Redis key."""
     redis_client = await get_client()
@@ -154,6 +160,12 @@ async def publish(channel: str, message: str):
     return await redis_client.publish(channel, message)
 
 
+async def pipeline(transaction: bool = False):
+    """Create a Redis pipeline to send several commands in one round-trip."""
+    redis_client = await get_client()
+    return redis_client.pipeline(transaction=transaction)
+
+
 async def create_pubsub():
     """Create a Redis pubsub object."""
     redis_client = await get_client()
@@ -179,6 +191,32 @@ async def llen(key: str) -> int:
     return await redis_client.llen(key)
 
 
+# Stream operations
+async def xadd(key: str, fields: Dict[str, str]) -> str:
+    """Append an entry to a stream and return its ID."""
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields)
+
+
+async def xrange(key: str, start: str = "-", end: str = "+", count: Optional[int] = None) -> List[Any]:
+    """Get a range of entries from a stream."""
+    redis_client = await get_client()
+    return await redis_client.xrange(key, min=start, max=end, count=count)
+
+
+async def xread(streams: Dict[str, str], count: Optional[int] = None, block: Optional[int] = None) -> List[Any]:
+    """Read entries after the given IDs from one or more streams, optionally blocking (ms)."""
+    redis_client = await get_client()
+    return await redis_client.xread(streams, count=count, block=block)
+
+
+# Sorted set operations
+async def zrem(key: str, *members: str):
+    """Remove one or more members from a sorted set."""
+    redis_client = await get_client()
+    return await redis_client.zrem(key, *members)
+
+
 # Key management
 async def expire(key: str, time: int):
     """Set a key's time to live in seconds."""
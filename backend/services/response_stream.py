@@ -0,0 +1,320 @@
+"""
+Transport for agent run responses.
+
+Background agent runs write their responses to Redis and API instances stream
+them to clients. Two transports are supported, selected with the
+AGENT_RESPONSE_TRANSPORT setting (writers and readers must use the same one):
+
+- "list" (default): responses are RPUSHed to a list and a "new" notification is
+  published per write; readers re-read new items by index with LRANGE.
+- "stream": responses are XADDed to a Redis Stream; readers block on XREAD and
+  resume from the last entry ID they saw, so no pub/sub connection is needed to
+  follow the run. Control signals are also written to the stream.
+
+Every response is addressed by a cursor (the list index or the stream entry ID),
+which the SSE endpoint sends as the event ID so clients can resume with
+Last-Event-ID.
+"""
+
+import asyncio
+import base64
+import json
+import zlib
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+TRANSPORT_LIST = "list"
+TRANSPORT_STREAM = "stream"
+
+# How long a stream reader blocks per XREAD; must stay below the Redis socket timeout
+STREAM_BLOCK_MS = 3000
+
+# Page size used when walking all responses of a run
+RESPONSE_PAGE_SIZE = 1000
+
+STORAGE_FULL = "full"
+STORAGE_COMPACTED = "compacted"
+STORAGE_COMPRESSED = "compressed"
+STORAGE_NONE = "none"
+
+
+def get_transport() -> str:
+    """Get the configured response transport."""
+    transport = (config.AGENT_RESPONSE_TRANSPORT or TRANSPORT_LIST).lower()
+    if transport not in (TRANSPORT_LIST, TRANSPORT_STREAM):
+        logger.warning(f"Unknown AGENT_RESPONSE_TRANSPORT '{transport}', using '{TRANSPORT_LIST}'")
+        return TRANSPORT_LIST
+    return transport
+
+
+def response_list_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:responses"
+
+
+def response_stream_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:stream"
+
+
+def response_channel(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:new_response"
+
+
+def control_channel(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:control"
+
+
+async def append_responses(agent_run_id: str, responses: List[Dict[str, Any]]) -> None:
+    """Append responses for an agent run and notify readers in one pipelined round-trip."""
+    if not responses:
+        return
+    pipe = await redis.pipeline()
+    if get_transport() == TRANSPORT_STREAM:
+        key = response_stream_key(agent_run_id)
+        for response in responses:
+            pipe.xadd(key, {"data": json.dumps(response)})
+    else:
+        pipe.rpush(response_list_key(agent_run_id), *[json.dumps(response) for response in responses])
+        pipe.publish(response_channel(agent_run_id), "new")
+    await pipe.execute()
+
+
+class ResponseBatchWriter:
+    """Buffers the responses of an agent run and writes them in batches.
+
+    A batch is flushed when it reaches max_batch_size or max_delay_ms after its
+    first response, whichever comes first. Flushes are serialized so responses
+    keep their order, and add() waits for a full batch to be written, which
+    bounds memory to one batch in flight plus one buffered.
+    """
+
+    def __init__(self, agent_run_id: str, max_batch_size: Optional[int] = None, max_delay_ms: Optional[int] = None):
+        self.agent_run_id = agent_run_id
+        self.max_batch_size = max(1, max_batch_size or config.AGENT_RESPONSE_BATCH_SIZE)
+        self.max_delay = (max_delay_ms if max_delay_ms is not None else config.AGENT_RESPONSE_BATCH_DELAY_MS) / 1000
+        self._buffer: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer: Optional[asyncio.Task] = None
+
+    async def add(self, response: Dict[str, Any]) -> None:
+        """Buffer a response, flushing if the batch is full."""
+        self._buffer.append(response)
+        if len(self._buffer) >= self.max_batch_size:
+            await self.flush()
+        elif self._flush_timer is None or self._flush_timer.done():
+            self._flush_timer = asyncio.create_task(self._flush_after_delay())
+
+    async def _flush_after_delay(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush responses for agent run {self.agent_run_id}: {e}")
+
+    async def flush(self) -> None:
+        """Write all buffered responses."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            await append_responses(self.agent_run_id, batch)
+
+    async def close(self) -> None:
+        """Wait for a pending delayed flush, then write whatever is left."""
+        if self._flush_timer and not self._flush_timer.done():
+            # Not cancelled: it may be mid-write with the batch already taken from the buffer
+            await self._flush_timer
+        await self.flush()
+
+
+async def publish_control(agent_run_id: str, signal: str) -> None:
+    """Publish a control signal (STOP, END_STREAM, ERROR) for an agent run.
+
+    The signal always goes to the control channel, which running workers listen
+    on. With the stream transport it is also written to the stream so readers
+    following it with XREAD see it in order.
+    """
+    await redis.publish(control_channel(agent_run_id), signal)
+    if get_transport() == TRANSPORT_STREAM:
+        await redis.xadd(response_stream_key(agent_run_id), {"control": signal})
+
+
+def _parse_stream_entries(entries: List[Any]) -> List[Dict[str, Any]]:
+    items = []
+    for entry_id, fields in entries:
+        if "control" in fields:
+            items.append({"id": entry_id, "control": fields["control"]})
+        elif "data" in fields:
+            items.append({"id": entry_id, "response": json.loads(fields["data"])})
+    return items
+
+
+async def read_responses(agent_run_id: str, after: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Read the entries of an agent run after a cursor (or from the start).
+
+    Returns a list of ``{"id": cursor, "response": dict}`` items, plus
+    ``{"id": cursor, "control": signal}`` items with the stream transport.
+    """
+    if get_transport() == TRANSPORT_STREAM:
+        # Exclusive range start so the entry at the cursor is not returned again
+        start = f"({after}" if after else "-"
+        entries = await redis.xrange(response_stream_key(agent_run_id), start=start)
+        return _parse_stream_entries(entries)
+
+    start_index = int(after) + 1 if after is not None else 0
+    responses_json = await redis.lrange(response_list_key(agent_run_id), start_index, -1)
+    return [
+        {"id": str(start_index + offset), "response": json.loads(response_json)}
+        for offset, response_json in enumerate(responses_json)
+    ]
+
+
+async def wait_for_responses(agent_run_id: str, after: Optional[str], block_ms: int = STREAM_BLOCK_MS) -> List[Dict[str, Any]]:
+    """Block until entries after the cursor are written (stream transport only).
+
+    Returns an empty list if nothing arrived within block_ms.
+    """
+    key = response_stream_key(agent_run_id)
+    result = await redis.xread({key: after or "0-0"}, block=block_ms)
+    if not result:
+        return []
+    _, entries = result[0]
+    return _parse_stream_entries(entries)
+
+
+async def iter_responses(agent_run_id: str, page_size: int = RESPONSE_PAGE_SIZE) -> AsyncGenerator[Dict[str, Any], None]:
+    """Iterate over every response of an agent run, reading one page at a time."""
+    if get_transport() == TRANSPORT_STREAM:
+        key = response_stream_key(agent_run_id)
+        start = "-"
+        while True:
+            entries = await redis.xrange(key, start=start, count=page_size)
+            for item in _parse_stream_entries(entries):
+                if "response" in item:
+                    yield item["response"]
+            if len(entries) < page_size:
+                break
+            start = f"({entries[-1][0]}"
+    else:
+        key = response_list_key(agent_run_id)
+        offset = 0
+        while True:
+            responses_json = await redis.lrange(key, offset, offset + page_size - 1)
+            for response_json in responses_json:
+                yield json.loads(response_json)
+            if len(responses_json) < page_size:
+                break
+            offset += page_size
+
+
+def _is_content_chunk(response: Dict[str, Any]) -> bool:
+    if response.get('type') != 'assistant':
+        return False
+    metadata = response.get('metadata')
+    if isinstance(metadata, str):
+        # Cheap check before parsing; chunk metadata is small
+        if '"chunk"' not in metadata:
+            return False
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            return False
+    return isinstance(metadata, dict) and metadata.get('stream_status') == 'chunk'
+
+
+def _chunk_text(response: Dict[str, Any]) -> str:
+    content = response.get('content')
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            return content
+    return content.get('content', '') if isinstance(content, dict) else ''
+
+
+def _merge_chunk_run(first: Dict[str, Any], parts: List[str], last: Dict[str, Any]) -> Dict[str, Any]:
+    merged = first.copy()
+    merged['content'] = json.dumps({"role": "assistant", "content": "".join(parts)})
+    merged['updated_at'] = last.get('updated_at')
+    return merged
+
+
+async def compact_responses(responses: AsyncGenerator[Dict[str, Any], None]) -> AsyncGenerator[Dict[str, Any], None]:
+    """Collapse streamed assistant content chunks.
+
+    Runs of consecutive chunks are merged into one chunk. Chunks are dropped
+    entirely once the saved assistant message they belong to arrives, since
+    that message holds the full content; tool status messages yielded while
+    the response was streaming are kept in place.
+
+    Responses are compacted in a single pass: only the responses of the
+    assistant message currently streaming are held, with each run of chunks
+    reduced to its text parts.
+    """
+    # Responses since the first chunk of the current message; chunk runs are [first, parts, last]
+    pending: List[Any] = []
+    async for response in responses:
+        if _is_content_chunk(response):
+            if pending and isinstance(pending[-1], list):
+                pending[-1][1].append(_chunk_text(response))
+                pending[-1][2] = response
+            else:
+                pending.append([response, [_chunk_text(response)], response])
+            continue
+        if not pending:
+            yield response
+            continue
+        if response.get('type') == 'assistant':
+            # The saved message supersedes its chunks; keep what was interleaved with them
+            for item in pending:
+                if not isinstance(item, list):
+                    yield item
+            pending = []
+            yield response
+            continue
+        pending.append(response)
+    for item in pending:
+        yield _merge_chunk_run(*item) if isinstance(item, list) else item
+
+
+async def get_responses_for_storage(agent_run_id: str) -> Optional[Any]:
+    """Build the value stored in agent_runs.responses according to AGENT_RUN_RESPONSES_STORAGE.
+
+    Returns None when responses should not be stored; the messages table
+    already holds the persisted messages of the run.
+    """
+    storage = (config.AGENT_RUN_RESPONSES_STORAGE or STORAGE_COMPACTED).lower()
+    if storage == STORAGE_NONE:
+        return None
+    if storage == STORAGE_FULL:
+        return [response async for response in iter_responses(agent_run_id)]
+
+    if storage == STORAGE_COMPRESSED:
+        # Compress as responses are compacted so the uncompressed JSON is never held whole
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        parts = [compressor.compress(b"[")]
+        count = 0
+        async for response in compact_responses(iter_responses(agent_run_id)):
+            prefix = b"," if count else b""
+            parts.append(compressor.compress(prefix + json.dumps(response).encode('utf-8')))
+            count += 1
+        parts.append(compressor.compress(b"]"))
+        parts.append(compressor.flush())
+        return {
+            "encoding": "gzip+base64",
+            "count": count,
+            "data": base64.b64encode(b"".join(parts)).decode('ascii'),
+        }
+    if storage != STORAGE_COMPACTED:
+        logger.warning(f"Unknown AGENT_RUN_RESPONSES_STORAGE '{storage}', storing compacted responses")
+    return [response async for response in compact_responses(iter_responses(agent_run_id))]
+
+
+async def expire_responses(agent_run_id: str, ttl: int) -> None:
+    """Set a TTL on the stored responses of an agent run."""
+    if get_transport() == TRANSPORT_STREAM:
+        await redis.expire(response_stream_key(agent_run_id), ttl)
+    else:
+        await redis.expire(response_list_key(agent_run_id), ttl)
@@ -0,0 +1,191 @@
+"""
+Content-addressed store for browser screenshots.
+
+Browser actions often produce the exact same screenshot as the previous one
+(waits, clicks that did nothing, scrolling at the bottom of a page). Screenshots
+are stored in the browser-screenshots bucket under their SHA-256, so each image
+is uploaded once:
+
+- store() returns the hash and public URL right away and uploads in the
+  background, so the browser_state message can be written without waiting
+- images already uploaded by this process, or by any process (recorded in
+  Redis under browser:screenshot:{filename}), are not uploaded again
+- wait_until_uploaded() lets the agent loop make sure an image exists before
+  it hands the URL to the model, and lets the browser tool record a failed
+  upload on the stored browser_state
+
+With BROWSER_SCREENSHOT_LLM_MAX_WIDTH set, store() also produces a downscaled
+copy (in BROWSER_SCREENSHOT_LLM_FORMAT) for the model, at llm_image_url.
+"""
+
+import asyncio
+import hashlib
+import io
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from services import redis
+from services.supabase import DBConnection
+from utils.config import config
+from utils.logger import logger
+
+BUCKET_NAME = "browser-screenshots"
+UPLOADED_KEY_PREFIX = "browser:screenshot:"
+# Public URLs don't expire, so uploads are remembered for as long as Redis keeps them
+UPLOADED_KEY_TTL = 7 * 24 * 3600
+MAX_REMEMBERED_UPLOADS = 1000
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp"}
+EXTENSIONS_MIME = {"jpg": "jpeg"}
+
+# Finished uploads (public URL -> whether they succeeded), in LRU order
+_uploaded: "OrderedDict[str, bool]" = OrderedDict()
+# Uploads in progress by public URL
+_pending: Dict[str, "asyncio.Task[bool]"] = {}
+# Store results by screenshot hash, so screenshots seen before need not be downloaded again
+_stored: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+
+
+def content_hash(image_data: bytes) -> str:
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def lookup(hash_prefix: str) -> Optional[Dict[str, str]]:
+    """Return the store() result of a screenshot stored earlier by this process.
+
+    hash_prefix may be the full hash or a prefix of it, like the screenshot ids
+    of the sandbox browser API. Screenshots whose upload failed are not
+    returned, so the caller stores them again.
+    """
+    for screenshot_hash, stored in reversed(_stored.items()):
+        if screenshot_hash.startswith(hash_prefix):
+            if _uploaded.get(stored["image_url"]) is False:
+                return None
+            _stored.move_to_end(screenshot_hash)
+            return dict(stored)
+    return None
+
+
+def _remember(cache: OrderedDict, key: str, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_REMEMBERED_UPLOADS:
+        cache.popitem(last=False)
+
+
+def _downscale(image_data: bytes, max_width: int, image_format: str) -> bytes:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_data)) as img:
+        if img.width > max_width:
+            img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+        if image_format.upper() in ("JPEG", "JPG") and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, format="JPEG" if image_format.upper() == "JPG" else image_format.upper(), quality=80)
+        return output.getvalue()
+
+
+async def _upload(filename: str, image_data: bytes, content_type: str) -> bool:
+    key = f"{UPLOADED_KEY_PREFIX}{filename}"
+    try:
+        if await redis.get(key):
+            return True
+    except Exception as e:
+        logger.warning(f"Failed to check screenshot upload {filename}: {e}")
+
+    try:
+        client = await DBConnection().client
+        await client.storage.from_(BUCKET_NAME).upload(
+            filename,
+            image_data,
+            {"content-type": content_type, "upsert": "true"}
+        )
+    except Exception as e:
+        logger.error(f"Error uploading screenshot {filename}: {e}")
+        return False
+
+    try:
+        await redis.set(key, "1", ex=UPLOADED_KEY_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to record screenshot upload {filename}: {e}")
+    logger.debug(f"Uploaded screenshot {filename}")
+    return True
+
+
+async def _public_url(filename: str) -> str:
+    client = await DBConnection().client
+    return await client.storage.from_(BUCKET_NAME).get_public_url(filename)
+
+
+def _start_upload(url: str, filename: str, image_data: bytes, content_type: str):
+    if _uploaded.get(url) or url in _pending:
+        return
+
+    task = asyncio.create_task(_upload(filename, image_data, content_type))
+    _pending[url] = task
+
+    def done(task: "asyncio.Task[bool]"):
+        _pending.pop(url, None)
+        _remember(_uploaded, url, not task.cancelled() and task.result())
+
+    task.add_done_callback(done)
+
+
+async def store(image_data: bytes, content_type: str = "image/jpeg") -> Dict[str, str]:
+    """Store a screenshot and return its screenshot_hash and image_url.
+
+    The upload runs in the background; use wait_until_uploaded() before
+    anything outside this process needs the image. The result also has an
+    llm_image_url when a downscaled copy for the model is configured.
+    """
+    screenshot_hash = content_hash(image_data)
+    filename = f"{screenshot_hash}.{EXTENSIONS.get(content_type, content_type.split('/')[-1])}"
+    image_url = await _public_url(filename)
+    _start_upload(image_url, filename, image_data, content_type)
+    result = {"screenshot_hash": screenshot_hash, "image_url": image_url}
+
+    max_width = config.BROWSER_SCREENSHOT_LLM_MAX_WIDTH
+    if max_width > 0:
+        image_format = config.BROWSER_SCREENSHOT_LLM_FORMAT.lower()
+        llm_filename = f"{screenshot_hash}_{max_width}.{image_format}"
+        llm_image_url = await _public_url(llm_filename)
+        try:
+            if not _uploaded.get(llm_image_url) and llm_image_url not in _pending:
+                llm_image_data = await asyncio.to_thread(_downscale, image_data, max_width, image_format)
+                _start_upload(llm_image_url, llm_filename, llm_image_data, f"image/{EXTENSIONS_MIME.get(image_format, image_format)}")
+            result["llm_image_url"] = llm_image_url
+        except Exception as e:
+            logger.warning(f"Failed to downscale screenshot {screenshot_hash}: {e}")
+
+    _remember(_stored, screenshot_hash, result)
+    return dict(result)
+
+
+async def _was_uploaded(url: str) -> bool:
+    """Check the upload record of a URL this process did not upload, e.g. after a worker restart."""
+    filename = url.split("?", 1)[0].rsplit("/", 1)[-1]
+    try:
+        return bool(await redis.get(f"{UPLOADED_KEY_PREFIX}{filename}"))
+    except Exception as e:
+        logger.warning(f"Failed to check screenshot upload {filename}: {e}")
+        return False
+
+
+async def wait_until_uploaded(url: str, timeout: float = 30) -> bool:
+    """Wait for the background upload of url, if any. Returns False if it failed or timed out.
+
+    URLs not uploaded by this process are checked against the upload records
+    in Redis, so an upload lost with the process that started it is reported
+    as failed.
+    """
+    task = _pending.get(url)
+    if task is None:
+        if url in _uploaded:
+            return _uploaded[url]
+        return await _was_uploaded(url)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out waiting for screenshot upload {url}")
+        return False
@@ -0,0 +1,83 @@
+BEGIN;
+
+-- Composite index so "latest message of type X in thread" lookups are index-only scans
+CREATE INDEX IF NOT EXISTS idx_messages_thread_type_created_at ON messages(thread_id, type, created_at DESC);
+
+-- Returns everything the agent loop needs at the start of an iteration in a single round-trip:
+-- the type of the latest conversational message, the latest browser_state and the latest image_context
+CREATE OR REPLACE FUNCTION get_agent_iteration_snapshot(
+    p_thread_id UUID
+)
+RETURNS JSONB
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    latest_message_type TEXT;
+    browser_state JSONB;
+    image_context JSONB;
+    has_access BOOLEAN;
+    current_role TEXT;
+    is_project_public BOOLEAN;
+BEGIN
+    -- Get current role
+    SELECT current_user INTO current_role;
+
+    -- Check if associated project is public
+    SELECT p.is_public INTO is_project_public
+    FROM threads t
+    LEFT JOIN projects p ON t.project_id = p.project_id
+    WHERE t.thread_id = p_thread_id;
+
+    -- Skip access check for service_role or public projects
+    IF current_role = 'authenticated' AND NOT COALESCE(is_project_public, false) THEN
+        -- Check if thread exists and user has access
+        SELECT EXISTS (
+            SELECT 1 FROM threads t
+            LEFT JOIN projects p ON t.project_id = p.project_id
+            WHERE t.thread_id = p_thread_id
+            AND (
+                basejump.has_role_on_account(t.account_id) = true OR
+                basejump.has_role_on_account(p.account_id) = true
+            )
+        ) INTO has_access;
+
+        IF NOT has_access THEN
+            RAISE EXCEPTION 'Thread not found or access denied';
+        END IF;
+    END IF;
+
+    SELECT m.type INTO latest_message_type
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.type IN ('assistant', 'tool', 'user')
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    SELECT jsonb_build_object('message_id', m.message_id, 'content', m.content) INTO browser_state
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.type = 'browser_state'
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    SELECT jsonb_build_object('message_id', m.message_id, 'content', m.content) INTO image_context
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.type = 'image_context'
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    RETURN jsonb_build_object(
+        'latest_message_type', latest_message_type,
+        'browser_state', browser_state,
+        'image_context', image_context
+    );
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION get_agent_iteration_snapshot TO authenticated, service_role;
+
+COMMENT ON FUNCTION get_agent_iteration_snapshot IS 'Returns the latest message type, browser state and image context for a thread in one call';
+
+COMMIT;
@@ -0,0 +1,108 @@
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- When an entry's content was last split into chunks and embedded (NULL = not indexed yet)
+ALTER TABLE agent_knowledge_base_entries
+ADD COLUMN IF NOT EXISTS indexed_at TIMESTAMPTZ;
+
+-- Embedded chunks of agent knowledge base entries, used to inject only the relevant parts of a knowledge base
+CREATE TABLE IF NOT EXISTS agent_knowledge_base_chunks (
+    chunk_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    entry_id UUID NOT NULL REFERENCES agent_knowledge_base_entries(entry_id) ON DELETE CASCADE,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    content_tokens INTEGER,
+    embedding vector(1536) NOT NULL,
+
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+
+    CONSTRAINT agent_kb_chunks_entry_index UNIQUE (entry_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_kb_chunks_agent_id ON agent_knowledge_base_chunks(agent_id);
+CREATE INDEX IF NOT EXISTS idx_agent_kb_chunks_embedding ON agent_knowledge_base_chunks
+    USING hnsw (embedding vector_cosine_ops);
+
+ALTER TABLE agent_knowledge_base_chunks ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY agent_kb_chunks_user_access ON agent_knowledge_base_chunks
+    FOR ALL
+    USING (
+        EXISTS (
+            SELECT 1 FROM agents a
+            WHERE a.agent_id = agent_knowledge_base_chunks.agent_id
+            AND basejump.has_role_on_account(a.account_id) = true
+        )
+    );
+
+-- Function to find the chunks of an agent's active knowledge base most similar to a query embedding.
+-- It bypasses row level security and does not check access to the agent, so only the backend may call it.
+CREATE OR REPLACE FUNCTION match_agent_knowledge_base_chunks(
+    p_agent_id UUID,
+    p_query_embedding vector(1536),
+    p_match_count INTEGER DEFAULT 8
+)
+RETURNS TABLE (
+    entry_id UUID,
+    entry_name VARCHAR(255),
+    entry_description TEXT,
+    chunk_index INTEGER,
+    content TEXT,
+    content_tokens INTEGER,
+    similarity DOUBLE PRECISION
+)
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        c.entry_id,
+        e.name,
+        e.description,
+        c.chunk_index,
+        c.content,
+        c.content_tokens,
+        1 - (c.embedding <=> p_query_embedding) AS similarity
+    FROM agent_knowledge_base_chunks c
+    JOIN agent_knowledge_base_entries e ON e.entry_id = c.entry_id
+    WHERE c.agent_id = p_agent_id
+    AND e.is_active = TRUE
+    AND e.usage_context IN ('always', 'contextual')
+    ORDER BY c.embedding <=> p_query_embedding
+    LIMIT p_match_count;
+END;
+$$;
+
+-- Entries need to be indexed again when their content or name changes. Recording that an entry
+-- was indexed is not an update of the entry, so it leaves updated_at alone.
+CREATE OR REPLACE FUNCTION update_agent_kb_entry_timestamp()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.indexed_at IS DISTINCT FROM OLD.indexed_at
+       AND (to_jsonb(NEW) - 'indexed_at') = (to_jsonb(OLD) - 'indexed_at') THEN
+        RETURN NEW;
+    END IF;
+
+    NEW.updated_at = NOW();
+    IF NEW.content != OLD.content THEN
+        NEW.content_tokens = LENGTH(NEW.content) / 4;
+    END IF;
+    IF NEW.content != OLD.content OR NEW.name != OLD.name THEN
+        NEW.indexed_at = NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+GRANT ALL PRIVILEGES ON TABLE agent_knowledge_base_chunks TO authenticated, service_role;
+REVOKE EXECUTE ON FUNCTION match_agent_knowledge_base_chunks FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION match_agent_knowledge_base_chunks TO service_role;
+
+COMMENT ON TABLE agent_knowledge_base_chunks IS 'Embedded chunks of agent knowledge base entries for retrieval';
+COMMENT ON FUNCTION match_agent_knowledge_base_chunks IS 'Finds the agent knowledge base chunks most similar to a query embedding';
+
+COMMIT;
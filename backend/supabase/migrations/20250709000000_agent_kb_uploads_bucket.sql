@@ -0,0 +1,9 @@
+BEGIN;
+
+-- Uploaded knowledge base files waiting to be processed by the workers. Only the
+-- backend (service role) reads and writes here; files are removed once processed.
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('knowledge-base-uploads', 'knowledge-base-uploads', false)
+ON CONFLICT (id) DO NOTHING; -- Avoid error if bucket already exists
+
+COMMIT;
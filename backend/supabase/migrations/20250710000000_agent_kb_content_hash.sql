@@ -0,0 +1,7 @@
+BEGIN;
+
+-- Uploads are skipped when the agent already has a file with the same content
+CREATE INDEX IF NOT EXISTS idx_agent_kb_entries_content_hash
+    ON agent_knowledge_base_entries(agent_id, (source_metadata->>'content_hash'));
+
+COMMIT;
@@ -0,0 +1,33 @@
+import sys
+import os
+import zipfile
+
+# Add the backend directory to the path (go up one level from tests/)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from knowledge_base.file_processor import _extract_in_worker, content_hash
+
+
+def test_file_too_large_is_not_read(tmp_path):
+    path = tmp_path / 'large.txt'
+    path.write_bytes(b'x' * 100)
+    assert _extract_in_worker(str(path), 'large.txt', 'text/plain', 10) == (None, 100, None)
+
+
+def test_zip_member_too_large_is_not_read(tmp_path):
+    zip_path = tmp_path / 'archive.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+        zip_ref.writestr('docs/large.txt', 'x' * 100)
+    source = (str(zip_path), 'docs/large.txt')
+    assert _extract_in_worker(source, 'large.txt', 'text/plain', 10) == (None, 100, None)
+
+
+def test_file_is_extracted_with_its_hash(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(b'hello')
+    assert _extract_in_worker(str(path), 'notes.txt', 'text/plain', 10) == ('hello', 5, content_hash(b'hello'))
+
+
+def test_unchanged_file_is_not_extracted():
+    file_hash = content_hash(b'hello')
+    assert _extract_in_worker(b'hello', 'notes.txt', 'text/plain', 10, file_hash) == (None, 5, file_hash)
@@ -0,0 +1,80 @@
+import random
+import sys
+import os
+
+# Add the backend directory to the path (go up one level from tests/)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+from agentpress.xml_tool_parser import StreamingXMLChunkExtractor, extract_xml_chunks
+
+LEGACY_TAGS = ['ask', 'web-search']
+
+FUNCTION_CALLS_BLOCK = '<function_calls><invoke name="x"></invoke></function_calls>'
+
+
+def stream(text, chunk_sizes, legacy_tags=LEGACY_TAGS):
+    """Feed text to a streaming extractor in chunks of the given sizes and collect every block."""
+    extractor = StreamingXMLChunkExtractor(legacy_tags)
+    chunks = []
+    pos = 0
+    sizes = iter(chunk_sizes)
+    while pos < len(text):
+        size = next(sizes, len(text) - pos)
+        chunks.extend(extractor.feed(text[pos:pos + size]))
+        pos += size
+    chunks.extend(extractor.finish())
+    return chunks
+
+
+CASES = [
+    # Unclosed legacy opener before a function_calls block
+    'I will use the <ask tool later.\n' + FUNCTION_CALLS_BLOCK,
+    # Complete legacy block before a function_calls block
+    '<ask>question</ask>\n' + FUNCTION_CALLS_BLOCK,
+    # Legacy blocks only, including nesting
+    'text <web-search query="a"></web-search> and <ask><ask>inner</ask></ask>',
+    # Two function_calls blocks and an unfinished third one
+    FUNCTION_CALLS_BLOCK + ' between ' + FUNCTION_CALLS_BLOCK + '<function_calls><invoke',
+    # Nothing to extract
+    'plain text with < and > and </function_calls>',
+]
+
+
+@pytest.mark.parametrize('text', CASES)
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1000])
+def test_stream_matches_full_text_extraction(text, chunk_size):
+    sizes = [chunk_size] * len(text)
+    assert stream(text, sizes) == extract_xml_chunks(text, LEGACY_TAGS)
+
+
+def test_unclosed_legacy_opener_does_not_hide_function_calls():
+    text = 'I will use the <ask tool later.\n' + FUNCTION_CALLS_BLOCK
+    assert stream(text, [len(text)]) == [FUNCTION_CALLS_BLOCK]
+
+
+def test_function_calls_blocks_are_returned_while_streaming():
+    extractor = StreamingXMLChunkExtractor(LEGACY_TAGS)
+    assert extractor.feed('<ask>q</ask> ' + FUNCTION_CALLS_BLOCK[:20]) == []
+    assert extractor.feed(FUNCTION_CALLS_BLOCK[20:]) == [FUNCTION_CALLS_BLOCK]
+    assert extractor.finish() == []
+
+
+def test_legacy_blocks_are_returned_on_finish():
+    extractor = StreamingXMLChunkExtractor(LEGACY_TAGS)
+    assert extractor.feed('<ask>q</ask>') == []
+    assert extractor.finish() == ['<ask>q</ask>']
+
+
+def test_random_streams_match_full_text_extraction():
+    tokens = [
+        '<function_calls>', '</function_calls>', '<invoke name="x">', '</invoke>',
+        '<ask', '<ask>', '</ask>', '<web-search>', '</web-search>',
+        'text ', '<', '>', '</', '<function', '_calls>', '\n',
+    ]
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = ''.join(rng.choice(tokens) for _ in range(rng.randint(0, 30)))
+        sizes = [rng.randint(1, 20) for _ in range(len(text))]
+        assert stream(text, sizes) == extract_xml_chunks(text, LEGACY_TAGS), text
@@ -196,11 +196,39 @@ class Configuration:
     REDIS_PORT: int = 6379
     REDIS_PASSWORD: Optional[str] = None
     REDIS_SSL: bool = True
-    
+
+    # Agent run response transport: "list" (RPUSH + PUBLISH) or "stream" (Redis Streams)
+    AGENT_RESPONSE_TRANSPORT: str = "list"
+    # Responses are buffered and written in batches of up to this many, or after this delay
+    AGENT_RESPONSE_BATCH_SIZE: int = 20
+    AGENT_RESPONSE_BATCH_DELAY_MS: int = 50
+    # How run responses are stored in agent_runs.responses when a run ends:
+    # "full", "compacted" (streamed chunks merged), "compressed" (compacted, gzipped) or "none"
+    AGENT_RUN_RESPONSES_STORAGE: str = "compacted"
+
+    # Pooled MCP client sessions: closed after this many idle seconds, pinged at this interval while idle
+    MCP_SESSION_IDLE_TTL: int = 300
+    MCP_SESSION_KEEPALIVE_INTERVAL: int = 30
+    MCP_SESSION_POOL_MAX_SIZE: int = 64
+    # Per-server timeout for MCP tool discovery at agent start, and how long discovered tool lists are cached
+    MCP_DISCOVERY_TIMEOUT: int = 20
+    MCP_TOOL_CATALOG_TTL: int = 3600
+
     # Daytona sandbox configuration
     DAYTONA_API_KEY: str
     DAYTONA_SERVER_URL: str
     DAYTONA_TARGET: str
+    # How long tools in a process reuse a project's resolved sandbox before looking it up again
+    SANDBOX_HANDLE_TTL: int = 300
+    # Width of the downscaled copy of browser screenshots shown to the model (0 sends the original),
+    # and its image format
+    BROWSER_SCREENSHOT_LLM_MAX_WIDTH: int = 0
+    BROWSER_SCREENSHOT_LLM_FORMAT: str = "webp"
+    # Image tools: processes that compress images, how many jobs may wait for them per worker,
+    # and how many bytes of compressed images are kept for reuse
+    IMAGE_PROCESS_WORKERS: int = 2
+    IMAGE_PROCESS_MAX_PENDING: int = 16
+    IMAGE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
     
     # Search and other API keys
     TAVILY_API_KEY: str
@@ -208,7 +236,28 @@ class Configuration:
     CLOUDFLARE_API_TOKEN: Optional[str] = None
     FIRECRAWL_API_KEY: str
     FIRECRAWL_URL: Optional[str] = "https://api.firecrawl.dev"
-    
+    # Concurrent Firecrawl scrapes per process, and how long scraped pages and search results are cached
+    WEB_SCRAPE_MAX_CONCURRENCY: int = 8
+    WEB_SCRAPE_CACHE_TTL: int = 3600
+    WEB_SEARCH_CACHE_TTL: int = 900
+
+    # Agent knowledge base retrieval: entries are split into chunks of about KB_CHUNK_TOKENS tokens
+    # (overlapping by KB_CHUNK_OVERLAP_TOKENS) and embedded with KB_EMBEDDING_MODEL, which must produce
+    # 1536-dimensional vectors. Runs get the KB_RETRIEVAL_TOP_K chunks closest to the latest user message.
+    KB_EMBEDDING_MODEL: str = "text-embedding-3-small"
+    KB_CHUNK_TOKENS: int = 400
+    KB_CHUNK_OVERLAP_TOKENS: int = 50
+    KB_RETRIEVAL_TOP_K: int = 8
+    # Processes that extract text from knowledge base files, and how many files one upload or
+    # repository import extracts at a time
+    KB_EXTRACTION_WORKERS: int = 2
+    KB_EXTRACTION_CONCURRENCY: int = 8
+    # Knowledge base uploads an account can have processed by the workers at the same time
+    KB_INGEST_MAX_CONCURRENT_PER_ACCOUNT: int = 2
+    # Assembled knowledge base contexts: how long they are cached, and how many each process keeps in memory
+    KB_CONTEXT_CACHE_TTL: int = 3600
+    KB_CONTEXT_CACHE_MAX_ENTRIES: int = 256
+
     # Stripe configuration
     STRIPE_SECRET_KEY: Optional[str] = None
     STRIPE_WEBHOOK_SECRET: Optional[str] = None
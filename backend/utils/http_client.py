@@ -0,0 +1,70 @@
+"""
+Pooled httpx clients shared across a process.
+
+An httpx.AsyncClient and its connections belong to the event loop they were
+created on, and dramatiq workers may run more than one loop over a process'
+lifetime. SharedHTTPClient creates the client for the running loop and closes
+the one it replaces, so connections of an old loop are not leaked.
+"""
+
+import asyncio
+from typing import Any, Optional, Set
+
+import httpx
+
+from utils.logger import logger
+
+# Replaced clients being closed
+_closing: Set["asyncio.Future[None]"] = set()
+
+
+async def _aclose(client: httpx.AsyncClient):
+    try:
+        await client.aclose()
+    except Exception as e:
+        # Connections of a loop that is already closed cannot be shut down cleanly
+        logger.debug(f"Failed to close replaced HTTP client: {e}")
+
+
+def _close_replaced(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]):
+    if loop is not None and loop.is_running():
+        # The loop runs in another thread, so close the client there
+        future = asyncio.run_coroutine_threadsafe(_aclose(client), loop)
+    else:
+        future = asyncio.ensure_future(_aclose(client))
+    _closing.add(future)
+    future.add_done_callback(_closing.discard)
+
+
+class SharedHTTPClient:
+    """An httpx.AsyncClient for the running event loop, created on first use."""
+
+    def __init__(self, **client_kwargs: Any):
+        """
+        Args:
+            client_kwargs: Arguments for httpx.AsyncClient (timeout, limits, ...)
+        """
+        self._client_kwargs = client_kwargs
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def ensure(self) -> bool:
+        """Create the client for the running event loop if needed.
+
+        Returns:
+            True if a new client was created, in which case any other state the
+            caller keeps per loop (semaphores, in-flight requests) is stale too
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is not None and not self._client.is_closed and self._loop is loop:
+            return False
+        if self._client is not None and not self._client.is_closed:
+            _close_replaced(self._client, self._loop)
+        self._client = httpx.AsyncClient(**self._client_kwargs)
+        self._loop = loop
+        return True
+
+    def client(self) -> httpx.AsyncClient:
+        """Get the client for the running event loop."""
+        self.ensure()
+        return self._client
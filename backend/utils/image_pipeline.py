@@ -0,0 +1,190 @@
+"""
+Shared image pipeline for the image tools.
+
+Decoding, resizing and re-encoding images with PIL takes hundreds of
+milliseconds for large images, which used to block every agent run on the
+worker's event loop. This module runs that work in a small process pool
+(IMAGE_PROCESS_WORKERS), lets at most IMAGE_PROCESS_MAX_PENDING jobs queue for
+it per process (further callers wait for a slot), and keeps the results in an
+LRU cache keyed by content hash and target size (IMAGE_CACHE_MAX_BYTES), so the
+same image is only compressed once.
+
+Image downloads share one connection pool and stream the body, stopping as
+soon as an image is larger than allowed.
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from utils.config import config
+from utils.http_client import SharedHTTPClient
+from utils.logger import logger
+
+DOWNLOAD_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+POOL_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=10, keepalive_expiry=60)
+# Some servers block the default user agents of HTTP libraries
+DOWNLOAD_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+_http_client = SharedHTTPClient(timeout=DOWNLOAD_TIMEOUT, limits=POOL_LIMITS, follow_redirects=True)
+_pending_slots: Optional[asyncio.Semaphore] = None
+
+# (content hash, mime type, max width, max height) -> (image bytes, mime type)
+_cache: "OrderedDict[Tuple[str, str, int, int], Tuple[bytes, str]]" = OrderedDict()
+_cache_size = 0
+
+
+class ImageTooLargeError(Exception):
+    pass
+
+
+def _check_loop():
+    """Create the shared HTTP client and queue slots for the running event loop if needed."""
+    global _pending_slots
+    if _http_client.ensure():
+        _pending_slots = asyncio.Semaphore(max(1, config.IMAGE_PROCESS_MAX_PENDING))
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Workers run threads and event loops, which are not safe to fork
+        _executor = ProcessPoolExecutor(
+            max_workers=max(1, config.IMAGE_PROCESS_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def _compress_image(image_bytes: bytes, mime_type: str, max_width: int, max_height: int) -> Tuple[bytes, str, Optional[Tuple[int, int]]]:
+    """Resize an image to fit max_width x max_height and re-encode it. Runs in the process pool.
+
+    GIFs stay GIFs and PNGs stay PNGs; everything else becomes JPEG. Returns
+    the new bytes, their MIME type and the original size if the image was resized.
+    """
+    from PIL import Image
+
+    img = Image.open(BytesIO(image_bytes))
+
+    # Convert RGBA to RGB if necessary (for JPEG)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Create a white background
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        img = background
+
+    # Calculate new dimensions while maintaining aspect ratio
+    resized_from = None
+    width, height = img.size
+    if width > max_width or height > max_height:
+        ratio = min(max_width / width, max_height / height)
+        img = img.resize((int(width * ratio), int(height * ratio)), Image.Resampling.LANCZOS)
+        resized_from = (width, height)
+
+    output = BytesIO()
+    if mime_type == 'image/gif':
+        img.save(output, format='GIF', optimize=True)
+        output_mime = 'image/gif'
+    elif mime_type == 'image/png':
+        img.save(output, format='PNG', optimize=True, compress_level=DEFAULT_PNG_COMPRESS_LEVEL)
+        output_mime = 'image/png'
+    else:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(output, format='JPEG', quality=DEFAULT_JPEG_QUALITY, optimize=True)
+        output_mime = 'image/jpeg'
+
+    return output.getvalue(), output_mime, resized_from
+
+
+async def _run(func, *args):
+    """Run func(*args) in the process pool, waiting for a queue slot first."""
+    global _executor
+    _check_loop()
+    async with _pending_slots:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(_get_executor(), func, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a new pool next time and run this job here
+            logger.warning("Image process pool broke, restarting it")
+            _executor = None
+            return await asyncio.to_thread(func, *args)
+
+
+def _cache_get(key) -> Optional[Tuple[bytes, str]]:
+    result = _cache.get(key)
+    if result is not None:
+        _cache.move_to_end(key)
+    return result
+
+
+def _cache_put(key, result: Tuple[bytes, str]):
+    global _cache_size
+    if key in _cache:
+        return
+    size = len(result[0])
+    if size > config.IMAGE_CACHE_MAX_BYTES:
+        return
+    _cache[key] = result
+    _cache_size += size
+    while _cache_size > config.IMAGE_CACHE_MAX_BYTES:
+        _, (evicted, _) = _cache.popitem(last=False)
+        _cache_size -= len(evicted)
+
+
+async def compress_image(image_bytes: bytes, mime_type: str, max_width: int, max_height: int) -> Tuple[bytes, str]:
+    """Resize and re-encode an image off the event loop. Returns (compressed_bytes, new_mime_type).
+
+    Raises whatever PIL raises for images it cannot process.
+    """
+    key = (hashlib.sha256(image_bytes).hexdigest(), mime_type, max_width, max_height)
+    cached = _cache_get(key)
+    if cached is not None:
+        logger.debug(f"Using cached compressed image {key[0][:16]} ({max_width}x{max_height})")
+        return cached
+
+    compressed_bytes, output_mime, resized_from = await _run(_compress_image, image_bytes, mime_type, max_width, max_height)
+    if resized_from:
+        logger.debug(f"Resized image {key[0][:16]} from {resized_from[0]}x{resized_from[1]} to fit {max_width}x{max_height}")
+    _cache_put(key, (compressed_bytes, output_mime))
+    return compressed_bytes, output_mime
+
+
+async def download_image(url: str, max_size: int) -> Tuple[bytes, Optional[str]]:
+    """Download an image and return its bytes and Content-Type.
+
+    Raises ImageTooLargeError as soon as the image turns out to be larger than
+    max_size bytes, and httpx errors for failed requests.
+    """
+    _check_loop()
+    async with _http_client.client().stream("GET", url, headers=DOWNLOAD_HEADERS) as response:
+        response.raise_for_status()
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_size:
+            raise ImageTooLargeError(f"Image is too large ({int(content_length)/(1024*1024):.2f}MB) for the maximum allowed size of {max_size/(1024*1024):.2f}MB")
+
+        chunks = []
+        received = 0
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+            if received > max_size:
+                raise ImageTooLargeError(f"Downloaded image is too large (over {max_size/(1024*1024):.2f}MB)")
+            chunks.append(chunk)
+
+        return b"".join(chunks), response.headers.get('Content-Type')